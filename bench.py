@@ -0,0 +1,967 @@
+"""Headless benchmarks. Run `python bench.py <name>`; see --help for the list.
+
+`python bench.py --suite --json results.json --baseline bench_baseline.json`
+runs the regression suite, writes what it measured and flags any metric
+more than --tolerance worse than the baseline, exiting with status 1."""
+from __future__ import division
+import sys, os, math, random, time, tracemalloc, tempfile, shutil, pickle, json, platform
+from collections import OrderedDict
+
+import numpy as np
+
+from world import TICKS_PER_SEC, GRASS, STONE, normalize, sectorize, chunk_array, World
+from terrain import HillsGenerator
+from region import RegionStore
+from meshcache import MeshCache, mesh_key
+from frustum import Frustum, sector_box, sector_ring, view_range
+from mesher import MESHERS, snapshot_sector
+from meshpool import MeshWorkerPool
+from bullets import PLAYER, BulletPool
+from spatial import SpatialHash
+from raycast import raycast_batch
+from simulation import Enemy, Simulation
+from profiler import Profiler, EventLog
+from swarm import EnemySwarm
+from pathfinding import FlowField
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+BENCHMARKS = {}
+
+# The benchmarks run by --suite, whose recorded metrics are compared
+# against a baseline.
+SUITE = ('world_build', 'streaming', 'hit_test', 'collide', 'combat', 'server',
+         'line_of_sight')
+
+# benchmark name -> metric -> {'value', 'unit', 'better'}, filled by record().
+RESULTS = OrderedDict()
+running = None
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+def record(metric, value, unit, better='lower'):
+    """Keep one number from the running benchmark for --json and
+       --baseline. better is 'lower' for times and 'higher' for rates."""
+    RESULTS.setdefault(running, OrderedDict())[metric] = OrderedDict(
+        [('value', float(value)), ('unit', unit), ('better', better)])
+
+def best_of(repeat, func):
+    """The fastest of repeat timed calls of func(), in seconds."""
+    best = None
+    for _ in xrange(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def measure(build):
+    """Run build() and return (result, bytes allocated and still held, seconds)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+def dict_world(n):
+    """The storage the chunk arrays replaced: a dict of position tuples to
+       texture lists plus a per-sector list of the same tuples."""
+    world = {}
+    sectors = {}
+    def add_block(position, texture):
+        world[position] = texture
+        sectors.setdefault(sectorize(position), []).append(position)
+    y = 0
+    for x in xrange(-n, n + 1):
+        for z in xrange(-n, n + 1):
+            add_block((x, y - 2, z), GRASS)
+            add_block((x, y - 3, z), STONE)
+            if x in (-n, n) or z in (-n, n):
+                for dy in xrange(-2, 3):
+                    add_block((x, y + dy, z), STONE)
+    return world, sectors
+
+@benchmark
+def memory(size=256):
+    """Block storage footprint of a (2 * size + 1)^2 map, dict vs chunks."""
+    _, before, before_time = measure(lambda: dict_world(size))
+    world, after, after_time = measure(lambda: arena(size))
+    print('%dx%d map, %d blocks' % (2 * size + 1, 2 * size + 1, len(world.world)))
+    print('  dict of tuples: %7.1f MB  built in %.2fs' % (before / 2**20, before_time))
+    print('  chunk arrays:   %7.1f MB  built in %.2fs' % (after / 2**20, after_time))
+    print('  reduction:      %7.1fx' % (before / after))
+
+@benchmark
+def quads(size=80):
+    """Quads and vertices submitted for the default map: whole cubes per
+       exposed block versus per-sector meshes from each mesher."""
+    world = arena(size)
+    exposed = sum(1 for position in world.world if world.exposed(position))
+    snapshots = [snapshot_sector(world.world, sector) for sector in world.sectors]
+    print('%d sectors, %d exposed blocks' % (len(snapshots), exposed))
+    print('  %-16s %8d quads %9d vertices in %d vertex lists' % (
+        'per-block cubes', exposed * 6, exposed * 24, exposed))
+    for name in sorted(MESHERS):
+        start = time.perf_counter()
+        meshes = [MESHERS[name](snapshot) for snapshot in snapshots]
+        elapsed = time.perf_counter() - start
+        lists = sum(len(mesh.parts) for mesh in meshes)
+        print('  %-16s %8d quads %9d vertices in %d vertex lists, %.1f ms/sector' % (
+            name, sum(mesh.quads for mesh in meshes),
+            sum(mesh.vertex_count for mesh in meshes), lists,
+            1000 * elapsed / len(meshes)))
+
+@benchmark
+def transition(size=80):
+    """Main-thread work when the player crosses a sector border: snapshot
+       and mesh every sector that comes into view, walking 8 sectors east.
+       Then the cost of placing and removing single blocks on the map."""
+    world = arena(size)
+    for name in sorted(MESHERS):
+        shown = 0
+        start = time.perf_counter()
+        for x in xrange(-4, 4):
+            for sector in sector_ring((x + 1, 0, 0), 4) - sector_ring((x, 0, 0), 4):
+                MESHERS[name](snapshot_sector(world.world, sector))
+                shown += 1
+        elapsed = time.perf_counter() - start
+        print('  %-8s %d sectors shown over 8 transitions, %.1f ms per transition' % (
+            name, shown, 1000 * elapsed / 8))
+    rng = random.Random(0)
+    positions = [(rng.randint(-size + 1, size - 1), rng.randint(-1, 4), rng.randint(-size + 1, size - 1))
+                 for _ in xrange(10000)]
+    start = time.perf_counter()
+    for position in positions:
+        world.add_block(position, STONE)
+        del world.world[position]
+    elapsed = time.perf_counter() - start
+    print('  %d block add/remove pairs: %.2f us per pair' % (len(positions), 1e6 * elapsed / len(positions)))
+
+@benchmark
+def regions(size=64):
+    """Building and tearing down a walled arena floor of (2 * size + 1)^2 x 3
+       blocks: add_block/remove_block one at a time versus the region
+       edits, with the number of sectors each leaves to re-mesh."""
+    cells = [(x, y, z) for x in xrange(-size, size + 1)
+             for y in xrange(0, 3) for z in xrange(-size, size + 1)]
+    world = World(0)
+    start = time.perf_counter()
+    touched = set()
+    for position in cells:
+        world.add_block(position, STONE)
+        touched.add(sectorize(position))
+    for position in cells:
+        world.remove_block(position)
+    single = time.perf_counter() - start
+    print('%d blocks' % len(cells))
+    print('  one at a time: %8.1f ms, a rebuild per block edit (%d sectors)' % (
+        1000 * single, len(touched)))
+    start = time.perf_counter()
+    touched = world.fill_region((-size, 0, -size), (size, 2, size), STONE)
+    touched |= world.replace_region((-size, 2, -size), (size, 2, size), STONE, GRASS)
+    touched |= world.clear_region((-size, 0, -size), (size, 2, size))
+    bulk = time.perf_counter() - start
+    print('  regions:       %8.1f ms, %d sectors to rebuild once (%.0fx)' % (
+        1000 * bulk, len(touched), single / bulk))
+
+@benchmark
+def startup():
+    """Time until the sectors around the player exist: loading whole flat
+       arenas up front versus generating on demand, then memory held while
+       walking 4000 blocks across endless hills with the default LRU bound."""
+    for size in (80, 256):
+        world, held, elapsed = measure(lambda: arena(size))
+        print('  arena %4d, all loaded:  %7.1f ms, %4d sectors, %6.1f MB' % (
+            size, 1000 * elapsed, len(world.sectors), held / 2**20))
+    for size in (80, 256, 100000):
+        def lazy():
+            world = World(size)
+            world.load_around((0, 0, 0))
+            return world
+        world, held, elapsed = measure(lazy)
+        print('  arena %6d, on demand: %7.1f ms, %4d sectors, %6.1f MB' % (
+            size, 1000 * elapsed, len(world.sectors), held / 2**20))
+    world = World(generator=HillsGenerator(0))
+    start = time.perf_counter()
+    peak = 0
+    for x in xrange(0, 4000, 4):
+        world.load_around((x, 0, 0))
+        peak = max(peak, len(world.sectors))
+    elapsed = time.perf_counter() - start
+    print('  hills walk: %d sector crossings, %.1f ms each, at most %d loaded (bound %d)' % (
+        4000 // 16, 1000 * elapsed / (4000 // 16), peak, world.max_sectors))
+
+def same_blocks(a, b):
+    """Whether two worlds have the same sectors holding the same blocks and masks."""
+    if set(a.sectors) != set(b.sectors):
+        return False
+    return all(a.sectors[s].blocks == b.sectors[s].blocks and
+               a.world.masks_of(a.sectors[s]) == b.world.masks_of(b.sectors[s])
+               for s in a.sectors)
+
+@benchmark
+def region(size=512):
+    """Region files: load a (2 * size + 1)^2 map from region files, against
+       generating it and unpickling the chunk arrays. tests/test_region.py
+       checks the round trip."""
+    directory = tempfile.mkdtemp()
+    try:
+        world = arena(size)
+        store = RegionStore(os.path.join(directory, 'big'))
+        start = time.perf_counter()
+        for chunk in world.sectors.values():
+            store.save(chunk, world.world.masks_of(chunk, keep=False))
+        store.close()
+        save_time = time.perf_counter() - start
+        disk = sum(os.path.getsize(os.path.join(directory, 'big', name))
+                   for name in os.listdir(os.path.join(directory, 'big')))
+        pickled = pickle.dumps(dict((sector, bytes(chunk.blocks))
+                                    for sector, chunk in world.sectors.items()))
+        print('  %dx%d map, %d sectors: saved in %.2fs, %.1f MB on disk' % (
+            2 * size + 1, 2 * size + 1, len(world.sectors), save_time, disk / 2**20))
+
+        def generated():
+            world = World(size)
+            world.load_all()
+            return world
+        def mapped():
+            world = World(size, store=RegionStore(os.path.join(directory, 'big')))
+            world.load_all()
+            return world
+        def unpickled():
+            world = World(size)
+            for sector, blocks in pickle.loads(pickled).items():
+                world.world.load_chunk(sector, chunk_array(blocks))
+            return world
+        for name, load in (('generate', generated), ('region mmap', mapped),
+                           ('unpickle', unpickled)):
+            start = time.perf_counter()
+            loaded = load()
+            elapsed = time.perf_counter() - start
+            assert same_blocks(world, loaded)
+            print('  %-12s %7.2fs, %.0f us per sector' % (
+                name, elapsed, 1e6 * elapsed / len(loaded.sectors)))
+            if loaded.store is not None:
+                loaded.store.close()
+    finally:
+        shutil.rmtree(directory)
+
+@benchmark
+def mesh_cache(size=80):
+    """Getting a mesh for every sector of the map the way Model does:
+       snapshot, hash, look up, and build and store on a miss. Cold is an
+       empty cache; warm from memory is the same cache again; warm from
+       disk is a new cache over the same directory, as on the next launch."""
+    world = arena(size)
+    sectors = list(world.sectors)
+    directory = tempfile.mkdtemp()
+    try:
+        for name in sorted(MESHERS):
+            def lookup(label, cache):
+                before = cache.stats()
+                start = time.perf_counter()
+                for sector in sectors:
+                    snapshot = snapshot_sector(world.world, sector)
+                    key = mesh_key(snapshot, name)
+                    if cache.get(key, sector) is None:
+                        cache.put(key, MESHERS[name](snapshot))
+                elapsed = time.perf_counter() - start
+                after = cache.stats()
+                print('    %-13s %7.1f ms, %.2f ms per sector, %d memory hits, %d disk hits, '
+                      '%d misses' % (label, 1000 * elapsed, 1000 * elapsed / len(sectors),
+                      after['memory_hits'] - before['memory_hits'],
+                      after['disk_hits'] - before['disk_hits'], after['misses'] - before['misses']))
+            print('  %s, %d sectors:' % (name, len(sectors)))
+            path = os.path.join(directory, name)
+            cache = MeshCache(path)
+            lookup('cold', cache)
+            lookup('warm, memory', cache)
+            lookup('warm, disk', MeshCache(path))
+    finally:
+        shutil.rmtree(directory)
+
+@benchmark
+def culling(frames=360):
+    """Frustum culling of shown sectors: turning a full circle at head
+       height, the share of sectors submitted and the cost per frame at
+       several view distances. tests/test_frustum.py checks known poses."""
+    aspect = 4 / 3
+    for view_distance in (4, 8, 16):
+        sectors = sorted(sector_ring((0, 0, 0), view_distance))
+        boxes = [sector_box(sector) for sector in sectors]
+        submitted = 0
+        start = time.perf_counter()
+        for i in xrange(frames):
+            frustum = Frustum.from_camera((8, 0, 8), (i * 360 / frames, -10), aspect,
+                                          view_range(view_distance))
+            submitted += frustum.visible(boxes).sum()
+        elapsed = time.perf_counter() - start
+        print('  view distance %2d: %3d sectors shown, %5.1f submitted per frame (%2.0f%%), '
+              '%.3f ms per frame' % (view_distance, len(sectors), submitted / frames,
+              100 * submitted / frames / len(sectors), 1000 * elapsed / frames))
+
+@benchmark
+def mesh_pool(size=80):
+    """Main-thread cost of showing every sector of the map: meshing inline
+       versus snapshotting for a MeshWorkerPool and collecting results."""
+    world = arena(size)
+    sectors = list(world.sectors)
+    start = time.perf_counter()
+    for sector in sectors:
+        MESHERS['culled'](snapshot_sector(world.world, sector))
+    inline = time.perf_counter() - start
+    print('%d sectors' % len(sectors))
+    print('  inline:  %.1f ms on the main thread' % (1000 * inline))
+    for processes in (False, True):
+        pool = MeshWorkerPool(processes=processes)
+        start = time.perf_counter()
+        for sector in sectors:
+            pool.submit(snapshot_sector(world.world, sector))
+        submitted = time.perf_counter() - start
+        pool.wait()
+        meshes = list(pool.completed())
+        wall = time.perf_counter() - start
+        stats = pool.stats()
+        pool.shutdown()
+        assert len(meshes) == len(sectors)
+        print('  %-8s %.1f ms on the main thread to submit, %.1f ms until all built, '
+              'build %.1f ms mean / %.1f ms max' % (
+                  'process:' if processes else 'thread:', 1000 * submitted, 1000 * wall,
+                  stats['build_ms_mean'], stats['build_ms_max']))
+
+def arena(size=80):
+    """The flat arena with every sector loaded up front."""
+    world = World(size)
+    world.load_all()
+    return world
+
+def scatter(rng, count, extent):
+    return [(rng.uniform(-extent, extent), rng.uniform(-1, 2), rng.uniform(-extent, extent))
+            for _ in xrange(count)]
+
+def list_bullet_tick(bullets, enemy_aabbs, dt):
+    """The per-object loop BulletPool replaced, minus the printing."""
+    for bullet in bullets[:]:
+        position, direction, speed, owner = bullet[:4]
+        bullet[0] = position = tuple(p + d * speed * dt for p, d in zip(position, direction))
+        bullet[4] += dt
+        if bullet[4] > 3.0:
+            bullets.remove(bullet)
+            continue
+        if owner == PLAYER:
+            x, y, z = position
+            for aabb in enemy_aabbs:
+                if aabb[0] <= x <= aabb[3] and aabb[1] <= y <= aabb[4] and aabb[2] <= z <= aabb[5]:
+                    bullets.remove(bullet)
+                    break
+
+@benchmark
+def bullets(enemies=300, ticks=60):
+    """Per-tick cost of moving bullets and testing player bullets against
+       every enemy: Python objects in a list versus BulletPool."""
+    rng = random.Random(0)
+    extent = 80
+    enemy_aabbs = [(x - 0.5, y, z - 0.5, x + 0.5, y + 2, z + 0.5)
+                   for x, y, z in scatter(rng, enemies, extent)]
+    player_aabb = (-0.5, 0, 4.5, 0.5, 2, 5.5)
+    dt = 1.0 / 60
+    print('%d enemies, %d ticks' % (enemies, ticks))
+    for count in (100, 1000, 10000):
+        positions = scatter(rng, count, extent)
+        directions = [(rng.uniform(-1, 1), rng.uniform(-0.1, 0.1), rng.uniform(-1, 1))
+                      for _ in xrange(count)]
+        owners = [PLAYER if i % 2 else i for i in xrange(count)]
+
+        objects = []
+        for p, d, o in zip(positions, directions, owners):
+            length = math.sqrt(sum(c * c for c in d))
+            objects.append([p, tuple(c / length for c in d), 30, o, 0.0])
+        start = time.perf_counter()
+        for _ in xrange(ticks):
+            list_bullet_tick(objects, enemy_aabbs, dt)
+        before = (time.perf_counter() - start) / ticks
+
+        index = SpatialHash()
+        for id, aabb in enumerate(enemy_aabbs):
+            index.insert(id, aabb)
+        pool = BulletPool()
+        pool.spawn_many(positions, directions, 30, owners)
+        start = time.perf_counter()
+        for _ in xrange(ticks):
+            pool.update(dt, index, player_aabb)
+        after = (time.perf_counter() - start) / ticks
+        print('  %6d bullets: list %8.2f ms/tick, pool %6.2f ms/tick (%.0fx)' % (
+            count, 1000 * before, 1000 * after, before / after))
+
+@benchmark
+def broadphase(ticks=10):
+    """Scaling of the enemy SpatialHash at constant density: per tick, move
+       every enemy a little and resolve all bullets against the index."""
+    rng = random.Random(0)
+    dt = 1.0 / 60
+    player_aabb = (-0.5, 0, -0.5, 0.5, 2, 0.5)
+    print('%d ticks, 1 enemy and 5 bullets per 16 square blocks' % ticks)
+    for enemies in (100, 1000, 10000):
+        count = enemies * 5
+        extent = 2 * math.sqrt(enemies)
+        centres = scatter(rng, enemies, extent)
+        index = SpatialHash()
+        for id, (x, y, z) in enumerate(centres):
+            index.insert(id, (x - 0.5, y, z - 0.5, x + 0.5, y + 2, z + 0.5))
+        pool = BulletPool()
+        pool.spawn_many(scatter(rng, count, extent),
+                        [(rng.uniform(-1, 1), 0, rng.uniform(-1, 1)) for _ in xrange(count)],
+                        30, PLAYER)
+        hits = 0
+        move = 0.0
+        start = time.perf_counter()
+        for tick in xrange(ticks):
+            step = 0.05 if tick % 2 else -0.05
+            t = time.perf_counter()
+            for id, (x, y, z) in enumerate(centres):
+                x += step
+                index.move(id, (x - 0.5, y, z - 0.5, x + 0.5, y + 2, z + 0.5))
+            move += time.perf_counter() - t
+            hits += len(pool.update(dt, index, player_aabb)[0])
+        elapsed = (time.perf_counter() - start) / ticks
+        print('  %5d enemies %6d bullets: %7.2f ms/tick (%.2f ms moving enemies), '
+              '%.2f us per entity, %d hits' % (
+                  enemies, count, 1000 * elapsed, 1000 * move / ticks,
+                  1e6 * elapsed / (enemies + count), hits))
+
+@benchmark
+def swarm(ticks=90):
+    """Enemy AI per tick: steering, shoot timers and refiling in the
+       SpatialHash, for Enemy objects in a list versus one EnemySwarm."""
+    rng = random.Random(0)
+    dt = 1.0 / 60
+    player = (0.0, 1.5, 0.0)
+    print('%d ticks' % ticks)
+    for count in (100, 1000, 10000):
+        extent = 2 * math.sqrt(count)
+        enemies = [Enemy(centre, speed=rng.uniform(1.5, 5.0), shoot_interval=rng.uniform(1.0, 3.0))
+                   for centre in scatter(rng, count, extent)]
+        index = SpatialHash()
+        for enemy in enemies:
+            index.insert(enemy.id, enemy.get_aabb())
+        pool = BulletPool()
+        start = time.perf_counter()
+        for _ in xrange(ticks):
+            for enemy in enemies:
+                enemy.update(dt, player, pool)
+                index.move(enemy.id, enemy.get_aabb())
+        before = (time.perf_counter() - start) / ticks
+
+        swarm = EnemySwarm()
+        index = SpatialHash()
+        for enemy in enemies:
+            swarm.append(enemy)
+            index.insert(enemy.id, enemy.get_aabb())
+        pool = BulletPool()
+        start = time.perf_counter()
+        for _ in xrange(ticks):
+            swarm.update(dt, player, pool)
+            index.move_many(swarm.ids[:len(swarm)].tolist(), swarm.get_aabbs())
+        after = (time.perf_counter() - start) / ticks
+        print('  %5d enemies: list %8.2f ms/tick, swarm %6.2f ms/tick (%.1fx), %d bullets fired' % (
+            count, 1000 * before, 1000 * after, before / after, len(pool)))
+
+@benchmark
+def flowfield(ticks=60):
+    """Cost of the shared flow field on the default map: one rebuild, then
+       per-tick enemy updates that read it, for few and many enemies. The
+       player walks one cell every 10 ticks so the field is kept current."""
+    world = arena()
+    flow = FlowField(world.world, -1)
+    start = time.perf_counter()
+    flow.update((0.0, 1.5, 5.0))
+    print('field of %dx%d cells rebuilt in %.2f ms' % (
+        flow.walkable.shape[1], flow.walkable.shape[0], 1000 * (time.perf_counter() - start)))
+    rng = random.Random(0)
+    dt = 1.0 / 60
+    for count in (5, 5000):
+        swarm = EnemySwarm()
+        for x, _, z in scatter(rng, count, 140):
+            swarm.append(Enemy((x, -1, z), speed=rng.uniform(1.5, 5.0), shoot_interval=1e9))
+        pool = BulletPool()
+        builds = flow.builds
+        field = 0.0
+        start = time.perf_counter()
+        for tick in xrange(ticks):
+            t = time.perf_counter()
+            flow.update((tick // 10, 1.5, 5.0))
+            field += time.perf_counter() - t
+            swarm.update(dt, (tick // 10, 1.5, 5.0), pool, flow)
+        elapsed = (time.perf_counter() - start) / ticks
+        print('  %4d enemies: %6.2f ms/tick, of which %.2f ms in the field (%d rebuilds)' % (
+            count, 1000 * elapsed, 1000 * field / ticks, flow.builds - builds))
+
+@benchmark
+def swept(ticks=30):
+    """Swept bullets against enemies and terrain. First, at 10 ticks/sec a
+       bullet moves 3 blocks per tick: count how many of 1000 aimed shots an
+       end-point test would register versus the swept test. Then the cost
+       per tick of sweeping many bullets through the default map."""
+    world = arena()
+    rng = random.Random(0)
+    dt = 0.1
+    index = SpatialHash()
+    targets = []
+    for id in xrange(1000):
+        x, z = rng.uniform(-60, 60), rng.uniform(-60, 60)
+        index.insert(id, (x - 0.5, -1, z - 0.5, x + 0.5, 1, z + 0.5))
+        targets.append((x, z))
+    pool = BulletPool()
+    origins = []
+    directions = []
+    for x, z in targets:
+        angle = rng.uniform(0, 2 * math.pi)
+        distance = rng.uniform(5, 20)
+        origins.append((x + math.cos(angle) * distance, 0, z + math.sin(angle) * distance))
+        directions.append((-math.cos(angle), 0, -math.sin(angle)))
+    pool.spawn_many(origins, directions, 30, PLAYER)
+    end_point = 0
+    for i, ((ox, oy, oz), (dx, dy, dz)) in enumerate(zip(origins, directions)):
+        x, z = targets[i]
+        for step in xrange(1, 8):
+            px, pz = ox + dx * 30 * dt * step, oz + dz * 30 * dt * step
+            if abs(px - x) <= 0.5 and abs(pz - z) <= 0.5:
+                end_point += 1
+                break
+    swept_hits = 0
+    for _ in xrange(8):
+        swept_hits += len(pool.update(dt, index, (0, 0, 0, 0, 0, 0), world.world)[0])
+    print('1000 shots at 10 ticks/sec: end-point test hits %d, swept test hits %d' % (
+        end_point, swept_hits))
+
+    dt = 1.0 / 60
+    player_aabb = (-0.5, -1.5, -0.5, 0.5, 0.5, 0.5)
+    for count in (1000, 10000, 50000):
+        pool = BulletPool()
+        pool.spawn_many(scatter(rng, count, 75),
+                        [(rng.uniform(-1, 1), rng.uniform(-0.5, 0.1), rng.uniform(-1, 1))
+                         for _ in xrange(count)],
+                        30, [PLAYER if i % 2 else i for i in xrange(count)])
+        start = time.perf_counter()
+        for _ in xrange(ticks):
+            pool.update(dt, index, player_aabb, world.world)
+        elapsed = (time.perf_counter() - start) / ticks
+        print('  %6d bullets in flight: %6.2f ms/tick, %d left after %d ticks' % (
+            count, 1000 * elapsed, len(pool), ticks))
+
+def fixed_step_hit_test(world, position, vector, max_distance=8):
+    """The 1/8-block stepping hit_test the DDA walk replaced."""
+    m = 8
+    x, y, z = position
+    dx, dy, dz = vector
+    previous = None
+    for _ in xrange(max_distance * m):
+        key = normalize((x, y, z))
+        if key != previous and key in world:
+            return key, previous
+        previous = key
+        x, y, z = x + dx / m, y + dy / m, z + dz / m
+    return None, None
+
+@benchmark
+def hit_test(rays=20000):
+    """Rays from head height in random directions on the default map:
+       fixed 1/8-block steps versus the exact DDA walk, single and batched."""
+    world = arena()
+    rng = random.Random(0)
+    origins = [(rng.uniform(-75, 75), rng.uniform(-1, 3), rng.uniform(-75, 75)) for _ in xrange(rays)]
+    vectors = []
+    for _ in xrange(rays):
+        rx, ry = rng.uniform(0, 360), rng.uniform(-90, 90)
+        m = math.cos(math.radians(ry))
+        vectors.append((math.cos(math.radians(rx - 90)) * m, math.sin(math.radians(ry)),
+                        math.sin(math.radians(rx - 90)) * m))
+    start = time.perf_counter()
+    old = [fixed_step_hit_test(world.world, o, v)[0] for o, v in zip(origins, vectors)]
+    fixed = time.perf_counter() - start
+    start = time.perf_counter()
+    new = [world.hit_test(o, v)[0] for o, v in zip(origins, vectors)]
+    exact = time.perf_counter() - start
+    start = time.perf_counter()
+    raycast_batch(world.world, origins, vectors, 8)
+    batched = time.perf_counter() - start
+    print('%d rays, %d hits, %d disagreements (corners the fixed step cut)' % (
+        rays, sum(1 for block in new if block), sum(1 for a, b in zip(old, new) if a != b)))
+    for name, elapsed in (('fixed step', fixed), ('DDA', exact), ('DDA batched', batched)):
+        print('  %-12s %8.0f rays/sec' % (name, rays / elapsed))
+    record('dda_rays_per_sec', rays / exact, 'rays/s', better='higher')
+    record('batched_rays_per_sec', rays / batched, 'rays/s', better='higher')
+
+@benchmark
+def profiling(ticks=3600):
+    """What instrumenting a tick costs: the same seeded match with the
+       profiler and event log off, then on."""
+    for enabled in (False, True):
+        sim = Simulation(World(), seed=0, profiler=Profiler(window=ticks, enabled=enabled),
+                         events=EventLog(enabled=enabled))
+        start = time.perf_counter()
+        for _ in xrange(ticks):
+            sim.step()
+        elapsed = time.perf_counter() - start
+        print('  %-3s %d ticks, %.1f us per tick, %d events' % (
+            'on' if enabled else 'off', ticks, 1e6 * elapsed / ticks, sim.events.emitted))
+    for name, summary in sim.profiler.summary()['phases'].items():
+        print('    %-13s p50 %6.3f  p99 %6.3f ms' % (name, summary['p50'], summary['p99']))
+
+@benchmark
+def world_build(repeat=5):
+    """World(size) plus load_all(), the start-up cost of the flat arena, at
+       several map sizes."""
+    for size in (32, 80, 160, 320):
+        elapsed = best_of(repeat if size <= 160 else 1, lambda: arena(size))
+        world = arena(size)
+        print('  size %3d: %4d sectors, %8d blocks, %7.1f ms' % (
+            size, len(world.sectors), len(world.world), 1000 * elapsed))
+        record('size_%d_ms' % size, 1000 * elapsed, 'ms')
+
+# Waypoints of the scripted walk for the streaming benchmark, in blocks.
+STREAMING_PATH = ((0, 0), (256, 0), (256, 128), (0, 256), (-128, -64))
+
+@benchmark
+def streaming(view_distance=4, mesher='culled'):
+    """Sector streaming over the hills terrain along a scripted path: at
+       each sector crossing, the work Model.change_sectors does without GL.
+       That is loading (generating) the padded square and meshing every
+       sector that came into view."""
+    world = World(generator=HillsGenerator(0))
+    build = MESHERS[mesher]
+    pad = view_distance
+    shown = set()
+    times = []
+    meshed = 0
+    previous = None
+    for (x0, z0), (x1, z1) in zip(STREAMING_PATH, STREAMING_PATH[1:]):
+        steps = int(max(abs(x1 - x0), abs(z1 - z0)))
+        for i in xrange(steps):
+            sector = sectorize((x0 + (x1 - x0) * i / steps, 0, z0 + (z1 - z0) * i / steps))
+            if sector == previous:
+                continue
+            previous = sector
+            start = time.perf_counter()
+            sx, _, sz = sector
+            world.load_sectors([(sx + dx, 0, sz + dz) for dx in xrange(-pad - 1, pad + 2)
+                                for dz in xrange(-pad - 1, pad + 2)])
+            visible = sector_ring(sector, view_distance)
+            for new in visible - shown:
+                build(snapshot_sector(world.world, new))
+                meshed += 1
+            shown = visible
+            times.append(time.perf_counter() - start)
+    times = 1000 * np.array(times)
+    first, rest = times[0], times[1:]
+    print('  %d transitions, %d sectors meshed, %d loaded at the end' % (
+        len(times), meshed, len(world.sectors)))
+    print('  first %.1f ms, then mean %.1f ms, p99 %.1f ms, max %.1f ms per transition' % (
+        first, rest.mean(), np.percentile(rest, 99), rest.max()))
+    record('first_ms', first, 'ms')
+    record('transition_mean_ms', rest.mean(), 'ms')
+    record('transition_p99_ms', np.percentile(rest, 99), 'ms')
+
+@benchmark
+def collide(substeps=20000):
+    """Player physics on the default map: whole substeps (gravity, motion
+       and Simulation.collide) while walking a circle into the arena wall,
+       then collide() alone at random spots on and around the floor."""
+    sim = Simulation(arena(), seed=0, events=EventLog(enabled=False))
+    player = sim.player
+    player.position = (0, -0.5, 70)
+    player.strafe = [-1, 0]
+    dt = 1.0 / 60 / 8
+    start = time.perf_counter()
+    for i in xrange(substeps):
+        player.rotation = ((i // 8) % 360, 0)
+        sim._update(dt)
+    stepped = time.perf_counter() - start
+    rng = random.Random(0)
+    positions = scatter(rng, substeps, 82)
+    start = time.perf_counter()
+    for position in positions:
+        sim.collide(position, 2)
+    alone = time.perf_counter() - start
+    print('  %d substeps: %.2f us each; collide() alone %.2f us' % (
+        substeps, 1e6 * stepped / substeps, 1e6 * alone / substeps))
+    record('substep_us', 1e6 * stepped / substeps, 'us')
+    record('collide_us', 1e6 * alone / substeps, 'us')
+
+@benchmark
+def combat(ticks=60):
+    """Full Simulation.step ticks with 10, 1k and 10k enemies and as many
+       player bullets in flight, on the default map with spawning off."""
+    for count in (10, 1000, 10000):
+        rng = random.Random(count)
+        sim = Simulation(arena(), seed=0, events=EventLog(enabled=False))
+        sim.enemy_spawner.count = 0
+        for position in scatter(rng, count, 70):
+            sim.enemies.append(Enemy((position[0], -1, position[2]), speed=rng.uniform(1.5, 5.0),
+                                     shoot_interval=rng.uniform(1.0, 3.0)))
+        boxes = sim.enemies.get_aabbs()
+        for row, id in enumerate(sim.enemies.ids[:count].tolist()):
+            sim.enemy_index.insert(id, boxes[row])
+        origins = np.array(scatter(rng, count, 70))
+        directions = np.array([[rng.uniform(-1, 1), rng.uniform(-0.2, 0.2), rng.uniform(-1, 1)]
+                               for _ in xrange(count)])
+        sim.bullets.spawn_many(origins, directions, 30, PLAYER)
+        sim.player.health = float('inf')
+        # The first tick loads sectors and builds the flow field.
+        sim.step()
+        start = time.perf_counter()
+        for _ in xrange(ticks):
+            sim.step()
+        elapsed = (time.perf_counter() - start) / ticks
+        print('  %5d enemies: %8.3f ms per tick, %d left, %d bullets at the end' % (
+            count, 1000 * elapsed, len(sim.enemies), len(sim.bullets)))
+        record('tick_%d_ms' % count, 1000 * elapsed, 'ms')
+
+@benchmark
+def server(clients=32, enemies=1000, ticks=120):
+    """The match server over loopback: bots walking circles and firing,
+       with enemies spread over the arena and spawning off, in lockstep.
+       Server tick time, then bytes sent per client with and without
+       delta compression, and with interest cut to one sector. The last
+       decoded state of each bot is checked against the server's."""
+    import asyncio
+    from server import INTEREST, QUANTUM, GameServer, Bot, play_match
+    for label, delta, interest in (('delta', True, INTEREST), ('full', False, INTEREST),
+                                   ('near', True, 1)):
+        rng = random.Random(0)
+        sim = Simulation(arena(), seed=0, profiler=Profiler(window=ticks),
+                         events=EventLog(enabled=False))
+        sim.enemy_spawner.count = 0
+        for position in scatter(rng, enemies, 75):
+            sim.enemies.append(Enemy((position[0], -1, position[2]), speed=rng.uniform(1.5, 5.0),
+                                     shoot_interval=rng.uniform(1.0, 3.0)))
+        boxes = sim.enemies.get_aabbs()
+        for row, id in enumerate(sim.enemies.ids[:enemies].tolist()):
+            sim.enemy_index.insert(id, boxes[row])
+        host = GameServer(sim, port=0, delta=delta, interest=interest)
+        bots = [Bot() for _ in xrange(clients)]
+        for i in xrange(20):
+            host.set_block((i - 10, 0, -20), STONE)
+        loop = asyncio.new_event_loop()
+        start = time.perf_counter()
+        loop.run_until_complete(play_match(host, bots, ticks))
+        elapsed = time.perf_counter() - start
+        loop.close()
+        phases = sim.profiler.summary()['phases']
+        sent = sum(bot.bytes_received for bot in bots) / clients
+        if label == 'delta':
+            tick, snapshots = phases['server.tick'], phases['server.snapshots']
+            print('  %d clients, %d enemies, %d ticks in %.1fs with the bots' % (
+                clients, enemies, ticks, elapsed))
+            print('  server tick p50 %.2f ms, p99 %.2f ms; snapshots p50 %.2f ms' % (
+                tick['p50'], tick['p99'], snapshots['p50']))
+            record('tick_p50_ms', tick['p50'], 'ms')
+            record('tick_p99_ms', tick['p99'], 'ms')
+        n = len(sim.enemies)
+        truth = dict(zip(sim.enemies.ids[:n].tolist(), sim.enemies.positions[:n].tolist()))
+        for bot in bots:
+            for id, position in bot.positions('enemies').items():
+                assert max(abs(a - b) for a, b in zip(position, truth[id])) <= 0.5 / QUANTUM
+            assert len(bot.blocks) == 20
+        print('  %-5s %7.1f KB per client, %6.0f bytes per snapshot, %6.1f kbit/s at %d ticks/sec' % (
+            label, sent / 1024, sent / ticks, 8 * sent / ticks * TICKS_PER_SEC / 1000, TICKS_PER_SEC))
+        record('%s_bytes_per_snapshot' % label, sent / ticks, 'B')
+
+@benchmark
+def timers(ticks=360):
+    """Keeping time for n enemies with 1-3 second shot intervals: counting
+       every one down each tick, as EnemySwarm.update does, versus a
+       TimerWheel that only visits the due ones, in one batch per tick as
+       Simulation keeps them or with a timer per enemy. Then what
+       scheduling and cancelling a single timer cost."""
+    from timers import TimerWheel, to_ticks
+    dt = 1.0 / TICKS_PER_SEC
+    for n in (100, 1000, 10000, 100000):
+        rng = np.random.RandomState(n)
+        intervals = rng.uniform(1.0, 3.0, n)
+        since = np.zeros(n)
+        fired = 0
+        start = time.perf_counter()
+        for _ in xrange(ticks):
+            since += dt
+            due = np.flatnonzero(since >= intervals)
+            since[due] = 0.0
+            fired += len(due)
+        polled = (time.perf_counter() - start) / ticks
+        delays = to_ticks(intervals)
+        wheel = TimerWheel()
+        wheel.schedule_many('shots', np.arange(n), delays - 1)
+        singles = TimerWheel()
+        for id, delay in enumerate(delays.tolist()):
+            singles.schedule(('shot', id), delay - 1)
+        results = []
+        for timed_wheel, batched in ((wheel, True), (singles, False)):
+            woken = 0
+            start = time.perf_counter()
+            for tick in xrange(ticks):
+                for key in timed_wheel.pop():
+                    if batched:
+                        ids = timed_wheel.take(key)
+                        timed_wheel.schedule_many('shots', ids, tick + delays[ids])
+                        woken += len(ids)
+                    else:
+                        timed_wheel.schedule(key, tick + delays[key[1]])
+                        woken += 1
+            results.append((time.perf_counter() - start) / ticks)
+            assert woken == fired
+        batched, single = results
+        print('  %6d timers, %4d due per tick: polled %7.1f, batched %7.1f, '
+              'one per enemy %7.1f us/tick' % (
+                  n, fired // ticks, 1e6 * polled, 1e6 * batched, 1e6 * single))
+        record('batched_%d_us' % n, 1e6 * batched, 'us')
+    keys = [('spawn', id) for id in xrange(100000)]
+    elapsed = best_of(3, lambda: [singles.schedule(key, 50) for key in keys])
+    cancelled = best_of(1, lambda: [singles.cancel(key) for key in keys])
+    print('  one timer: schedule %.2f us, cancel %.2f us' % (
+        1e6 * elapsed / len(keys), 1e6 * cancelled / len(keys)))
+
+@benchmark
+def line_of_sight(pairs=10000, repeat=3):
+    """LOS queries per second on the default map, between enemies' eyes
+       scattered over and around the arena and players inside it: one
+       World.raycast per pair, LineOfSight with nothing cached, and again
+       with every pair cached. The border walls must block exactly the
+       lines from outside them."""
+    from sight import LineOfSight, cells
+    world = arena()
+    rng = random.Random(0)
+    eyes = np.array([(x, 0, z) for x, _, z in scatter(rng, pairs, 95)])
+    players = np.array([(x, 0.5, z) for x, _, z in scatter(rng, pairs, 70)])
+    sight = LineOfSight(world.world)
+    outside = (np.abs(cells(eyes)[:, [0, 2]]) >= 80).any(axis=1)
+    assert (sight.query(eyes, players) == ~outside).all()
+    sample = pairs // 10
+    start = time.perf_counter()
+    for eye, player in zip(eyes[:sample].tolist(), players[:sample].tolist()):
+        world.raycast(eye, [b - a for a, b in zip(eye, player)],
+                      math.sqrt(sum((b - a) ** 2 for a, b in zip(eye, player))))
+    naive = sample / (time.perf_counter() - start)
+    print('  one World.raycast per pair: %8.0f per sec' % naive)
+    record('raycast_per_sec', naive, 'q/s', better='higher')
+    for batch in (100, 1000, pairs):
+        def uncached():
+            for i in xrange(0, pairs, batch):
+                sight.cache.clear()
+                sight.query(eyes[i:i + batch], players[i:i + batch])
+        elapsed = best_of(repeat, uncached)
+        print('  LineOfSight, batches of %5d: %8.0f per sec' % (batch, pairs / elapsed))
+        record('batch_%d_per_sec' % batch, pairs / elapsed, 'q/s', better='higher')
+    sight.query(eyes, players)
+    elapsed = best_of(repeat, lambda: sight.query(eyes, players))
+    print('  LineOfSight, all cached:       %8.0f per sec' % (pairs / elapsed))
+    record('cached_per_sec', pairs / elapsed, 'q/s', better='higher')
+
+def play_script(sim, ticks):
+    """Drive sim's player for ticks ticks: walk, turn, fire and jump on a
+       fixed schedule."""
+    for tick in xrange(ticks):
+        if tick % 240 == 0:
+            sim.move(((-1, 0), (-1, 1), (0, -1), (1, 0))[tick // 240 % 4])
+        if tick % 7 == 0:
+            sim.look(13 - tick % 29, (tick % 11) - 5)
+        if tick % 20 == 0:
+            sim.fire()
+        if tick % 150 == 75:
+            sim.jump()
+        sim.step()
+
+@benchmark
+def replay(ticks=3600):
+    """Record a scripted minute of play on the default map to an input log,
+       then replay it headless twice, checking its state hashes."""
+    from replay import Recorder, terrain_of, replay as play_back
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'match.fpsi')
+    try:
+        sim = Simulation(World(), seed=1234, events=EventLog(enabled=False))
+        sim.recorder = Recorder(path, 1234, *terrain_of(sim.world.generator))
+        start = time.perf_counter()
+        play_script(sim, ticks)
+        live = time.perf_counter() - start
+        sim.recorder.close(sim)
+        expected = sim.state_hash()
+        print('  recorded %d ticks in %.2fs: %d records, %d bytes' % (
+            ticks, live, sim.recorder.records, os.path.getsize(path)))
+        for _ in xrange(2):
+            replayed, checked, elapsed = play_back(path)
+            assert replayed.tick == ticks and checked == ticks // 60 + 1
+            assert replayed.state_hash() == expected
+            print('  replayed: %d hashes matched, %.0f ticks/sec, %.0fx real time' % (
+                checked, ticks / elapsed, ticks / elapsed / TICKS_PER_SEC))
+        record('ticks_per_sec', ticks / elapsed, 'ticks/s', better='higher')
+        record('log_bytes', os.path.getsize(path), 'B')
+    finally:
+        shutil.rmtree(directory)
+
+def compare(results, baseline, tolerance):
+    """Print each recorded metric next to its baseline. Returns the names
+       of those more than tolerance (a fraction) worse."""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, result in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if old is None:
+                print('  %-34s %12.3f %-6s (new)' % (name + '.' + metric, result['value'], result['unit']))
+                continue
+            ratio = result['value'] / old['value'] if old['value'] else float('inf')
+            worse = ratio - 1 if result['better'] == 'lower' else 1 / ratio - 1 if ratio else float('inf')
+            flag = 'REGRESSION' if worse > tolerance else ''
+            if flag:
+                regressions.append(name + '.' + metric)
+            print('  %-34s %12.3f %-6s baseline %12.3f  %+6.1f%%  %s' % (
+                name + '.' + metric, result['value'], result['unit'], old['value'],
+                100 * (ratio - 1), flag))
+    return regressions
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run, from: %s (default: all)'
+                        % ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--suite', action='store_true',
+                        help='run the regression suite: %s' % ', '.join(SUITE))
+    parser.add_argument('--json', metavar='PATH', help='write the recorded metrics to PATH')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='compare the recorded metrics with an earlier --json file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much worse than the baseline a metric may be, as a '
+                             'fraction (default: 0.25)')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %r' % name)
+    global running
+    for name in args.names or (SUITE if args.suite else sorted(BENCHMARKS)):
+        print('== %s' % name)
+        running = name
+        BENCHMARKS[name]()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(OrderedDict([
+                ('python', platform.python_version()),
+                ('numpy', np.__version__),
+                ('platform', platform.platform()),
+                ('results', RESULTS),
+            ]), f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print('== compared with %s' % args.baseline)
+        regressions = compare(RESULTS, baseline, args.tolerance)
+        if regressions:
+            print('%d regressions: %s' % (len(regressions), ', '.join(regressions)))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""All live bullets as one structure of NumPy arrays."""
+from __future__ import division
+
+import numpy as np
+
+from pool import ColumnPool
+from raycast import raycast_batch, segment_aabb
+
+PLAYER = -1
+BULLET_SIZE = 0.1
+BULLET_LIFETIME = 3.0
+
+class BulletPool(ColumnPool):
+    """Bullets are rows of ids, positions and directions (n x 3), speeds,
+       lifetimes and owners. An owner is PLAYER or the id of the enemy that
+       fired. Ids are handed out in spawn order, so like EnemySwarm's they
+       stay sorted. A bullet is not aged here: it flies until it hits
+       something or expire() drops it, which a Simulation does when the
+       timer it set from the lifetime runs out."""
+    COLUMNS = (
+        ('ids', (), np.int64),
+        ('positions', (3,), float),
+        ('directions', (3,), float),
+        ('speeds', (), float),
+        ('lifetimes', (), float),
+        ('owners', (), np.int64),
+    )
+
+    def __init__(self, capacity=64):
+        super(BulletPool, self).__init__(capacity)
+        self.next_id = 0
+
+    def spawn(self, position, direction, speed, owner, lifetime=BULLET_LIFETIME):
+        self.spawn_many([position], [direction], speed, owner, lifetime)
+
+    def spawn_many(self, positions, directions, speeds, owners, lifetime=BULLET_LIFETIME):
+        """Add one bullet per row of positions/directions. speeds, owners and
+           lifetime may be scalars or per-bullet arrays. Directions need not
+           be normalized."""
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=float).reshape(-1, 3)
+        n = len(positions)
+        if not n:
+            return
+        self._reserve(n)
+        start, end = self.count, self.count + n
+        self.ids[start:end] = np.arange(self.next_id, self.next_id + n)
+        self.next_id += n
+        self.positions[start:end] = positions
+        self.directions[start:end] = directions / np.linalg.norm(directions, axis=1)[:, None]
+        self.speeds[start:end] = speeds
+        self.lifetimes[start:end] = lifetime
+        self.owners[start:end] = owners
+        self.count = end
+
+    def expire(self, ranges):
+        """Drop the bullets whose ids fall in any of ranges, (first, end)
+           pairs. Ids no longer live are skipped, so a range still covers
+           whatever is left of the batch it was set for. Returns how many
+           went."""
+        n = self.count
+        if not n or not len(ranges):
+            return 0
+        bounds = np.searchsorted(self.ids[:n], np.asarray(ranges, dtype=np.int64).reshape(-1, 2))
+        keep = np.ones(n, dtype=bool)
+        for first, end in bounds.tolist():
+            keep[first:end] = False
+        if keep.all():
+            return 0
+        self.compact(keep)
+        return n - self.count
+
+    def update(self, dt, enemy_index, player_aabb, block_map=None):
+        """Advance every bullet by one tick and stop it on the first thing
+           its path for the tick crosses: an enemy box in enemy_index (a
+           SpatialHash) for player bullets, the player_aabb for enemy
+           bullets, or a solid block in block_map for both. Returns (ids of the
+           enemies hit, one per player bullet that hit, in bullet order;
+           number of enemy bullets that hit the player). player_aabb may
+           also be m x 6, one box per player, and then the second value is
+           the number of hits on each."""
+        n = self.count
+        enemy_hits = np.zeros(0, dtype=np.int64)
+        player_aabb = np.asarray(player_aabb, dtype=float)
+        players = player_aabb.reshape(-1, 6)
+        m = len(players)
+        if not n:
+            return enemy_hits, 0 if player_aabb.ndim == 1 else np.zeros(m, dtype=np.int64)
+
+        starts = self.positions[:n]
+        directions = self.directions[:n]
+        travel = self.speeds[:n] * dt
+        ends = starts + directions * travel[:, None]
+        # How far along its path (0..1) each bullet meets a block.
+        blocked = np.full(n, np.inf)
+        if block_map is not None:
+            _, _, _, distances = raycast_batch(block_map, starts, directions, travel)
+            blocked = distances / travel
+        dead = np.isfinite(blocked)
+
+        from_player = self.owners[:n] == PLAYER
+        shooters = np.flatnonzero(from_player)
+        if len(shooters) and len(enemy_index):
+            rows, ids, t = enemy_index.query_segments(starts[shooters], ends[shooters])
+            rows, first = np.unique(rows, return_index=True)
+            ids, t = ids[first], t[first]
+            rows = shooters[rows]
+            struck = t <= blocked[rows]
+            enemy_hits = ids[struck]
+            dead[rows[struck]] = True
+
+        # Every enemy bullet against every player; each stops at the first.
+        others = np.flatnonzero(~from_player)
+        hits = np.zeros(m, dtype=np.int64)
+        if len(others) and m:
+            t = segment_aabb(np.repeat(starts[others], m, axis=0),
+                             np.repeat(ends[others], m, axis=0),
+                             np.tile(players, (len(others), 1))).reshape(len(others), m)
+            victims = t.argmin(axis=1)
+            t = t[np.arange(len(others)), victims]
+            struck = np.isfinite(t) & (t <= blocked[others])
+            dead[others[struck]] = True
+            hits = np.bincount(victims[struck], minlength=m)
+
+        self.positions[:n] = ends
+        if dead.any():
+            self.compact(~dead)
+        return enemy_hits, int(hits[0]) if player_aabb.ndim == 1 else hits
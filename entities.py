@@ -0,0 +1,109 @@
+"""Draws every dynamic entity of a type with one persistent vertex buffer."""
+from __future__ import division
+import ctypes
+
+import numpy as np
+from pyglet.gl import *
+
+from world import cube_vertices
+from bullets import BULLET_SIZE
+
+# The 24 corners cube_vertices emits for a unit cube at the origin.
+CUBE = np.array(cube_vertices(0, 0, 0, 1), dtype=np.float32).reshape(24, 3)
+
+def box_vertices(centers, n):
+    """cube_vertices for every row of centers (an m x 3 array) at once, as
+       one flat float32 array of m * 72 floats ready for GL_QUADS."""
+    centers = np.asarray(centers, dtype=np.float32).reshape(-1, 3)
+    return (centers[:, None, :] + CUBE * n).reshape(-1)
+
+class EntityBuffer(object):
+    """A GL_DYNAMIC_DRAW vertex buffer that is overwritten in place each
+       frame. It only reallocates, to twice the size, when the entities no
+       longer fit."""
+    def __init__(self, color, capacity=1024):
+        self.color = color
+        self.id = GLuint()
+        glGenBuffers(1, ctypes.byref(self.id))
+        self.capacity = 0
+        self.count = 0
+        self._allocate(capacity)
+
+    def _allocate(self, nbytes):
+        glBindBuffer(GL_ARRAY_BUFFER, self.id)
+        glBufferData(GL_ARRAY_BUFFER, nbytes, None, GL_DYNAMIC_DRAW)
+        self.capacity = nbytes
+
+    def upload(self, vertices):
+        """Replace the buffer contents with vertices, a flat float32 array.
+           Returns the number of bytes written."""
+        vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+        self.count = len(vertices) // 3
+        if not vertices.nbytes:
+            return 0
+        if vertices.nbytes > self.capacity:
+            capacity = self.capacity
+            while capacity < vertices.nbytes:
+                capacity *= 2
+            self._allocate(capacity)
+        glBindBuffer(GL_ARRAY_BUFFER, self.id)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, vertices.nbytes, vertices.ctypes.data)
+        return vertices.nbytes
+
+    def draw(self):
+        """Returns the number of draw calls made: 1, or 0 when empty."""
+        if not self.count:
+            return 0
+        glColor3f(*self.color)
+        glBindBuffer(GL_ARRAY_BUFFER, self.id)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, 0)
+        glDrawArrays(GL_QUADS, 0, self.count)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        return 1
+
+    def delete(self):
+        glDeleteBuffers(1, ctypes.byref(self.id))
+
+class EntityRenderer(object):
+    """One EntityBuffer per entity type, refilled from the simulation's
+       arrays every frame. draw_calls and upload_bytes count the last frame;
+       the totals count since creation."""
+    def __init__(self):
+        self.enemies = EntityBuffer((0.6, 0.3, 0.0))
+        self.bullets = EntityBuffer((1.0, 0.0, 0.0))
+        self.draw_calls = 0
+        self.upload_bytes = 0
+        self.frames = 0
+        self.total_draw_calls = 0
+        self.total_upload_bytes = 0
+
+    def draw(self, sim):
+        # An enemy is two stacked cubes, at its feet and one block up.
+        enemies = sim.enemies
+        feet = enemies.positions[:len(enemies)].astype(np.float32)
+        heads = feet + (0, 1, 0)
+        centers = np.stack([feet, heads], axis=1)
+        bullets = sim.bullets
+        uploaded = self.enemies.upload(box_vertices(centers, 0.5))
+        uploaded += self.bullets.upload(box_vertices(bullets.positions[:len(bullets)], BULLET_SIZE))
+        calls = self.enemies.draw() + self.bullets.draw()
+        self.draw_calls = calls
+        self.upload_bytes = uploaded
+        self.frames += 1
+        self.total_draw_calls += calls
+        self.total_upload_bytes += uploaded
+
+    def stats(self):
+        return {
+            'draw_calls': self.draw_calls,
+            'upload_bytes': self.upload_bytes,
+            'frames': self.frames,
+            'total_draw_calls': self.total_draw_calls,
+            'total_upload_bytes': self.total_upload_bytes,
+        }
+
+    def delete(self):
+        self.enemies.delete()
+        self.bullets.delete()
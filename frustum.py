@@ -0,0 +1,101 @@
+"""View distance and view-frustum culling of sectors, in plain NumPy.
+
+The matrices here are the ones Window.set_3d builds with gluPerspective,
+glRotatef and glTranslatef, so which sectors are culled can be worked out
+and checked without a GL context."""
+from __future__ import division
+import sys, math
+
+import numpy as np
+
+from world import SECTOR_SIZE, WORLD_BOTTOM, WORLD_HEIGHT
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+VIEW_DISTANCE = 4
+FIELD_OF_VIEW = 65.0
+NEAR = 0.1
+
+def view_range(view_distance):
+    """Distance of the far plane and the end of the fog, in blocks, for a
+       view distance in sectors."""
+    return view_distance * SECTOR_SIZE
+
+def sector_ring(centre, view_distance):
+    """The sectors shown around centre: a disc view_distance sectors across
+       plus the corners inside one more sector's radius."""
+    cx, _, cz = centre
+    n = view_distance
+    return set((cx + dx, 0, cz + dz)
+               for dx in xrange(-n, n + 1) for dz in xrange(-n, n + 1)
+               if dx * dx + dz * dz <= (n + 1) ** 2)
+
+def sector_box(sector):
+    """(x0, y0, z0, x1, y1, z1) around every block a sector can hold."""
+    s = SECTOR_SIZE
+    sx, _, sz = sector
+    return (sx * s - 0.5, WORLD_BOTTOM - 0.5, sz * s - 0.5,
+            (sx + 1) * s - 0.5, WORLD_BOTTOM + WORLD_HEIGHT - 0.5, (sz + 1) * s - 0.5)
+
+def perspective(fovy, aspect, near, far):
+    """The gluPerspective matrix."""
+    f = 1 / math.tan(math.radians(fovy) / 2)
+    return np.array([[f / aspect, 0, 0, 0],
+                     [0, f, 0, 0],
+                     [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+                     [0, 0, -1, 0]])
+
+def rotate(angle, x, y, z):
+    """The glRotatef matrix: angle degrees about the axis (x, y, z)."""
+    x, y, z = np.array((x, y, z), dtype=float) / math.sqrt(x * x + y * y + z * z)
+    c = math.cos(math.radians(angle))
+    s = math.sin(math.radians(angle))
+    t = 1 - c
+    return np.array([[x * x * t + c, x * y * t - z * s, x * z * t + y * s, 0],
+                     [y * x * t + z * s, y * y * t + c, y * z * t - x * s, 0],
+                     [x * z * t - y * s, y * z * t + x * s, z * z * t + c, 0],
+                     [0, 0, 0, 1]])
+
+def translate(x, y, z):
+    matrix = np.identity(4)
+    matrix[:3, 3] = (x, y, z)
+    return matrix
+
+def camera_matrix(position, rotation, aspect, far, fovy=FIELD_OF_VIEW, near=NEAR):
+    """Projection times model-view, exactly as Window.set_3d sets them up."""
+    rx, ry = rotation
+    x, y, z = position
+    return (perspective(fovy, aspect, near, far)
+            .dot(rotate(rx, 0, 1, 0))
+            .dot(rotate(-ry, math.cos(math.radians(rx)), 0, math.sin(math.radians(rx))))
+            .dot(translate(-x, -y, -z)))
+
+class Frustum(object):
+    """The six clip planes of a camera, as rows (a, b, c, d) with
+       a*x + b*y + c*z + d >= 0 on the inside."""
+    def __init__(self, matrix):
+        m = np.asarray(matrix, dtype=float)
+        planes = np.array([m[3] + m[0], m[3] - m[0],
+                           m[3] + m[1], m[3] - m[1],
+                           m[3] + m[2], m[3] - m[2]])
+        self.planes = planes / np.sqrt((planes[:, :3] ** 2).sum(axis=1))[:, None]
+
+    @classmethod
+    def from_camera(cls, position, rotation, aspect, far, fovy=FIELD_OF_VIEW, near=NEAR):
+        return cls(camera_matrix(position, rotation, aspect, far, fovy, near))
+
+    def contains(self, point):
+        return bool((self.planes[:, :3].dot(point) + self.planes[:, 3] >= 0).all())
+
+    def visible(self, boxes):
+        """Which of boxes (n x 6, min corner then max corner) are at least
+           partly inside. For each plane only the box corner furthest along
+           its normal is tested, so a box is culled only if it is wholly
+           outside one plane; a few boxes just past a frustum edge are kept."""
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 6)
+        normals = self.planes[:, :3]
+        # n x 6 planes x 3: the far corner picks max where the normal is positive.
+        corners = np.where(normals[None] >= 0, boxes[:, None, 3:], boxes[:, None, :3])
+        distances = (corners * normals[None]).sum(axis=2) + self.planes[:, 3]
+        return (distances >= 0).all(axis=1)
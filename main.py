@@ -1,510 +1,407 @@
 from __future__ import division
-import sys, math, random, time
-from collections import deque
+import sys, math, time, random
 
+import numpy as np
 import pyglet
 from pyglet import image
 from pyglet.gl import *
 from pyglet.graphics import TextureGroup
 from pyglet.window import key, mouse
 
-# === Constants and Helper Functions ========================================
-
-TICKS_PER_SEC = 60
-SECTOR_SIZE = 16
-WALKING_SPEED = 5
-GRAVITY = 20.0
-MAX_JUMP_HEIGHT = 1.0 
-JUMP_SPEED = math.sqrt(2 * GRAVITY * MAX_JUMP_HEIGHT)
-TERMINAL_VELOCITY = 50
-PLAYER_HEIGHT = 2
+from world import (TICKS_PER_SEC, TEXTURE_PATH, GRASS, SAND, BRICK, FACES,
+                   cube_vertices, sectorize, World)
+from mesher import MESHERS, snapshot_sector
+from meshpool import MeshWorkerPool
+from simulation import Simulation
+from entities import EntityRenderer
+from terrain import FlatArenaGenerator, HillsGenerator
+from region import RegionStore
+from meshcache import MeshCache, mesh_key
+from profiler import Profiler, EventLog
+from replay import Recorder, terrain_of
+from frustum import VIEW_DISTANCE, FIELD_OF_VIEW, NEAR, Frustum, sector_ring, view_range
 
 if sys.version_info[0] >= 3:
     xrange = range
 
-def cube_vertices(x, y, z, n):
-    return [
-        x-n, y+n, z-n,  x-n, y+n, z+n,  x+n, y+n, z+n,  x+n, y+n, z-n,  # top
-        x-n, y-n, z-n,  x+n, y-n, z-n,  x+n, y-n, z+n,  x-n, y-n, z+n,  # bottom
-        x-n, y-n, z-n,  x-n, y-n, z+n,  x-n, y+n, z+n,  x-n, y+n, z-n,  # left
-        x+n, y-n, z+n,  x+n, y-n, z-n,  x+n, y+n, z-n,  x+n, y+n, z+n,  # right
-        x-n, y-n, z+n,  x+n, y-n, z+n,  x+n, y+n, z+n,  x-n, y+n, z+n,  # front
-        x+n, y-n, z-n,  x-n, y-n, z-n,  x-n, y+n, z-n,  x+n, y+n, z-n,  # back
-    ]
-
-def tex_coord(x, y, n=4):
-    m = 1.0 / n
-    dx = x * m
-    dy = y * m
-    return dx, dy, dx + m, dy, dx + m, dy + m, dx, dy + m
-
-def tex_coords(top, bottom, side):
-    top = tex_coord(*top)
-    bottom = tex_coord(*bottom)
-    side = tex_coord(*side)
-    result = []
-    result.extend(top)
-    result.extend(bottom)
-    result.extend(side * 4)
-    return result
-
-# === Texture Definitions =====================================================
-
-TEXTURE_PATH = 'texture.png'
-GRASS = tex_coords((1, 0), (0, 1), (0, 0))
-SAND  = tex_coords((1, 1), (1, 1), (1, 1))
-BRICK = tex_coords((2, 0), (2, 0), (2, 0))
-STONE = tex_coords((2, 1), (2, 1), (2, 1))
-
-FACES = [
-    ( 0, 1, 0),
-    ( 0,-1, 0),
-    (-1, 0, 0),
-    ( 1, 0, 0),
-    ( 0, 0, 1),
-    ( 0, 0,-1),
-]
-
-def normalize(position):
-    x, y, z = position
-    return (int(round(x)), int(round(y)), int(round(z)))
-
-def sectorize(position):
-    x, y, z = normalize(position)
-    return (x // SECTOR_SIZE, 0, z // SECTOR_SIZE)
-
 # === Model: World and Static Blocks ==========================================
 
-class Model(object):
-    def __init__(self):
-        self.batch = pyglet.graphics.Batch()
-        self.group = TextureGroup(image.load(TEXTURE_PATH).get_texture())
-        self.world = {}
+class TileGroup(TextureGroup):
+    """One atlas tile as its own texture, repeating, for the greedy mesher's
+       merged quads."""
+    def __init__(self, atlas, tile, n=4, parent=None):
+        size = atlas.width // n
+        texture = atlas.get_region(tile[0] * size, tile[1] * size, size, size).get_texture()
+        glBindTexture(texture.target, texture.id)
+        glTexParameteri(texture.target, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(texture.target, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(texture.target, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(texture.target, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        super(TileGroup, self).__init__(texture, parent)
+
+class Model(World):
+    """World plus its GL side. Each shown sector is a batch of one vertex
+       list per texture group holding only the block faces not hidden by a
+       solid neighbour; it is rebuilt whenever a block in or bordering that
+       sector changes. Sectors within view_distance of the player's are
+       shown, and draw() skips those outside the camera's frustum.
+       Meshes are built from sector snapshots by a MeshWorkerPool and only
+       uploaded here, on the main thread. mesher names an entry of
+       mesher.MESHERS; generator and store are passed on to World. Meshes
+       are looked up in cache, a MeshCache, before any are built, and the
+       ones built are added to it."""
+    def __init__(self, mesher='culled', processes=True, generator=None, store=None,
+                 cache=None, view_distance=VIEW_DISTANCE):
+        self.atlas = image.load(TEXTURE_PATH)
+        self.group = TextureGroup(self.atlas.get_texture())
+        self.groups = {None: self.group}
+        self.mesher = mesher
+        self.workers = MeshWorkerPool(mesher, processes=processes)
+        self.cache = cache if cache is not None else MeshCache()
+        self.building = {}
         self.shown = {}
-        self._shown = {}
-        self.sectors = {}
-        self.queue = deque()
-        self._initialize()
-
-    def _initialize(self):
-        n = 80  
-        s = 1  
-        y = 0  
-        for x in xrange(-n, n + 1, s):
-            for z in xrange(-n, n + 1, s):
-                self.add_block((x, y - 2, z), GRASS, immediate=False)
-                self.add_block((x, y - 3, z), STONE, immediate=False)
-                if x in (-n, n) or z in (-n, n):
-                    for dy in xrange(-2, 3):
-                        self.add_block((x, y + dy, z), STONE, immediate=False)
+        self.vertex_lists = 0
+        self.bounds = {}
+        self.boxes = None
+        self.visible = set()
+        self.dirty = set()
+        self.sector = None
+        self.submitted = 0
+        self.culled = 0
+        self.frames = 0
+        self.total_submitted = 0
+        self.total_culled = 0
+        super(Model, self).__init__(generator=generator, store=store)
+        self.view_distance = None
+        self.set_view_distance(view_distance)
 
     def add_block(self, position, texture, immediate=True):
-        self.world[position] = texture
-        sector = sectorize(position)
-        self.sectors.setdefault(sector, []).append(position)
-        if self.exposed(position):
-            self.show_block(position, immediate)
-
-    def hit_test(self, position, vector, max_distance=8):
-        m = 8
-        x, y, z = position
-        dx, dy, dz = vector
-        previous = None
-        for _ in xrange(max_distance * m):
-            key = normalize((x, y, z))
-            if key != previous and key in self.world:
-                return key, previous
-            previous = key
-            x, y, z = x + dx / m, y + dy / m, z + dz / m
-        return None, None
-
-    def exposed(self, position):
-        x, y, z = position
-        for dx, dy, dz in FACES:
-            if (x + dx, y + dy, z + dz) not in self.world:
-                return True
-        return False
+        super(Model, self).add_block(position, texture)
+        self.rebuild_around(position, immediate)
 
-    def show_block(self, position, immediate=True):
-        texture = self.world[position]
-        self.shown[position] = texture
-        if immediate:
-            self._show_block(position, texture)
-        else:
-            self._enqueue(self._show_block, position, texture)
+    def remove_block(self, position, immediate=True):
+        super(Model, self).remove_block(position)
+        self.rebuild_around(position, immediate)
 
-    def _show_block(self, position, texture):
+    def fill_region(self, start, end, texture, immediate=False):
+        return self.rebuild(super(Model, self).fill_region(start, end, texture), immediate)
+
+    def clear_region(self, start, end, immediate=False):
+        return self.rebuild(super(Model, self).clear_region(start, end), immediate)
+
+    def replace_region(self, start, end, old, new, immediate=False):
+        return self.rebuild(super(Model, self).replace_region(start, end, old, new), immediate)
+
+    def load_sectors(self, sectors):
+        return self.rebuild(super(Model, self).load_sectors(sectors))
+
+    def unload_sector(self, sector):
+        self.hide_sector(sector)
+        super(Model, self).unload_sector(sector)
+
+    def rebuild(self, sectors, immediate=False):
+        """Re-mesh each of sectors that is visible, once."""
+        for sector in sectors:
+            if sector in self.visible:
+                self.show_sector(sector, immediate)
+        return sectors
+
+    def rebuild_around(self, position, immediate=True):
+        """Re-mesh the visible sectors whose masks a change at position
+           touched: its own and any it borders."""
         x, y, z = position
-        vertex_data = cube_vertices(x, y, z, 0.5)
-        texture_data = list(texture)
-        self._shown[position] = self.batch.add(24, GL_QUADS, self.group,
-            ('v3f/static', vertex_data),
-            ('t2f/static', texture_data))
-
-    def hide_block(self, position, immediate=True):
-        self.shown.pop(position)
+        for dx, dy, dz in FACES:
+            sector = sectorize((x + dx, y, z + dz))
+            if sector in self.visible:
+                self.show_sector(sector, immediate)
+
+    def show_sector(self, sector, immediate=False):
         if immediate:
-            self._hide_block(position)
+            self.dirty.discard(sector)
+            self.workers.cancel(sector)
+            self.building.pop(sector, None)
+            snapshot = snapshot_sector(self.world, sector)
+            key = mesh_key(snapshot, self.mesher)
+            mesh = self.cache.get(key, sector)
+            if mesh is None:
+                mesh = MESHERS[self.mesher](snapshot)
+                self.cache.put(key, mesh)
+            self.upload(mesh)
         else:
-            self._enqueue(self._hide_block, position)
-
-    def _hide_block(self, position):
-        self._shown.pop(position).delete()
-
-    def show_sector(self, sector):
-        for position in self.sectors.get(sector, []):
-            if position not in self.shown and self.exposed(position):
-                self.show_block(position, False)
+            self.dirty.add(sector)
+
+    def upload(self, mesh):
+        self._delete_vertex_lists(mesh.sector)
+        batch = pyglet.graphics.Batch()
+        vertex_lists = []
+        for tile, (vertices, tex_coords) in mesh.parts.items():
+            if vertices:
+                vertex_lists.append(batch.add(len(vertices) // 3, GL_QUADS, self.get_group(tile),
+                    ('v3f/static', vertices),
+                    ('t2f/static', tex_coords)))
+        self.shown[mesh.sector] = batch, vertex_lists
+        self.vertex_lists += len(vertex_lists)
+        bounds = mesh.bounds
+        if bounds is not None:
+            self.bounds[mesh.sector] = bounds
+            self.boxes = None
+
+    def get_group(self, tile):
+        group = self.groups.get(tile)
+        if group is None:
+            group = self.groups[tile] = TileGroup(self.atlas, tile)
+        return group
 
     def hide_sector(self, sector):
-        for position in self.sectors.get(sector, []):
-            if position in self.shown:
-                self.hide_block(position, False)
-
-    def change_sectors(self, before, after):
-        before_set = set()
-        after_set = set()
-        pad = 4
-        for dx in xrange(-pad, pad + 1):
-            for dy in [0]:
-                for dz in xrange(-pad, pad + 1):
-                    if dx ** 2 + dy ** 2 + dz ** 2 > (pad + 1) ** 2:
-                        continue
-                    if before:
-                        bx, by, bz = before
-                        before_set.add((bx + dx, by + dy, bz + dz))
-                    if after:
-                        ax, ay, az = after
-                        after_set.add((ax + dx, ay + dy, az + dz))
-        show = after_set - before_set
-        hide = before_set - after_set
+        self.dirty.discard(sector)
+        self.workers.cancel(sector)
+        self.building.pop(sector, None)
+        self._delete_vertex_lists(sector)
+
+    def _delete_vertex_lists(self, sector):
+        _, vertex_lists = self.shown.pop(sector, (None, ()))
+        for vertex_list in vertex_lists:
+            vertex_list.delete()
+        self.vertex_lists -= len(vertex_lists)
+        if self.bounds.pop(sector, None) is not None:
+            self.boxes = None
+
+    def change_sectors(self, centre):
+        """Show the sectors within view distance of centre, hiding the rest."""
+        self.sector = centre
+        visible = sector_ring(centre, self.view_distance) if centre else set()
+        show = visible - self.visible
+        hide = self.visible - visible
+        self.visible = visible
+        if centre:
+            # Load a ring past what is shown so every shown sector has its
+            # neighbours and so its outer faces are culled.
+            sx, _, sz = centre
+            pad = self.view_distance
+            self.load_sectors([(sx + dx, 0, sz + dz) for dx in xrange(-pad - 1, pad + 2)
+                               for dz in xrange(-pad - 1, pad + 2)])
         for sector in show:
             self.show_sector(sector)
         for sector in hide:
             self.hide_sector(sector)
 
-    def _enqueue(self, func, *args):
-        self.queue.append((func, args))
+    def set_view_distance(self, view_distance):
+        """Show sectors up to view_distance sectors away, keeping enough
+           sectors loaded for that."""
+        self.view_distance = view_distance
+        self.max_sectors = max(self.max_sectors, (2 * view_distance + 3) ** 2)
+        self.world.mask_capacity = max(self.world.mask_capacity, (2 * view_distance + 3) ** 2)
+        if self.sector is not None:
+            self.change_sectors(self.sector)
+
+    def draw(self, frustum):
+        """Draw the shown sectors whose bounds are at least partly inside
+           frustum, a frustum.Frustum."""
+        if self.boxes is None:
+            sectors = list(self.bounds)
+            self.boxes = sectors, np.array([self.bounds[sector] for sector in sectors],
+                                           dtype=float).reshape(-1, 6)
+        sectors, boxes = self.boxes
+        visible = frustum.visible(boxes)
+        for i in np.flatnonzero(visible):
+            self.shown[sectors[i]][0].draw()
+        self.submitted = int(visible.sum())
+        self.culled = len(sectors) - self.submitted
+        self.frames += 1
+        self.total_submitted += self.submitted
+        self.total_culled += self.culled
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'culled': self.culled,
+            'frames': self.frames,
+            'total_submitted': self.total_submitted,
+            'total_culled': self.total_culled,
+        }
+
+    def submit_dirty(self):
+        """Upload the dirty sectors the cache has a mesh for and hand the
+           rest to the workers."""
+        for sector in self.dirty:
+            snapshot = snapshot_sector(self.world, sector)
+            key = mesh_key(snapshot, self.mesher)
+            mesh = self.cache.get(key, sector)
+            if mesh is not None:
+                self.workers.cancel(sector)
+                self.building.pop(sector, None)
+                self.upload(mesh)
+            else:
+                self.building[sector] = key
+                self.workers.submit(snapshot)
+        self.dirty.clear()
 
-    def _dequeue(self):
-        func, args = self.queue.popleft()
-        func(*args)
+    def upload_built(self, mesh):
+        key = self.building.pop(mesh.sector, None)
+        if key is not None:
+            self.cache.put(key, mesh)
+        self.upload(mesh)
 
     def process_queue(self):
+        """Hand dirty sectors to the workers and upload finished meshes for
+           up to one tick's worth of time."""
         start = time.perf_counter()
-        while self.queue and time.perf_counter() - start < 1.0 / TICKS_PER_SEC:
-            self._dequeue()
+        self.submit_dirty()
+        for mesh in self.workers.completed():
+            self.upload_built(mesh)
+            if time.perf_counter() - start >= 1.0 / TICKS_PER_SEC:
+                break
 
     def process_entire_queue(self):
-        while self.queue:
-            self._dequeue()
-
-# === Dynamic Entities: Bullets and Enemies ===================================
-
-class Bullet(object):
-    """A bullet is a small moving cube that damages whoever it hits.
-       owner is either "player" or an Enemy instance."""
-    def __init__(self, position, direction, speed, owner, lifetime=3.0):
-        self.position = position
-        length = math.sqrt(direction[0]**2 + direction[1]**2 + direction[2]**2)
-        self.direction = (direction[0]/length, direction[1]/length, direction[2]/length)
-        self.speed = speed
-        self.owner = owner
-        self.size = 0.1
-        self.lifetime = lifetime
-        self.age = 0
-
-    def update(self, dt):
-        self.position = (self.position[0] + self.direction[0]*self.speed*dt,
-                         self.position[1] + self.direction[1]*self.speed*dt,
-                         self.position[2] + self.direction[2]*self.speed*dt)
-        self.age += dt
-
-    def draw(self):
-        glColor3f(1.0, 0.0, 0.0)
-        vertices = cube_vertices(*self.position, self.size)
-        pyglet.graphics.draw(24, GL_QUADS, ('v3f/static', vertices))
-
-class Enemy(object):
-    """A simple enemy made of two blocks (each 1 block tall) with a hitbox
-       roughly 1×2 blocks and health. It uses the provided speed and shooting rate."""
-    def __init__(self, position, speed=2.0, shoot_interval=2.0):
-        self.position = position 
-        self.health = 100
-        self.speed = speed
-        self.shoot_interval = shoot_interval
-        self.time_since_shot = 0.0
-
-    def update(self, dt, player_position, bullet_list):
-        
-        ex, ey, ez = self.position
-        px, py, pz = player_position
-        dx = px - ex
-        dz = pz - ez
-        dist = math.sqrt(dx*dx + dz*dz)
-        if dist > 0:
-            dx /= dist
-            dz /= dist
-        ex += dx * self.speed * dt
-        ez += dz * self.speed * dt
-        self.position = (ex, ey, ez)
-        
-        self.time_since_shot += dt
-        if self.time_since_shot >= self.shoot_interval:
-            self.time_since_shot = 0.0
-            aim_from = (ex, ey + 1, ez)  
-            direction = (px - aim_from[0], py - aim_from[1], pz - aim_from[2])
-            bullet = Bullet(aim_from, direction, speed=20, owner=self)
-            bullet_list.append(bullet)
-
-    def draw(self):
-        glColor3f(0.6, 0.3, 0.0) 
-        x, y, z = self.position
-        vertices_lower = cube_vertices(x, y, z, 0.5)
-        pyglet.graphics.draw(24, GL_QUADS, ('v3f/static', vertices_lower))
-        vertices_upper = cube_vertices(x, y + 1, z, 0.5)
-        pyglet.graphics.draw(24, GL_QUADS, ('v3f/static', vertices_upper))
-        
-    def get_aabb(self):
-        x, y, z = self.position
-        return (x - 0.5, y, z - 0.5, x + 0.5, y + 2, z + 0.5)
-
-def point_in_aabb(point, aabb):
-    x, y, z = point
-    minx, miny, minz, maxx, maxy, maxz = aabb
-    return (minx <= x <= maxx and miny <= y <= maxy and minz <= z <= maxz)
-
-# === Enemy Spawner ===========================================================
-
-
-class EnemySpawner(object):
-    def __init__(self, center, width, depth, count,
-                 respawn_time_range, speed_range, shoot_rate_range,
-                 spawn_y=-1):
-        """
-        center: tuple (center_x, center_z) for the spawn area.
-        width, depth: dimensions of the area.
-        count: maximum number of active enemies from this spawner.
-        respawn_time_range: (min, max) seconds between spawns.
-        speed_range: (min, max) enemy speed.
-        shoot_rate_range: (min, max) enemy shoot interval.
-        spawn_y: the y-coordinate for spawning (so enemies are on the ground).
-        """
-        self.center = center
-        self.width = width
-        self.depth = depth
-        self.count = count
-        self.respawn_time_range = respawn_time_range
-        self.speed_range = speed_range
-        self.shoot_rate_range = shoot_rate_range
-        self.spawn_y = spawn_y
-        self.time_until_next_spawn = random.uniform(*respawn_time_range)
-
-    def update(self, dt, enemy_list):
-        active_count = len(enemy_list)
-        self.time_until_next_spawn -= dt
-        if self.time_until_next_spawn <= 0 and active_count < self.count:
-            spawn_x = random.uniform(self.center[0] - self.width/2,
-                                     self.center[0] + self.width/2)
-            spawn_z = random.uniform(self.center[1] - self.depth/2,
-                                     self.center[1] + self.depth/2)
-            spawn_position = (spawn_x, self.spawn_y, spawn_z)
-            speed = random.uniform(self.speed_range[0], self.speed_range[1])
-            shoot_interval = random.uniform(self.shoot_rate_range[0], self.shoot_rate_range[1])
-            enemy = Enemy(spawn_position, speed=speed, shoot_interval=shoot_interval)
-            enemy_list.append(enemy)
-            self.time_until_next_spawn = random.uniform(*self.respawn_time_range)
+        self.submit_dirty()
+        self.workers.wait()
+        for mesh in self.workers.completed():
+            self.upload_built(mesh)
 
 # === Window and Main Game Loop ===============================================
 
 class Window(pyglet.window.Window):
+    """Renders a Simulation and turns keyboard/mouse events into its input.
+       All game state lives in self.sim. profiler times the phases of every
+       update and frame, and F3 shows its percentiles in place of the status
+       line; events is the Simulation's EventLog. seed seeds the Simulation,
+       and a recorder, if given, logs its input until the window closes."""
     def __init__(self, *args, **kwargs):
+        mesher = kwargs.pop('mesher', 'culled')
+        generator = kwargs.pop('generator', None)
+        store = kwargs.pop('store', None)
+        cache = kwargs.pop('cache', None)
+        view_distance = kwargs.pop('view_distance', VIEW_DISTANCE)
+        profiler = kwargs.pop('profiler', None)
+        events = kwargs.pop('events', None)
+        profile_path = kwargs.pop('profile_path', None)
+        seed = kwargs.pop('seed', None)
+        recorder = kwargs.pop('recorder', None)
         super(Window, self).__init__(*args, **kwargs)
         self.exclusive = False
-        self.strafe = [0, 0]
-        self.position = (0, 1.5, 5) 
-        self.rotation = (0, 0)
         self.sector = None
         self.reticle = None
-        self.dy = 0
+        self.focus_key = None
+        self.focused = None
         self.inventory = [BRICK, GRASS, SAND]
         self.block = self.inventory[0]
         self.num_keys = [key._1, key._2, key._3, key._4, key._5,
                          key._6, key._7, key._8, key._9, key._0]
-        self.model = Model()
+        self.model = Model(mesher, generator=generator, store=store, cache=cache,
+                           view_distance=view_distance)
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.profile_path = profile_path
+        self.sim = Simulation(self.model, seed=seed, profiler=self.profiler, events=events)
+        self.sim.recorder = recorder
+        self.entities = EntityRenderer()
         self.label = pyglet.text.Label('', font_name='Arial', font_size=18,
                                        x=10, y=self.height - 10,
                                        anchor_x='left', anchor_y='top',
                                        color=(0, 0, 0, 255))
+        self.overlay = pyglet.text.Label('', font_name='Courier New', font_size=10,
+                                         x=10, y=self.height - 10, width=600,
+                                         anchor_x='left', anchor_y='top',
+                                         color=(0, 0, 0, 255), multiline=True)
+        self.show_overlay = False
+        self.frame = 0
         pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SEC)
-        
-        self.player_health = 100
-        self.enemies = []
-        self.bullets = []
-        self.enemy_spawner = EnemySpawner(center=(0, -10),
-                                          width=30, depth=30, count=5,
-                                          respawn_time_range=(2, 6),
-                                          speed_range=(1.5, 5.0),
-                                          shoot_rate_range=(1.0, 3.0),
-                                          spawn_y=-1)
+
+    @property
+    def player(self):
+        return self.sim.player
 
     def set_exclusive_mouse(self, exclusive):
         super(Window, self).set_exclusive_mouse(exclusive)
         self.exclusive = exclusive
 
-    def get_sight_vector(self):
-        x, y = self.rotation
-        m = math.cos(math.radians(y))
-        dy = math.sin(math.radians(y))
-        dx = math.cos(math.radians(x - 90)) * m
-        dz = math.sin(math.radians(x - 90)) * m
-        return (dx, dy, dz)
-
-    def get_motion_vector(self):
-        if any(self.strafe):
-            x, y = self.rotation
-            strafe = math.degrees(math.atan2(*self.strafe))
-            x_angle = math.radians(x + strafe)
-            dx = math.cos(x_angle)
-            dz = math.sin(x_angle)
-        else:
-            dx = 0.0
-            dz = 0.0
-        return (dx, 0.0, dz)
-
     def update(self, dt):
-        self.model.process_queue()
-        sector = sectorize(self.position)
-        if sector != self.sector:
-            self.model.change_sectors(self.sector, sector)
-            if self.sector is None:
-                self.model.process_entire_queue()
-            self.sector = sector
-
-        m = 8
-        dt = min(dt, 0.2)
-        for _ in xrange(m):
-            self._update(dt / m)
-
-
-        for bullet in self.bullets[:]:
-            bullet.update(dt)
-            if bullet.age > bullet.lifetime:
-                self.bullets.remove(bullet)
-                continue
-            if bullet.owner == "player":
-                for enemy in self.enemies:
-                    if point_in_aabb(bullet.position, enemy.get_aabb()):
-                        enemy.health -= 20
-                        self.bullets.remove(bullet)
-                        print("Enemy hit! Health now:", enemy.health)
-                        break
-            else:
-                px, py, pz = self.position
-                player_aabb = (px - 0.5, py, pz - 0.5, px + 0.5, py + PLAYER_HEIGHT, pz + 0.5)
-                if point_in_aabb(bullet.position, player_aabb):
-                    self.player_health -= 10
-                    self.bullets.remove(bullet)
-                    print("Player hit! Health now:", self.player_health)
-                    break
-
-        for enemy in self.enemies[:]:
-            enemy.update(dt, self.position, self.bullets)
-            if enemy.health <= 0:
-                print("Enemy defeated!")
-                self.enemies.remove(enemy)
-
-        self.enemy_spawner.update(dt, self.enemies)
-
-    def _update(self, dt):
-        speed = WALKING_SPEED
-        d = dt * speed
-        dx, dy, dz = self.get_motion_vector()
-        dx, dy, dz = dx * d, dy * d, dz * d
-        self.dy -= dt * GRAVITY
-        self.dy = max(self.dy, -TERMINAL_VELOCITY)
-        dy += self.dy * dt
-        x, y, z = self.position
-        x, y, z = self.collide((x + dx, y + dy, z + dz), PLAYER_HEIGHT)
-        self.position = (x, y, z)
-
-    def collide(self, position, height):
-        pad = 0.25
-        p = list(position)
-        np_pos = normalize(position)
-        for face in FACES:
-            for i in xrange(3):
-                if not face[i]:
-                    continue
-                d = (p[i] - np_pos[i]) * face[i]
-                if d < pad:
-                    continue
-                for dy in xrange(height):
-                    op = list(np_pos)
-                    op[1] -= dy
-                    op[i] += face[i]
-                    if tuple(op) not in self.model.world:
-                        continue
-                    p[i] -= (d - pad) * face[i]
-                    if face in [(0, -1, 0), (0, 1, 0)]:
-                        self.dy = 0
-                    break
-        return tuple(p)
+        profiler = self.profiler
+        model = self.model
+        with profiler.phase('update'):
+            with profiler.phase('update.queue'):
+                model.process_queue()
+            with profiler.phase('update.sectors'):
+                sector = sectorize(self.player.position)
+                if sector != self.sector:
+                    model.change_sectors(sector)
+                    self.sector = sector
+            with profiler.phase('update.sim'):
+                self.sim.advance(dt)
+        profiler.count('mesh_queue', len(model.dirty) + len(model.building))
+        profiler.count('vertex_lists', model.vertex_lists)
+
+    def set_view_distance(self, view_distance):
+        """Change how many sectors away are shown, moving the far plane and
+           the fog with it."""
+        self.model.set_view_distance(view_distance)
+        setup_fog(view_distance)
+
+    def on_close(self):
+        if self.model.store is not None:
+            self.model.save()
+            self.model.store.close()
+        self.model.workers.shutdown()
+        self.entities.delete()
+        if self.profile_path:
+            self.profiler.export(self.profile_path)
+        if self.sim.recorder is not None:
+            self.sim.recorder.close(self.sim)
+        super(Window, self).on_close()
 
     def on_mouse_press(self, x, y, button, modifiers):
         if self.exclusive:
             if button == mouse.LEFT:
-                self.shoot_bullet("player")
+                self.sim.fire()
         else:
             self.set_exclusive_mouse(True)
 
-    def shoot_bullet(self, owner):
-        if owner == "player":
-            sight = self.get_sight_vector()
-            pos = (self.position[0] + sight[0] * 0.5,
-                   self.position[1] + sight[1] * 0.5,
-                   self.position[2] + sight[2] * 0.5)
-            bullet = Bullet(pos, sight, speed=30, owner="player")
-            self.bullets.append(bullet)
-
     def on_mouse_motion(self, x, y, dx, dy):
         if self.exclusive:
-            m = 0.15
-            rx, ry = self.rotation
-            rx, ry = rx + dx * m, ry + dy * m
-            ry = max(-90, min(90, ry))
-            self.rotation = (rx, ry)
+            self.sim.look(dx, dy)
 
     def on_key_press(self, symbol, modifiers):
+        strafe = list(self.player.strafe)
         if symbol == key.W:
-            self.strafe[0] -= 1
+            strafe[0] -= 1
         elif symbol == key.S:
-            self.strafe[0] += 1
+            strafe[0] += 1
         elif symbol == key.A:
-            self.strafe[1] -= 1
+            strafe[1] -= 1
         elif symbol == key.D:
-            self.strafe[1] += 1
+            strafe[1] += 1
         elif symbol == key.SPACE:
-            if self.dy == 0:
-                self.dy = JUMP_SPEED
+            self.sim.jump()
         elif symbol == key.ESCAPE:
             self.set_exclusive_mouse(False)
+        elif symbol == key.F3:
+            self.show_overlay = not self.show_overlay
+            self.overlay.text = ''
+        elif symbol in (key.PLUS, key.EQUAL):
+            self.set_view_distance(self.model.view_distance + 1)
+        elif symbol == key.MINUS:
+            self.set_view_distance(max(1, self.model.view_distance - 1))
         elif symbol in self.num_keys:
             index = (symbol - self.num_keys[0]) % len(self.inventory)
             self.block = self.inventory[index]
+        if strafe != self.player.strafe:
+            self.sim.move(strafe)
 
     def on_key_release(self, symbol, modifiers):
+        strafe = list(self.player.strafe)
         if symbol == key.W:
-            self.strafe[0] += 1
+            strafe[0] += 1
         elif symbol == key.S:
-            self.strafe[0] -= 1
+            strafe[0] -= 1
         elif symbol == key.A:
-            self.strafe[1] += 1
+            strafe[1] += 1
         elif symbol == key.D:
-            self.strafe[1] -= 1
+            strafe[1] -= 1
+        if strafe != self.player.strafe:
+            self.sim.move(strafe)
 
     def on_resize(self, width, height):
         self.label.y = height - 10
+        self.overlay.y = height - 10
         if self.reticle:
             self.reticle.delete()
         x, y = self.width // 2, self.height // 2
@@ -529,39 +426,50 @@ class Window(pyglet.window.Window):
         glViewport(0, 0, max(1, width), max(1, height))
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        gluPerspective(65.0, width / float(height), 0.1, 60.0)
+        gluPerspective(FIELD_OF_VIEW, width / float(height), NEAR,
+                       view_range(self.model.view_distance))
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
-        rx, ry = self.rotation
+        rx, ry = self.player.rotation
         glRotatef(rx, 0, 1, 0)
         glRotatef(-ry, math.cos(math.radians(rx)), 0, math.sin(math.radians(rx)))
-        x, y, z = self.position
+        x, y, z = self.player.position
         glTranslatef(-x, -y, -z)
 
     def on_draw(self):
-        self.clear()
-        self.set_3d()
-        glColor3f(1, 1, 1)
-        self.model.batch.draw()
-
-        # Draw an outline around the block you're aiming at.
-        self.draw_focused_block()
-
-        # Draw enemies.
-        for enemy in self.enemies:
-            enemy.draw()
-
-        # Draw bullets.
-        for bullet in self.bullets:
-            bullet.draw()
-
-        self.set_2d()
-        self.draw_label()
-        self.draw_reticle()
+        profiler = self.profiler
+        with profiler.phase('draw'):
+            self.clear()
+            self.set_3d()
+            glColor3f(1, 1, 1)
+            with profiler.phase('draw.world'):
+                width, height = self.get_size()
+                self.model.draw(Frustum.from_camera(
+                    self.player.position, self.player.rotation, width / float(max(1, height)),
+                    view_range(self.model.view_distance)))
+
+            # Draw an outline around the block you're aiming at.
+            with profiler.phase('draw.focus'):
+                self.draw_focused_block()
+
+            with profiler.phase('draw.entities'):
+                self.entities.draw(self.sim)
+
+            with profiler.phase('draw.hud'):
+                self.set_2d()
+                self.draw_label()
+                self.draw_reticle()
+        profiler.count('submitted', self.model.submitted)
+        profiler.count('culled', self.model.culled)
+        self.frame += 1
 
     def draw_focused_block(self):
-        vector = self.get_sight_vector()
-        block = self.model.hit_test(self.position, vector)[0]
+        player = self.player
+        key = (player.position, player.rotation, self.model.version)
+        if key != self.focus_key:
+            self.focus_key = key
+            self.focused = self.model.hit_test(player.position, player.get_sight_vector())[0]
+        block = self.focused
         if block:
             x, y, z = block
             vertex_data = cube_vertices(x, y, z, 0.51)
@@ -571,10 +479,19 @@ class Window(pyglet.window.Window):
             glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
 
     def draw_label(self):
-        x, y, z = self.position
-        self.label.text = 'Pos: (%.2f, %.2f, %.2f) | Health: %d | Enemies: %d' % (
-            x, y, z, self.player_health, len(self.enemies))
-        self.label.draw()
+        x, y, z = self.player.position
+        text = 'Pos: (%.2f, %.2f, %.2f) | Health: %d | Enemies: %d' % (
+            x, y, z, self.player.health, len(self.sim.enemies))
+        if not self.show_overlay:
+            self.label.text = text
+            self.label.draw()
+            return
+        # Laying out the overlay takes longer than drawing it, so it is
+        # only refreshed a few times a second.
+        if not self.overlay.text or self.frame % 20 == 0:
+            self.overlay.text = '%s\n%-14s %6s %6s %6s\n%s' % (
+                text, 'phase', 'p50', 'p90', 'p99', self.profiler.report())
+        self.overlay.draw()
 
     def draw_reticle(self):
         glColor3f(0, 0, 0)
@@ -582,28 +499,71 @@ class Window(pyglet.window.Window):
 
 # === OpenGL Setup Functions ================================================
 
-def setup_fog():
+def setup_fog(view_distance=VIEW_DISTANCE):
+    """Linear fog ending at the far plane for view_distance."""
+    end = view_range(view_distance)
     glEnable(GL_FOG)
     fogColor = (GLfloat * 4)(0.5, 0.69, 1.0, 1)
     glFogfv(GL_FOG_COLOR, fogColor)
     glHint(GL_FOG_HINT, GL_DONT_CARE)
     glFogi(GL_FOG_MODE, GL_LINEAR)
-    glFogf(GL_FOG_START, 20.0)
-    glFogf(GL_FOG_END, 60.0)
+    glFogf(GL_FOG_START, end / 3)
+    glFogf(GL_FOG_END, end)
 
-def setup():
+def setup(view_distance=VIEW_DISTANCE):
     glClearColor(0.5, 0.69, 1.0, 1)
     glEnable(GL_CULL_FACE)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    setup_fog()
+    setup_fog(view_distance)
 
 # === Main Entry Point =======================================================
 
 def main():
-    window = Window(width=800, height=600, caption='FPS Prototype with Spawner', resizable=True)
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mesher', choices=sorted(MESHERS), default='culled',
+                        help='how sector meshes are built (default: culled)')
+    parser.add_argument('--terrain', choices=['flat', 'hills'], default='flat',
+                        help='the flat walled arena, or endless hills (default: flat)')
+    parser.add_argument('--seed', type=int, default=0, help='terrain seed for hills')
+    parser.add_argument('--world', metavar='DIR',
+                        help='directory of region files to load edited sectors from '
+                             'and save them to on exit')
+    parser.add_argument('--mesh-cache', metavar='DIR',
+                        help='directory to keep built sector meshes in between runs')
+    parser.add_argument('--view-distance', type=int, default=VIEW_DISTANCE, metavar='SECTORS',
+                        help='how many sectors away are drawn; +/- change it while '
+                             'playing (default: %d)' % VIEW_DISTANCE)
+    parser.add_argument('--profile', metavar='PATH',
+                        help='on exit, write per-phase timings to PATH, as CSV if it '
+                             'ends in .csv and JSON otherwise; F3 shows them in game')
+    parser.add_argument('--events', action='store_true',
+                        help='print hits and kills as lines of JSON')
+    parser.add_argument('--record', metavar='PATH',
+                        help='log the match seed and every input to PATH, for replay.py '
+                             'to play back headless (not with --world, whose saved '
+                             'edits the log does not hold)')
+    parser.add_argument('--match-seed', type=int, default=None,
+                        help='seed for enemy spawns and aim (default: random)')
+    args = parser.parse_args()
+    if args.match_seed is not None and not -2 ** 63 <= args.match_seed < 2 ** 63:
+        parser.error('--match-seed must fit in 64 bits, signed')
+    if args.terrain == 'hills':
+        generator = HillsGenerator(args.seed)
+    else:
+        generator = FlatArenaGenerator()
+    seed = args.match_seed if args.match_seed is not None else random.randrange(2 ** 32)
+    recorder = Recorder(args.record, seed, *terrain_of(generator)) if args.record else None
+    window = Window(width=800, height=600, caption='FPS Prototype with Spawner', resizable=True,
+                    mesher=args.mesher, generator=generator,
+                    store=RegionStore(args.world) if args.world else None,
+                    cache=MeshCache(args.mesh_cache) if args.mesh_cache else None,
+                    view_distance=args.view_distance, profile_path=args.profile,
+                    seed=seed, recorder=recorder,
+                    events=EventLog(stream=sys.stdout if args.events else None))
     window.set_exclusive_mouse(True)
-    setup()
+    setup(args.view_distance)
     pyglet.app.run()
 
 if __name__ == '__main__':
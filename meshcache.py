@@ -0,0 +1,149 @@
+"""Built sector meshes cached by content, in memory and on disk."""
+from __future__ import division
+import os, struct, hashlib
+from array import array
+from collections import OrderedDict
+
+from mesher import MESHER_VERSION, SectorMesh
+
+MAGIC = b'FPSM'
+HEADER = struct.Struct('<4sII')
+PART = struct.Struct('<iiII')
+
+def mesh_key(snapshot, mesher):
+    """Hex digest of everything a mesh depends on: the sector (vertices are
+       in world coordinates), its blocks and masks, and which mesher at
+       which MESHER_VERSION built it."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(('%s:%d:%d,%d,%d:' % ((mesher, MESHER_VERSION) + tuple(snapshot.sector))).encode())
+    digest.update(snapshot.blocks)
+    digest.update(snapshot.masks)
+    return digest.hexdigest()
+
+def dump_mesh(mesh):
+    """Pack a mesh as a header, then per part its tile (-1, -1 for the
+       atlas), float counts and the raw float arrays."""
+    chunks = [HEADER.pack(MAGIC, MESHER_VERSION, len(mesh.parts))]
+    for tile, (vertices, tex_coords) in mesh.parts.items():
+        tx, ty = tile if tile is not None else (-1, -1)
+        chunks.append(PART.pack(tx, ty, len(vertices), len(tex_coords)))
+        chunks.append(vertices.tobytes())
+        chunks.append(tex_coords.tobytes())
+    return b''.join(chunks)
+
+def load_mesh(sector, data):
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != MESHER_VERSION:
+        return None
+    offset = HEADER.size
+    parts = {}
+    for _ in range(count):
+        tx, ty, nv, nt = PART.unpack_from(data, offset)
+        offset += PART.size
+        vertices = array('f')
+        vertices.frombytes(data[offset:offset + 4 * nv])
+        offset += 4 * nv
+        tex_coords = array('f')
+        tex_coords.frombytes(data[offset:offset + 4 * nt])
+        offset += 4 * nt
+        parts[(tx, ty) if tx >= 0 else None] = (vertices, tex_coords)
+    return SectorMesh(sector, parts)
+
+class MeshCache(object):
+    """Meshes by mesh_key. Up to capacity of them are kept in memory, least
+       recently used dropped first; with a directory every mesh put is also
+       written there as <key>.mesh and read back on a memory miss.
+
+       The directory holds at most disk_capacity meshes. Reading a file
+       touches it, and the files with the oldest modification times are
+       deleted past the cap, so the meshes of sectors edited since are
+       pruned rather than left behind for good. The cap is applied on
+       startup too."""
+    def __init__(self, directory=None, capacity=512, disk_capacity=4096):
+        self.directory = directory
+        self.capacity = capacity
+        self.disk_capacity = disk_capacity
+        self.memory = OrderedDict()
+        self.files = OrderedDict()
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            found = []
+            for name in os.listdir(directory):
+                if name.endswith('.mesh'):
+                    path = os.path.join(directory, name)
+                    found.append((os.path.getmtime(path), name[:-len('.mesh')]))
+            for _, key in sorted(found):
+                self.files[key] = None
+            self._prune()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.mesh')
+
+    def get(self, key, sector):
+        mesh = self.memory.get(key)
+        if mesh is not None:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return mesh
+        if self.directory is not None:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    mesh = load_mesh(sector, f.read())
+            except (IOError, OSError, struct.error):
+                mesh = None
+            if mesh is not None:
+                self._remember(key, mesh)
+                self._touch(key)
+                self.disk_hits += 1
+                return mesh
+        self.misses += 1
+        return None
+
+    def put(self, key, mesh):
+        self._remember(key, mesh)
+        if self.directory is not None:
+            path = self._path(key)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(dump_mesh(mesh))
+            os.replace(path + '.tmp', path)
+            self.files[key] = None
+            self.files.move_to_end(key)
+            self._prune()
+
+    def _remember(self, key, mesh):
+        self.memory[key] = mesh
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def _touch(self, key):
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            pass
+        self.files[key] = None
+        self.files.move_to_end(key)
+
+    def _prune(self):
+        """Delete the least recently used files past disk_capacity."""
+        while len(self.files) > self.disk_capacity:
+            key, _ = self.files.popitem(last=False)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'in_memory': len(self.memory),
+            'on_disk': len(self.files),
+        }
@@ -0,0 +1,180 @@
+"""Turns a sector's blocks into vertex data. Nothing here needs pyglet or GL;
+Model uploads the result as one vertex list per sector."""
+from __future__ import division
+import sys
+from array import array
+
+from world import (SECTOR_SIZE, WORLD_BOTTOM, WORLD_HEIGHT, CHUNK_VOLUME,
+                   ALL_FACES, BLOCK_TYPES, cube_vertices)
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+# Per-face vertex offsets from a block's centre, in FACES order.
+_CUBE = cube_vertices(0, 0, 0, 0.5)
+FACE_VERTICES = [tuple(_CUBE[i * 12:i * 12 + 12]) for i in xrange(6)]
+
+class SectorSnapshot(object):
+    """What meshing one sector needs, copied out of the world so it can be
+       meshed later or elsewhere: the sector's block ids and neighbour
+       masks. The masks already account for blocks in adjacent sectors."""
+    def __init__(self, sector, blocks, masks):
+        self.sector = sector
+        self.blocks = blocks
+        self.masks = masks
+
+def snapshot_sector(block_map, sector):
+    chunk = block_map.chunks.get(sector)
+    if chunk is None:
+        return SectorSnapshot(sector, bytes(CHUNK_VOLUME), bytes(CHUNK_VOLUME))
+    return SectorSnapshot(sector, bytes(chunk.blocks), bytes(block_map.masks_of(chunk)))
+
+class SectorMesh(object):
+    """Vertex data for one sector. parts maps a texture group key to
+       (vertices, tex_coords) float arrays; None is the shared atlas."""
+    def __init__(self, sector, parts):
+        self.sector = sector
+        self.parts = parts
+
+    @property
+    def vertex_count(self):
+        return sum(len(vertices) // 3 for vertices, _ in self.parts.values())
+
+    @property
+    def quads(self):
+        return self.vertex_count // 4
+
+    @property
+    def bounds(self):
+        """(x0, y0, z0, x1, y1, z1) around every vertex, or None if the
+           mesh is empty."""
+        parts = [vertices for vertices, _ in self.parts.values() if len(vertices)]
+        if not parts:
+            return None
+        return tuple(f(f(vertices[axis::3]) for vertices in parts)
+                     for f in (min, max) for axis in xrange(3))
+
+# The face indices left uncovered by each neighbour mask.
+OPEN_FACES = [[face for face in xrange(6) if not mask & (1 << face)]
+              for mask in xrange(ALL_FACES + 1)]
+
+def visible_faces(snapshot):
+    """Yield (lx, ly, lz, id, faces) for each block in the sector with at
+       least one face whose neighbour in FACES is empty; faces lists those
+       face indices. Coordinates are local to the chunk."""
+    s = SECTOR_SIZE
+    blocks = snapshot.blocks
+    masks = snapshot.masks
+    for index in xrange(CHUNK_VOLUME):
+        id = blocks[index]
+        if not id or masks[index] == ALL_FACES:
+            continue
+        yz, lx = divmod(index, s)
+        ly, lz = divmod(yz, s)
+        yield lx, ly, lz, id, OPEN_FACES[masks[index]]
+
+def build_culled(snapshot):
+    """One quad per block face whose neighbour in FACES is empty."""
+    sx, _, sz = snapshot.sector
+    ox, oy, oz = sx * SECTOR_SIZE, WORLD_BOTTOM, sz * SECTOR_SIZE
+    vertices = array('f')
+    tex_coords = array('f')
+    for lx, ly, lz, id, faces in visible_faces(snapshot):
+        x, y, z = ox + lx, oy + ly, oz + lz
+        texture = BLOCK_TYPES[id].texture
+        for face in faces:
+            offsets = FACE_VERTICES[face]
+            for i in xrange(0, 12, 3):
+                vertices.append(x + offsets[i])
+                vertices.append(y + offsets[i + 1])
+                vertices.append(z + offsets[i + 2])
+            tex_coords.extend(texture[face * 8:face * 8 + 8])
+    return SectorMesh(snapshot.sector, {None: (vertices, tex_coords)})
+
+# === Greedy Meshing ==========================================================
+
+# For each face: the axis it faces along, and the axes that its texture's u
+# and v run along (read off the corner order of FACE_VERTICES).
+FACE_AXES = []
+for _offsets in FACE_VERTICES:
+    _corners = [_offsets[i:i + 3] for i in xrange(0, 12, 3)]
+    _u = [a for a in xrange(3) if _corners[0][a] != _corners[1][a]][0]
+    _v = [a for a in xrange(3) if _corners[1][a] != _corners[2][a]][0]
+    FACE_AXES.append((3 - _u - _v, _u, _v))
+TILE_CORNERS = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+def build_greedy(snapshot):
+    """Like build_culled, but coplanar visible faces that share a texture
+       tile are merged into larger rectangles. The atlas cannot repeat a
+       tile across a merged quad, so parts are keyed by tile (tx, ty) and
+       carry texture coordinates in tile units for a repeating texture."""
+    s = SECTOR_SIZE
+    dims = (s, WORLD_HEIGHT, s)
+    tiles = []
+    tile_ids = {}
+    masks = {}
+    for lx, ly, lz, id, faces in visible_faces(snapshot):
+        cell = (lx, ly, lz)
+        block = BLOCK_TYPES[id]
+        for face in faces:
+            tile = block.tiles[face]
+            if tile not in tile_ids:
+                tiles.append(tile)
+                tile_ids[tile] = len(tiles)
+            normal, u, v = FACE_AXES[face]
+            mask = masks.get((face, cell[normal]))
+            if mask is None:
+                mask = masks[face, cell[normal]] = bytearray(dims[u] * dims[v])
+            mask[cell[v] * dims[u] + cell[u]] = tile_ids[tile]
+
+    sx, _, sz = snapshot.sector
+    origin = (sx * s, WORLD_BOTTOM, sz * s)
+    parts = dict((tile, (array('f'), array('f'))) for tile in tiles)
+    for (face, depth), mask in masks.items():
+        normal, u, v = FACE_AXES[face]
+        nu, nv = dims[u], dims[v]
+        for j in xrange(nv):
+            row = j * nu
+            i = 0
+            while i < nu:
+                t = mask[row + i]
+                if not t:
+                    i += 1
+                    continue
+                w = 1
+                while i + w < nu and mask[row + i + w] == t:
+                    w += 1
+                run = bytes(bytearray([t]) * w)
+                h = 1
+                while j + h < nv and mask[row + h * nu + i:row + h * nu + i + w] == run:
+                    h += 1
+                for k in xrange(h):
+                    mask[row + k * nu + i:row + k * nu + i + w] = bytes(w)
+                lo = [0, 0, 0]
+                hi = [0, 0, 0]
+                lo[normal] = hi[normal] = origin[normal] + depth
+                lo[u], hi[u] = origin[u] + i - 0.5, origin[u] + i + w - 0.5
+                lo[v], hi[v] = origin[v] + j - 0.5, origin[v] + j + h - 0.5
+                vertices, tex_coords = parts[tiles[t - 1]]
+                offsets = FACE_VERTICES[face]
+                for c in xrange(4):
+                    for a in xrange(3):
+                        d = offsets[c * 3 + a]
+                        if a == normal:
+                            vertices.append(lo[a] + d)
+                        else:
+                            vertices.append(lo[a] if d < 0 else hi[a])
+                    tu, tv = TILE_CORNERS[c]
+                    tex_coords.append(tu * (hi[u] - lo[u]))
+                    tex_coords.append(tv * (hi[v] - lo[v]))
+                i += w
+    return SectorMesh(snapshot.sector, parts)
+
+MESHERS = {
+    'culled': build_culled,
+    'greedy': build_greedy,
+}
+
+# Bump whenever a mesher's output changes for the same blocks, so cached
+# meshes from older code are not reused.
+MESHER_VERSION = 1
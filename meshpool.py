@@ -0,0 +1,83 @@
+"""Builds sector meshes in a worker pool so the main thread only uploads."""
+from __future__ import division
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from mesher import MESHERS
+
+def build_mesh(mesher, snapshot):
+    """Worker entry point: returns (mesh, seconds spent meshing)."""
+    start = time.perf_counter()
+    mesh = MESHERS[mesher](snapshot)
+    return mesh, time.perf_counter() - start
+
+class MeshWorkerPool(object):
+    """At most one job per sector is live. Submitting a sector again, or
+       cancelling it, drops the earlier job: it is cancelled if it has not
+       started and its result is ignored if it has."""
+    def __init__(self, mesher='culled', workers=None, processes=True):
+        self.mesher = mesher
+        if processes:
+            self.executor = ProcessPoolExecutor(workers)
+        else:
+            self.executor = ThreadPoolExecutor(workers)
+        self.jobs = {}
+        self.submitted = 0
+        self.cancelled = 0
+        self.build_times = deque(maxlen=256)
+        self.latencies = deque(maxlen=256)
+
+    def submit(self, snapshot):
+        self.cancel(snapshot.sector)
+        future = self.executor.submit(build_mesh, self.mesher, snapshot)
+        self.jobs[snapshot.sector] = (future, time.perf_counter())
+        self.submitted += 1
+
+    def cancel(self, sector):
+        job = self.jobs.pop(sector, None)
+        if job is not None:
+            job[0].cancel()
+            self.cancelled += 1
+
+    def completed(self):
+        """Yield meshes whose jobs have finished, oldest submission first.
+           A job is only removed once its mesh has been taken."""
+        now = time.perf_counter()
+        done = [(submitted, sector) for sector, (future, submitted)
+                in self.jobs.items() if future.done()]
+        for submitted, sector in sorted(done):
+            future, _ = self.jobs.pop(sector)
+            mesh, build_time = future.result()
+            self.build_times.append(build_time)
+            self.latencies.append(now - submitted)
+            yield mesh
+
+    def wait(self):
+        wait([future for future, _ in self.jobs.values()])
+
+    @property
+    def queue_depth(self):
+        return len(self.jobs)
+
+    def stats(self):
+        def summary(samples):
+            if not samples:
+                return 0.0, 0.0
+            return 1000 * sum(samples) / len(samples), 1000 * max(samples)
+        build_mean, build_max = summary(self.build_times)
+        latency_mean, latency_max = summary(self.latencies)
+        return {
+            'queue_depth': self.queue_depth,
+            'submitted': self.submitted,
+            'cancelled': self.cancelled,
+            'build_ms_mean': build_mean,
+            'build_ms_max': build_max,
+            'latency_ms_mean': latency_mean,
+            'latency_ms_max': latency_max,
+        }
+
+    def shutdown(self):
+        for sector in list(self.jobs):
+            self.cancel(sector)
+        self.executor.shutdown()
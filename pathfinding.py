@@ -0,0 +1,136 @@
+"""A flow field toward the player, shared by every enemy."""
+from __future__ import division
+import math
+
+import numpy as np
+
+from world import SECTOR_SIZE, WORLD_BOTTOM, WORLD_HEIGHT, sectorize
+
+# Neighbour offsets (dx, dz), orthogonal first so ties prefer straight moves.
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+def solid_layer(block_map, y, x0, z0, width, depth):
+    """Boolean depth x width array, indexed [z - z0, x - x0], of which cells
+       of layer y hold a block. x0, z0, width and depth must be multiples of
+       SECTOR_SIZE; the chunk layers are copied in whole."""
+    s = SECTOR_SIZE
+    solid = np.zeros((depth, width), dtype=bool)
+    ly = y - WORLD_BOTTOM
+    if not 0 <= ly < WORLD_HEIGHT:
+        return solid
+    chunks = block_map.chunks
+    for i in range(depth // s):
+        for j in range(width // s):
+            chunk = chunks.get((x0 // s + j, 0, z0 // s + i))
+            if chunk is not None:
+                blocks = np.frombuffer(chunk.blocks, dtype=np.uint8, count=s * s, offset=ly * s * s)
+                solid[i * s:(i + 1) * s, j * s:(j + 1) * s] = blocks.reshape(s, s) != 0
+    return solid
+
+class FlowField(object):
+    """Distances and next steps toward the player over the walkable cells of
+       one layer: y is the layer enemies' feet are in, and a cell is walkable
+       if it and the cell above are empty and the one below is solid. The
+       field covers the (2 * radius + 1)^2 sectors around the player's.
+
+       update() is cheap to call every tick. The walkable grid is only
+       rebuilt when the player enters another sector or a block changes,
+       and the wavefront only reruns when the player changes cell as well.
+       Its cost depends on the area covered, not on the number of enemies
+       that read it."""
+    def __init__(self, block_map, y, radius=3):
+        self.block_map = block_map
+        self.y = y
+        self.radius = radius
+        self.origin = None
+        self.version = None
+        self.target = None
+        self.walkable = None
+        self.distance = None
+        self.steps = None
+        self.builds = 0
+
+    def update(self, player_position):
+        """Make sure the field leads to player_position. Returns whether it
+           had to be recomputed."""
+        x, _, z = player_position
+        target = (int(math.floor(x + 0.5)), int(math.floor(z + 0.5)))
+        sx, _, sz = sectorize((target[0], 0, target[1]))
+        s = SECTOR_SIZE
+        origin = ((sx - self.radius) * s, (sz - self.radius) * s)
+        version = self.block_map.version
+        if origin != self.origin or version != self.version:
+            self.origin = origin
+            self.version = version
+            self.walkable = self._walkable()
+        elif target == self.target:
+            return False
+        self.target = target
+        self._flood()
+        self.builds += 1
+        return True
+
+    def _walkable(self):
+        size = (2 * self.radius + 1) * SECTOR_SIZE
+        x0, z0 = self.origin
+        layer = lambda y: solid_layer(self.block_map, y, x0, z0, size, size)
+        return ~layer(self.y) & ~layer(self.y + 1) & layer(self.y - 1)
+
+    def _flood(self):
+        """Breadth-first wavefront from the target over walkable cells, one
+           ring per iteration, then each cell's cheapest neighbour. Diagonal
+           steps are only taken when both orthogonal cells are walkable, so
+           enemies do not cut wall corners."""
+        walkable = self.walkable
+        depth, width = walkable.shape
+        distance = np.full((depth, width), np.inf)
+        tx, tz = self.target[0] - self.origin[0], self.target[1] - self.origin[1]
+        distance[tz, tx] = 0
+        frontier = np.zeros((depth, width), dtype=bool)
+        frontier[tz, tx] = True
+        ring = 0
+        while frontier.any():
+            ring += 1
+            reached = np.zeros_like(frontier)
+            reached[1:] |= frontier[:-1]
+            reached[:-1] |= frontier[1:]
+            reached[:, 1:] |= frontier[:, :-1]
+            reached[:, :-1] |= frontier[:, 1:]
+            reached &= walkable & np.isinf(distance)
+            distance[reached] = ring
+            frontier = reached
+
+        padded = np.pad(distance, 1, constant_values=np.inf)
+        open_ = np.pad(walkable, 1)
+        costs = np.empty((len(NEIGHBOURS), depth, width))
+        for k, (dx, dz) in enumerate(NEIGHBOURS):
+            cost = padded[1 + dz:1 + dz + depth, 1 + dx:1 + dx + width]
+            if dx and dz:
+                cost = cost + math.sqrt(2) - 1
+                corner = (open_[1:1 + depth, 1 + dx:1 + dx + width] &
+                          open_[1 + dz:1 + dz + depth, 1:1 + width])
+                cost = np.where(corner, cost, np.inf)
+            costs[k] = cost
+        best = costs.argmin(axis=0)
+        stuck = ~np.isfinite(costs.min(axis=0)) | (distance == 0) | np.isinf(distance)
+        steps = np.array(NEIGHBOURS, dtype=np.int64)[best]
+        steps[stuck] = 0
+        self.distance = distance
+        self.steps = steps
+
+    def next_cells(self, positions):
+        """For each row of positions (n x 3), the x/z centre of the cell to
+           head for next, and whether the field knows a route from there.
+           Rows off the field, unreachable or already in the player's cell
+           have no route."""
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        cells = np.floor(positions[:, [0, 2]] + 0.5).astype(np.int64)
+        local = cells - self.origin
+        depth, width = self.distance.shape
+        inside = ((local >= 0) & (local < (width, depth))).all(axis=1)
+        routed = np.zeros(len(positions), dtype=bool)
+        rows = np.flatnonzero(inside)
+        steps = self.steps[local[rows, 1], local[rows, 0]]
+        routed[rows] = steps.any(axis=1)
+        cells[rows] += steps
+        return cells, routed
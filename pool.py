@@ -0,0 +1,43 @@
+"""Growable structure-of-arrays storage shared by the entity pools."""
+from __future__ import division
+
+import numpy as np
+
+class ColumnPool(object):
+    """Entities are rows 0..len(pool)-1 of parallel NumPy arrays, one per
+       name in COLUMNS, each given as (name, per-row shape, dtype). Dead rows
+       are dropped by compacting the survivors to the front, so order is
+       preserved."""
+    COLUMNS = ()
+
+    def __init__(self, capacity=64):
+        self.count = 0
+        for name, shape, dtype in self.COLUMNS:
+            setattr(self, name, np.zeros((capacity,) + shape, dtype=dtype))
+
+    def __len__(self):
+        return self.count
+
+    def _columns(self):
+        return [name for name, _, _ in self.COLUMNS]
+
+    def _reserve(self, extra):
+        needed = self.count + extra
+        capacity = len(getattr(self, self.COLUMNS[0][0]))
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in self._columns():
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def compact(self, keep):
+        """Keep only the rows where the boolean mask keep is set."""
+        kept = int(keep.sum())
+        for name in self._columns():
+            column = getattr(self, name)
+            column[:kept] = column[:self.count][keep]
+        self.count = kept
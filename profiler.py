@@ -0,0 +1,160 @@
+"""Where the time goes: per-phase timers and counters over a rolling window
+of frames, and a log of game events in place of print calls."""
+from __future__ import division
+import csv, json, time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+class Phase(object):
+    """Times each with-block into a rolling window of samples, in seconds."""
+    __slots__ = ('samples', 'start')
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.samples.append(time.perf_counter() - self.start)
+
+class NullPhase(object):
+    """What a disabled Profiler hands out: a with-block that does nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+NULL_PHASE = NullPhase()
+
+def summarize(samples, scale=1):
+    """count, mean, percentiles and max of samples, times scale."""
+    values = np.fromiter(samples, dtype=float, count=len(samples)) * scale
+    if not len(values):
+        return OrderedDict([('count', 0)])
+    summary = OrderedDict([('count', len(values)), ('mean', float(values.mean()))])
+    for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES).tolist()):
+        summary['p%d' % q] = value
+    summary['max'] = float(values.max())
+    return summary
+
+class Profiler(object):
+    """Named phase timers and counters, each keeping its last window
+       samples. Wrap a phase in `with profiler.phase('tick.physics'):` and
+       report a quantity once a frame with profiler.count('enemies', n).
+       Names are reported in the order they were first used. A disabled
+       profiler costs one method call per phase and records nothing."""
+    def __init__(self, window=600, enabled=True):
+        self.window = window
+        self.enabled = enabled
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase(self.window)
+        return phase
+
+    def count(self, name, value):
+        if not self.enabled:
+            return
+        samples = self.counters.get(name)
+        if samples is None:
+            samples = self.counters[name] = deque(maxlen=self.window)
+        samples.append(value)
+
+    def reset(self):
+        self.phases.clear()
+        self.counters.clear()
+
+    def summary(self):
+        """{'phases': name -> summary in milliseconds,
+            'counters': name -> summary plus the last value}."""
+        counters = OrderedDict()
+        for name, samples in self.counters.items():
+            counters[name] = summarize(samples)
+            counters[name]['last'] = samples[-1] if samples else None
+        return OrderedDict([
+            ('window', self.window),
+            ('phases', OrderedDict((name, summarize(phase.samples, 1000))
+                                   for name, phase in self.phases.items())),
+            ('counters', counters),
+        ])
+
+    def rows(self):
+        """The summary as flat rows: kind, name, count, mean, p50, p90,
+           p99, max. Phases are in milliseconds."""
+        fields = ['count', 'mean'] + ['p%d' % q for q in PERCENTILES] + ['max']
+        summary = self.summary()
+        for kind in ('phases', 'counters'):
+            for name, values in summary[kind].items():
+                yield [kind[:-1], name] + [values.get(field, '') for field in fields]
+
+    def export(self, path):
+        """Write the summary to path, as CSV if it ends in .csv and JSON
+           otherwise."""
+        if path.endswith('.csv'):
+            with open(path, 'w') as f:
+                writer = csv.writer(f)
+                writer.writerow(['kind', 'name', 'count', 'mean'] +
+                                ['p%d' % q for q in PERCENTILES] + ['max'])
+                writer.writerows(self.rows())
+        else:
+            with open(path, 'w') as f:
+                json.dump(self.summary(), f, indent=2)
+
+    def report(self):
+        """A few lines of text for an on-screen overlay."""
+        lines = []
+        for name, phase in self.phases.items():
+            s = summarize(phase.samples, 1000)
+            if s['count']:
+                lines.append('%-14s %6.2f %6.2f %6.2f ms' % (name, s['p50'], s['p90'], s['p99']))
+        counts = ['%s %s' % (name, samples[-1]) for name, samples in self.counters.items()
+                  if samples]
+        if counts:
+            lines.append(' | '.join(counts))
+        return '\n'.join(lines)
+
+# === Event Log ===============================================================
+
+class EventLog(object):
+    """Game events as records of tick, kind and fields, keeping the last
+       capacity of them. With a stream each event is also written to it as
+       a line of JSON. Callers check enabled before building events, so a
+       disabled log costs nothing in the loops that report them."""
+    def __init__(self, enabled=True, capacity=1000, stream=None):
+        self.enabled = enabled
+        self.events = deque(maxlen=capacity)
+        self.stream = stream
+        self.emitted = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def emit(self, tick, kind, **fields):
+        if not self.enabled:
+            return
+        event = OrderedDict([('tick', tick), ('kind', kind)])
+        event.update(sorted(fields.items()))
+        self.events.append(event)
+        self.emitted += 1
+        if self.stream is not None:
+            self.stream.write(json.dumps(event) + '\n')
+
+    def of_kind(self, kind):
+        return [event for event in self.events if event['kind'] == kind]
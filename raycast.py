@@ -0,0 +1,145 @@
+"""Batched ray and segment queries against the voxel world and boxes."""
+from __future__ import division
+
+import numpy as np
+
+from world import SECTOR_SIZE, WORLD_BOTTOM, WORLD_HEIGHT
+
+def block_ids(block_map, cells):
+    """Block id at each row of cells, an n x 3 integer array of block
+       positions; 0 where there is no block. Reads the chunk arrays in place,
+       one NumPy gather per sector touched."""
+    cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+    ids = np.zeros(len(cells), dtype=np.uint8)
+    s = SECTOR_SIZE
+    ly = cells[:, 1] - WORLD_BOTTOM
+    valid = (ly >= 0) & (ly < WORLD_HEIGHT)
+    if not valid.any():
+        return ids
+    rows = np.flatnonzero(valid)
+    cx, cz = cells[rows, 0], cells[rows, 2]
+    sx, sz = cx // s, cz // s
+    index = (ly[rows] * s + cz % s) * s + cx % s
+    # Sort by sector, packed into one int64, and take each sector's run.
+    keys = (sx << 32) | (sz & 0xFFFFFFFF)
+    order = np.argsort(keys)
+    bounds = (np.flatnonzero(np.diff(keys[order])) + 1).tolist()
+    chunks = block_map.chunks
+    for lo, hi in zip([0] + bounds, bounds + [len(order)]):
+        mine = order[lo:hi]
+        chunk = chunks.get((int(sx[mine[0]]), 0, int(sz[mine[0]])))
+        if chunk is None:
+            continue
+        blocks = np.frombuffer(chunk.blocks, dtype=np.uint8)
+        ids[rows[mine]] = blocks[index[mine]]
+    return ids
+
+def raycast_batch(block_map, origins, directions, max_distances):
+    """Amanatides-Woo traversal of many rays at once. Each ray starts at a
+       row of origins and runs along the matching row of directions (any
+       non-zero length) for up to max_distances (a scalar or one per ray).
+       Rays advance in lockstep, one cell boundary per iteration, visiting
+       only the cells they cross. Returns (hit, cells, normals, distances):
+       whether a block was hit, the block position, the normal of the face
+       the ray entered through (zero if it started inside the block) and the
+       distance travelled to that face. Misses have distance inf."""
+    origins = np.asarray(origins, dtype=float).reshape(-1, 3)
+    directions = np.asarray(directions, dtype=float).reshape(-1, 3)
+    n = len(origins)
+    max_distances = np.broadcast_to(np.asarray(max_distances, dtype=float), (n,))
+    directions = directions / np.linalg.norm(directions, axis=1)[:, None]
+
+    # Blocks are centred on integers, so cell boundaries sit at k + 0.5.
+    shifted = origins + 0.5
+    cells = np.floor(shifted).astype(np.int64)
+    step = np.sign(directions).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(step != 0, 1.0 / np.abs(directions), np.inf)
+        frac = shifted - cells
+        t_max = np.where(step > 0, (1.0 - frac) * delta,
+                         np.where(step < 0, frac * delta, np.inf))
+
+    hit = np.zeros(n, dtype=bool)
+    hit_cells = cells.copy()
+    normals = np.zeros((n, 3), dtype=np.int64)
+    distances = np.full(n, np.inf)
+
+    start = block_ids(block_map, cells) != 0
+    hit[start] = True
+    distances[start] = 0.0
+    active = np.flatnonzero(~start)
+    while len(active):
+        t = t_max[active]
+        axis = t.argmin(axis=1)
+        t_next = t[np.arange(len(active)), axis]
+        alive = t_next <= max_distances[active]
+        active, axis, t_next = active[alive], axis[alive], t_next[alive]
+        if not len(active):
+            break
+        cells[active, axis] += step[active, axis]
+        t_max[active, axis] += delta[active, axis]
+        struck = block_ids(block_map, cells[active]) != 0
+        done = active[struck]
+        hit[done] = True
+        hit_cells[done] = cells[done]
+        normals[done, axis[struck]] = -step[done, axis[struck]]
+        distances[done] = t_next[struck]
+        active = active[~struck]
+    return hit, hit_cells, normals, distances
+
+def segments_clear(block_map, starts, ends):
+    """Whether each segment from a row of starts to the matching row of
+       ends crosses no block, its end cells included. Rather than stepping
+       the segments along together, this finds every cell boundary each one
+       crosses up front, and the cell it enters there, and reads all those
+       cells with a single block_ids call. Where a segment passes exactly
+       through an edge or corner, one of the cells beside it may be read
+       as well."""
+    starts = np.asarray(starts, dtype=float).reshape(-1, 3)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 3)
+    n = len(starts)
+    deltas = ends - starts
+    rays = [np.arange(n)]
+    entered = [np.floor(starts + 0.5)]
+    for axis in range(3):
+        # Boundaries sit at k - 0.5: those strictly between the two ends.
+        lo = np.minimum(starts[:, axis], ends[:, axis]) + 0.5
+        hi = np.maximum(starts[:, axis], ends[:, axis]) + 0.5
+        first = np.floor(lo).astype(np.int64) + 1
+        counts = np.maximum(0, np.ceil(hi).astype(np.int64) - first)
+        ray = np.repeat(np.arange(n), counts)
+        k = np.arange(len(ray)) - np.repeat(np.cumsum(counts) - counts, counts) + first[ray]
+        d = deltas[ray]
+        t = (k - 0.5 - starts[ray, axis]) / d[:, axis]
+        cells = np.floor(starts[ray] + d * t[:, None] + 0.5)
+        cells[:, axis] = np.where(d[:, axis] > 0, k, k - 1)
+        rays.append(ray)
+        entered.append(cells)
+    ray = np.concatenate(rays)
+    solid = block_ids(block_map, np.concatenate(entered)) != 0
+    return np.bincount(ray[solid], minlength=n) == 0
+
+def segment_aabb(starts, ends, boxes):
+    """Slab test of segments against boxes, row by row. boxes are
+       (minx, miny, minz, maxx, maxy, maxz). Returns the fraction of the way
+       from start to end where each segment enters its box (0 if it starts
+       inside), or inf where it misses."""
+    starts = np.asarray(starts, dtype=float).reshape(-1, 3)
+    deltas = np.asarray(ends, dtype=float).reshape(-1, 3) - starts
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 6)
+    enter = np.zeros(len(starts))
+    leave = np.ones(len(starts))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for axis in range(3):
+            d = deltas[:, axis]
+            lo = (boxes[:, axis] - starts[:, axis]) / d
+            hi = (boxes[:, axis + 3] - starts[:, axis]) / d
+            still = d == 0
+            outside = still & ((starts[:, axis] < boxes[:, axis]) |
+                               (starts[:, axis] > boxes[:, axis + 3]))
+            near = np.where(still, -np.inf, np.minimum(lo, hi))
+            far = np.where(still, np.inf, np.maximum(lo, hi))
+            enter = np.maximum(enter, near)
+            leave = np.minimum(leave, far)
+            leave[outside] = -np.inf
+    return np.where(enter <= leave, enter, np.inf)
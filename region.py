@@ -0,0 +1,146 @@
+"""Saved worlds: sector block arrays in memory-mapped region files.
+
+A region file holds up to REGION_SIZE x REGION_SIZE sectors. It starts with
+a header (magic, format version, REGION_SIZE, CHUNK_VOLUME as little-endian
+uint32s) and an index of one uint32 per sector, row-major by local z then x,
+giving its slot number plus one, or 0 if the sector is not stored. Slots of
+SLOT_SIZE bytes follow, each a chunk's block ids then its neighbour masks
+exactly as Chunk lays them out, so loading a sector is two slices of the
+mapped file and no mask computation. Slots are handed out in the order
+sectors are first saved and rewritten in place.
+"""
+from __future__ import division
+import os, mmap, struct
+
+import numpy as np
+
+from world import CHUNK_VOLUME, WORLD_HEIGHT, SECTOR_SIZE
+
+MAGIC = b'FPSR'
+FORMAT_VERSION = 1
+REGION_SIZE = 32
+HEADER = struct.Struct('<4sIII')
+INDEX_OFFSET = HEADER.size
+SLOTS_OFFSET = INDEX_OFFSET + 4 * REGION_SIZE * REGION_SIZE
+SLOT_SIZE = 2 * CHUNK_VOLUME
+
+def region_of(sector):
+    """(region coordinates, index entry) of a sector."""
+    sx, _, sz = sector
+    rx, lx = divmod(sx, REGION_SIZE)
+    rz, lz = divmod(sz, REGION_SIZE)
+    return (rx, rz), lz * REGION_SIZE + lx
+
+class RegionFile(object):
+    """One region file, opened for reading and writing. Reads go through a
+       read-only mmap that is remapped after the file grows."""
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.exists(path)
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        if exists:
+            magic, version, size, volume = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError('%s is not a region file' % path)
+            if (version, size, volume) != (FORMAT_VERSION, REGION_SIZE, CHUNK_VOLUME):
+                raise ValueError('%s has format %d, %d sectors a side, %d bytes a sector; '
+                                 'expected %d, %d, %d' % (path, version, size, volume,
+                                 FORMAT_VERSION, REGION_SIZE, CHUNK_VOLUME))
+            self.index = np.frombuffer(self.file.read(SLOTS_OFFSET - INDEX_OFFSET),
+                                       dtype='<u4').copy()
+        else:
+            self.index = np.zeros(REGION_SIZE * REGION_SIZE, dtype='<u4')
+            self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, REGION_SIZE, CHUNK_VOLUME))
+            self.file.write(self.index.tobytes())
+            self.file.flush()
+        self.slots = int(self.index.max())
+        self.map = None
+        self.pending = False
+
+    def __contains__(self, entry):
+        return self.index[entry] != 0
+
+    def read(self, entry):
+        """The stored (blocks, masks) at index entry as read-only [y, z, x]
+           arrays over the mapped file, or None."""
+        slot = int(self.index[entry])
+        if not slot:
+            return None
+        if self.pending:
+            self.flush()
+        if self.map is None:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = SLOTS_OFFSET + (slot - 1) * SLOT_SIZE
+        data = np.frombuffer(self.map, dtype=np.uint8, count=SLOT_SIZE, offset=offset)
+        return data.reshape(2, WORLD_HEIGHT, SECTOR_SIZE, SECTOR_SIZE)
+
+    def write(self, entry, blocks, masks):
+        slot = int(self.index[entry])
+        if not slot:
+            self.slots += 1
+            slot = self.index[entry] = self.slots
+            self.file.seek(INDEX_OFFSET + 4 * entry)
+            self.file.write(struct.pack('<I', slot))
+            self._unmap()
+        self.file.seek(SLOTS_OFFSET + (slot - 1) * SLOT_SIZE)
+        self.file.write(blocks)
+        self.file.write(masks)
+        self.pending = True
+
+    def flush(self):
+        self.file.flush()
+        self.pending = False
+
+    def _unmap(self):
+        # Arrays handed out by read() may still point into the map, so it
+        # is left for the garbage collector rather than closed.
+        self.map = None
+
+    def close(self):
+        self.file.close()
+        self._unmap()
+
+class RegionStore(object):
+    """A directory of region files named r.<x>.<z>.region, opened as needed."""
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.regions = {}
+        self.written = 0
+
+    def _region(self, coords, create):
+        region = self.regions.get(coords)
+        if region is None:
+            path = os.path.join(self.directory, 'r.%d.%d.region' % coords)
+            if not create and not os.path.exists(path):
+                return None
+            region = self.regions[coords] = RegionFile(path)
+        return region
+
+    def __contains__(self, sector):
+        coords, entry = region_of(sector)
+        region = self._region(coords, False)
+        return region is not None and entry in region
+
+    def load(self, sector):
+        """The saved (blocks, masks) of sector, or None if it was never saved."""
+        coords, entry = region_of(sector)
+        region = self._region(coords, False)
+        return region.read(entry) if region is not None else None
+
+    def save(self, chunk, masks):
+        """Store chunk's blocks with its neighbour masks (see
+           BlockMap.masks_of)."""
+        coords, entry = region_of(chunk.sector)
+        self._region(coords, True).write(entry, chunk.blocks, masks)
+        self.written += 1
+
+    def flush(self):
+        for region in self.regions.values():
+            region.flush()
+
+    def close(self):
+        for region in self.regions.values():
+            region.close()
+        self.regions.clear()
@@ -0,0 +1,187 @@
+"""Recording a match's input and replaying it headless, tick for tick.
+
+A log starts with a header: magic, format version, the match seed as an
+int64, the terrain (0 flat with its size, 1 hills with its seed) and
+TICKS_PER_SEC.
+Records follow, each a uint16 count of ticks since the previous record
+and a uint8 kind, then:
+  MOVE  strafe as two int8s
+  LOOK  mouse movement as two int16s
+  JUMP, FIRE  nothing
+  HASH  the 8-byte Simulation.state_hash() at that tick
+  WAIT  nothing; it only carries a gap too long for one record
+  END   nothing; the last tick of the match
+Input at tick t was given before tick t ran, and a hash at tick t was
+taken after tick t - 1, so the replayer checks hashes before it applies
+input for the same tick."""
+from __future__ import division
+import sys, time, struct
+
+from world import TICKS_PER_SEC, World
+from terrain import FlatArenaGenerator, HillsGenerator
+from simulation import Simulation
+from profiler import Profiler, EventLog
+
+MAGIC = b'FPSI'
+# Raised with the log layout, and whenever the simulation changes so that
+# older logs would no longer play out the same.
+FORMAT_VERSION = 4
+HEADER = struct.Struct('<4sHqBqH')
+RECORD = struct.Struct('<HB')
+MOVE, LOOK, JUMP, FIRE, HASH, WAIT, END = range(7)
+PAYLOADS = {MOVE: struct.Struct('<bb'), LOOK: struct.Struct('<hh'), HASH: struct.Struct('<8s')}
+FLAT, HILLS = 0, 1
+HASH_INTERVAL = 60
+
+def terrain_of(generator):
+    """The (terrain, parameter) header fields for a terrain generator."""
+    if isinstance(generator, HillsGenerator):
+        return HILLS, generator.seed
+    return FLAT, generator.size
+
+def simulation_for(seed, terrain, parameter, events=None, profiler=None):
+    """A fresh Simulation like the one a log was recorded from."""
+    if terrain == HILLS:
+        world = World(generator=HillsGenerator(parameter))
+    else:
+        world = World(generator=FlatArenaGenerator(parameter))
+    return Simulation(world, seed=seed, events=events, profiler=profiler)
+
+class Recorder(object):
+    """Writes a log as a Simulation reports its input. Set it as the
+       simulation's recorder; it also writes a hash every hash_interval
+       ticks and, on close(), the final tick and hash."""
+    def __init__(self, path, seed, terrain, parameter, hash_interval=HASH_INTERVAL):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, seed, terrain, parameter, TICKS_PER_SEC))
+        self.hash_interval = hash_interval
+        self.last = 0
+        self.records = 0
+
+    def _write(self, tick, kind, *args):
+        gap = tick - self.last
+        while gap > 0xFFFF:
+            self.file.write(RECORD.pack(0xFFFF, WAIT))
+            gap -= 0xFFFF
+        self.file.write(RECORD.pack(gap, kind))
+        if kind in PAYLOADS:
+            self.file.write(PAYLOADS[kind].pack(*args))
+        self.last = tick
+        self.records += 1
+
+    def move(self, tick, strafe):
+        self._write(tick, MOVE, *strafe)
+
+    def look(self, tick, dx, dy):
+        clamp = lambda v: max(-0x8000, min(0x7FFF, int(v)))
+        self._write(tick, LOOK, clamp(dx), clamp(dy))
+
+    def jump(self, tick):
+        self._write(tick, JUMP)
+
+    def fire(self, tick):
+        self._write(tick, FIRE)
+
+    def stepped(self, sim):
+        if sim.tick % self.hash_interval == 0:
+            self._write(sim.tick, HASH, sim.state_hash())
+
+    def close(self, sim):
+        self._write(sim.tick, HASH, sim.state_hash())
+        self._write(sim.tick, END)
+        self.file.close()
+
+def read_log(path):
+    """(header fields after the magic and version, [(tick, kind, args)]).
+       Raises ValueError if the log is cut short or holds a kind of record
+       it should not."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError('%s is too short for an input log' % path)
+    magic, version, seed, terrain, parameter, rate = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('%s is not an input log' % path)
+    if version != FORMAT_VERSION:
+        raise ValueError('%s has format %d, expected %d' % (path, version, FORMAT_VERSION))
+    if rate != TICKS_PER_SEC:
+        raise ValueError('%s was recorded at %d ticks/sec, not %d' % (path, rate, TICKS_PER_SEC))
+    records = []
+    offset = HEADER.size
+    tick = 0
+    while offset < len(data):
+        if offset + RECORD.size > len(data):
+            raise ValueError('%s is cut short at byte %d' % (path, offset))
+        gap, kind = RECORD.unpack_from(data, offset)
+        if kind > END:
+            raise ValueError('%s has a record of unknown kind %d at byte %d' % (path, kind, offset))
+        offset += RECORD.size
+        tick += gap
+        args = ()
+        if kind in PAYLOADS:
+            if offset + PAYLOADS[kind].size > len(data):
+                raise ValueError('%s is cut short at byte %d' % (path, offset))
+            args = PAYLOADS[kind].unpack_from(data, offset)
+            offset += PAYLOADS[kind].size
+        if kind != WAIT:
+            records.append((tick, kind, args))
+    return (seed, terrain, parameter), records
+
+class Divergence(Exception):
+    """A replay's state hash differed from the recorded one."""
+    def __init__(self, tick):
+        Exception.__init__(self, 'replay diverged from the recording at tick %d' % tick)
+        self.tick = tick
+
+def replay(path, check=True, profiler=None):
+    """Run the match in the log at path as fast as possible. Raises
+       Divergence at the first hash that differs, if check is set, and
+       ValueError if read_log does. Returns (the Simulation, number of
+       hashes checked, seconds spent ticking)."""
+    header, records = read_log(path)
+    sim = simulation_for(*header, events=EventLog(enabled=False), profiler=profiler)
+    checked = 0
+    elapsed = 0.0
+    for tick, kind, args in records:
+        start = time.perf_counter()
+        while sim.tick < tick:
+            sim.step()
+        elapsed += time.perf_counter() - start
+        if kind == MOVE:
+            sim.move(args)
+        elif kind == LOOK:
+            sim.look(*args)
+        elif kind == JUMP:
+            sim.jump()
+        elif kind == FIRE:
+            sim.fire()
+        elif kind == HASH and check:
+            if sim.state_hash() != args[0]:
+                raise Divergence(tick)
+            checked += 1
+        elif kind == END:
+            break
+    return sim, checked, elapsed
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay a recorded match headless.')
+    parser.add_argument('log', help='an input log written with main.py --record')
+    parser.add_argument('--no-check', action='store_true', help='skip the state hash checks')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='write per-phase tick timings to PATH, as CSV if it ends '
+                             'in .csv and JSON otherwise')
+    args = parser.parse_args()
+    profiler = Profiler(window=1 << 20, enabled=bool(args.profile))
+    try:
+        sim, checked, elapsed = replay(args.log, not args.no_check, profiler)
+    except Divergence as e:
+        print(e)
+        sys.exit(1)
+    print('%d ticks in %.2fs (%.0f ticks/sec, %.1fx real time), %d hashes matched' % (
+        sim.tick, elapsed, sim.tick / elapsed, sim.tick / elapsed / TICKS_PER_SEC, checked))
+    if args.profile:
+        profiler.export(args.profile)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,488 @@
+"""An authoritative match server over TCP, and scripted bots to load it.
+
+The server runs the Simulation for every connected player. Each tick it
+applies the latest input from each client, steps the match, and sends
+each client a snapshot of what is near its player.
+
+Messages are framed as a uint32 payload length and a uint8 type,
+little-endian like the rest of the payload. A client whose frame is longer
+than MAX_FRAME, or whose input does not parse or holds a rotation that is
+not a finite number, is disconnected.
+
+Client to server:
+  HELLO, then one INPUT per snapshot received: (ack tick, strafe x,
+  strafe z, rotation x, rotation y, buttons).
+Server to client:
+  WELCOME: (client id, tick, TICKS_PER_SEC).
+  SNAPSHOT: one every tick.
+
+A snapshot starts with its tick. Then it has a section for each of
+players, enemies and bullets, in that order. Each section lists:
+  - a bitmask over the ids the client already knows, in id order, of
+    those that only moved a little, and their (dx, dy, dz),
+  - the ids that left the client's view,
+  - full records (id, x, y, z, extra) for entities that are new or
+    changed a lot.
+Ids are sent as int64, as the simulation keeps them, positions as int32
+and extra as int16.
+Entities that did not change are left out. Positions are in 1/QUANTUM
+blocks. extra is health for players and enemies, and 1 for player
+bullets. After the sections come the block edits since the last snapshot,
+as (x, y, z, block id) with id 0 for a removal.
+
+A client's view is everything within `interest` sectors of its player's
+sector on x and z. Deltas are against the last snapshot sent to that
+client, which TCP is sure to have delivered first."""
+from __future__ import division
+import time, math, struct, asyncio
+
+import numpy as np
+
+from world import TICKS_PER_SEC, SECTOR_SIZE, block_id
+from bullets import PLAYER
+from simulation import Simulation
+from profiler import Profiler, EventLog
+
+DEFAULT_PORT = 5125
+QUANTUM = 32
+INTEREST = 4
+
+FRAME = struct.Struct('<IB')
+MAX_FRAME = 256
+# Bytes of snapshots a client may leave unsent before it is dropped.
+MAX_BUFFERED = 1 << 20
+HELLO, WELCOME, INPUT, SNAPSHOT = 1, 2, 3, 4
+WELCOME_BODY = struct.Struct('<III')
+INPUT_BODY = struct.Struct('<IbbffB')
+JUMP, FIRE = 1, 2
+SECTION = struct.Struct('<III')
+TICK = struct.Struct('<I')
+COUNT = struct.Struct('<I')
+
+FULL = np.dtype([('id', '<i8'), ('x', '<i4'), ('y', '<i4'), ('z', '<i4'), ('extra', '<i2')])
+EDIT = np.dtype([('x', '<i4'), ('y', '<i4'), ('z', '<i4'), ('id', 'u1')])
+KINDS = ('players', 'enemies', 'bullets')
+
+def frame(kind, payload=b''):
+    return FRAME.pack(len(payload), kind) + payload
+
+def read_input(body):
+    """An INPUT payload as (ack, strafe x, strafe z, rotation x, rotation y,
+       buttons), with strafe clamped to -1..1, rotation x taken modulo 360
+       and rotation y clamped to -90..90 as Player.look does. Raises
+       struct.error if body is the wrong size, ValueError if a rotation is
+       not finite."""
+    ack, sx, sz, rx, ry, buttons = INPUT_BODY.unpack(body)
+    if not (math.isfinite(rx) and math.isfinite(ry)):
+        raise ValueError('rotation (%r, %r) is not finite' % (rx, ry))
+    return (ack, max(-1, min(1, sx)), max(-1, min(1, sz)),
+            math.fmod(rx, 360), max(-90.0, min(90.0, ry)), buttons)
+
+def quantize(positions):
+    return np.round(np.asarray(positions, dtype=float).reshape(-1, 3) * QUANTUM).astype(np.int64)
+
+def lookup(ids, wanted):
+    """Rows of the sorted array ids holding each of wanted, and whether it
+       is there at all."""
+    rows = np.searchsorted(ids, wanted)
+    found = rows < len(ids)
+    found[found] = ids[rows[found]] == wanted[found]
+    return rows, found
+
+def empty_state():
+    """The (ids, values) a client knows of one kind of entity: sorted ids
+       and an n x 4 array of quantized x, y, z and extra."""
+    return np.zeros(0, dtype=np.int64), np.zeros((0, 4), dtype=np.int64)
+
+EMPTY = empty_state()
+
+# === Snapshot Encoding =======================================================
+
+def encode_section(before, after, delta=True):
+    """The section that turns one (ids, values) state into another."""
+    old_ids, old_values = before
+    ids, values = after
+    rows, known = lookup(old_ids, ids)
+    kept = np.zeros(len(old_ids), dtype=bool)
+    kept[rows[known]] = True
+    removed = old_ids[~kept]
+    full = ~known
+    small = np.zeros(len(old_ids), dtype=bool)
+    change = np.zeros((0, 4), dtype=np.int64)
+    if known.any():
+        new_rows = np.flatnonzero(known)
+        old_rows = rows[known]
+        change = values[new_rows] - old_values[old_rows]
+        moved = change.any(axis=1)
+        fits = moved & (np.abs(change[:, :3]) <= 127).all(axis=1) & (change[:, 3] == 0)
+        if not delta:
+            fits[:] = False
+        small[old_rows[fits]] = True
+        full[new_rows[moved & ~fits]] = True
+        change = change[fits, :3]
+    records = np.zeros(int(full.sum()), dtype=FULL)
+    records['id'] = ids[full]
+    for i, name in enumerate(('x', 'y', 'z', 'extra')):
+        records[name] = values[full, i]
+    return b''.join([SECTION.pack(len(change), len(removed), len(records)),
+                     np.packbits(small).tobytes(), change.astype('i1').tobytes(),
+                     removed.astype('<i8').tobytes(), records.tobytes()])
+
+def decode_section(data, offset, state):
+    """Apply the section at offset to state. Returns (new state, offset
+       after the section)."""
+    ids, values = state
+    moved, removed, full = SECTION.unpack_from(data, offset)
+    offset += SECTION.size
+    mask = np.frombuffer(data, np.uint8, (len(ids) + 7) // 8, offset)
+    offset += len(mask)
+    change = np.frombuffer(data, 'i1', 3 * moved, offset).reshape(-1, 3)
+    offset += 3 * moved
+    gone = np.frombuffer(data, '<i8', removed, offset)
+    offset += 8 * removed
+    records = np.frombuffer(data, FULL, full, offset)
+    offset += FULL.itemsize * full
+
+    values = values.copy()
+    values[np.flatnonzero(np.unpackbits(mask)[:len(ids)]), :3] += change
+    keep = ~np.isin(ids, gone) & ~np.isin(ids, records['id'])
+    ids, values = ids[keep], values[keep]
+    if len(records):
+        ids = np.concatenate([ids, records['id'].astype(np.int64)])
+        values = np.concatenate([values, np.stack(
+            [records[name].astype(np.int64) for name in ('x', 'y', 'z', 'extra')], axis=1)])
+        order = np.argsort(ids, kind='stable')
+        ids, values = ids[order], values[order]
+    return (ids, values), offset
+
+# === Server ==================================================================
+
+class Client(object):
+    """One connection: its player, its latest input and what it was last sent."""
+    def __init__(self, id, player, writer):
+        self.id = id
+        self.player = player
+        self.writer = writer
+        self.input = None
+        self.ack = -1
+        self.fired = False
+        self.known = dict((kind, EMPTY) for kind in KINDS)
+        self.edits = 0
+        self.bytes_sent = 0
+        self.snapshots = 0
+
+class GameServer(object):
+    """Hosts a Simulation over TCP. Each connection plays one of its
+       players: the first to join takes sim.player, whom the flow field
+       follows, and the rest are added. Block edits made through set_block
+       and remove_block are sent to every client.
+
+       A client that falls more than max_buffered bytes behind on its
+       snapshots is disconnected, rather than left to grow its send buffer
+       without bound; in real time nothing else waits for a slow client.
+
+       With delta off every changed entity is sent in full, for comparison."""
+    def __init__(self, sim=None, host='127.0.0.1', port=DEFAULT_PORT, interest=INTEREST,
+                 delta=True, profiler=None, max_buffered=MAX_BUFFERED):
+        self.sim = sim if sim is not None else Simulation(events=EventLog(enabled=False))
+        self.host = host
+        self.port = port
+        self.interest = interest
+        self.delta = delta
+        self.max_buffered = max_buffered
+        self.dropped = 0
+        self.profiler = profiler if profiler is not None else self.sim.profiler
+        self.clients = {}
+        self.next_id = 1
+        self.edits = []
+        self.server = None
+        self.acked = None
+
+    async def start(self):
+        # Made here rather than in __init__: before Python 3.10 an Event
+        # binds to the event loop current when it is created, which need
+        # not be the one the server runs on.
+        self.acked = asyncio.Event()
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        for client in list(self.clients.values()):
+            client.writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def set_block(self, position, texture):
+        self.sim.world.add_block(position, texture)
+        self.edits.append(tuple(position) + (block_id(texture),))
+
+    def remove_block(self, position):
+        self.sim.world.remove_block(position)
+        self.edits.append(tuple(position) + (0,))
+
+    def _join(self, writer):
+        sim = self.sim
+        owned = set(id(client.player) for client in self.clients.values())
+        player = sim.player if id(sim.player) not in owned else sim.add_player()
+        client = Client(self.next_id, player, writer)
+        self.next_id += 1
+        self.clients[client.id] = client
+        return client
+
+    def _leave(self, client):
+        del self.clients[client.id]
+        if client.player is self.sim.player:
+            client.player.strafe = [0, 0]
+        else:
+            self.sim.remove_player(client.player)
+        self.acked.set()
+
+    async def _serve(self, reader, writer):
+        try:
+            length, kind = FRAME.unpack(await reader.readexactly(FRAME.size))
+            if kind != HELLO or length > MAX_FRAME:
+                writer.close()
+                return
+            await reader.readexactly(length)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        client = self._join(writer)
+        writer.write(frame(WELCOME, WELCOME_BODY.pack(client.id, self.sim.tick, TICKS_PER_SEC)))
+        try:
+            while True:
+                length, kind = FRAME.unpack(await reader.readexactly(FRAME.size))
+                if length > MAX_FRAME:
+                    break
+                body = await reader.readexactly(length)
+                if kind == INPUT:
+                    client.input = read_input(body)
+                    client.ack = client.input[0]
+                    client.fired |= bool(client.input[5] & FIRE)
+                    if all(other.ack >= self.sim.tick for other in self.clients.values()):
+                        self.acked.set()
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error, ValueError):
+            # Only this client is dropped; the match goes on for the rest.
+            pass
+        finally:
+            self._leave(client)
+            writer.close()
+
+    def _apply_inputs(self):
+        sim = self.sim
+        for client in self.clients.values():
+            if client.input is None:
+                continue
+            _, sx, sz, rx, ry, buttons = client.input
+            player = client.player
+            player.strafe = [sx, sz]
+            player.rotation = (rx, ry)
+            if buttons & JUMP:
+                player.jump()
+            if client.fired:
+                sim.shoot_bullet('player', player)
+                client.fired = False
+
+    def _states(self):
+        """(ids, quantized values, sector x, sector z) for each kind."""
+        sim = self.sim
+        players = sorted(self.clients.values(), key=lambda client: client.id)
+        ids = np.array([client.id for client in players], dtype=np.int64)
+        positions = np.array([client.player.position for client in players], dtype=float)
+        extra = np.array([client.player.health for client in players], dtype=np.int64)
+        n = len(sim.enemies)
+        m = len(sim.bullets)
+        states = {
+            'players': (ids, positions.reshape(-1, 3), extra),
+            'enemies': (sim.enemies.ids[:n], sim.enemies.positions[:n],
+                        sim.enemies.healths[:n].astype(np.int64)),
+            'bullets': (sim.bullets.ids[:m], sim.bullets.positions[:m],
+                        (sim.bullets.owners[:m] == PLAYER).astype(np.int64)),
+        }
+        for kind, (ids, positions, extra) in states.items():
+            values = np.empty((len(ids), 4), dtype=np.int64)
+            values[:, :3] = quantize(positions)
+            values[:, 3] = extra
+            sectors = np.floor(positions[:, [0, 2]] + 0.5).astype(np.int64) // SECTOR_SIZE
+            states[kind] = ids, values, sectors
+        return states
+
+    def snapshot(self, client, states, sections):
+        """The SNAPSHOT payload for client, which then counts as sent.
+           Clients that see the same entities share one state object for
+           them, and those that knew the same state get the same section.
+           sections caches both for one tick: states by what is seen, and
+           sections by that and the identity of the state before, which its
+           entries keep alive so the identity cannot be reused."""
+        x, _, z = client.player.position
+        centre = np.floor(np.array([x, z]) + 0.5).astype(np.int64) // SECTOR_SIZE
+        parts = [TICK.pack(self.sim.tick)]
+        for kind in KINDS:
+            ids, values, sectors = states[kind]
+            near = (np.abs(sectors - centre) <= self.interest).all(axis=1)
+            seen = kind, np.packbits(near).tobytes()
+            after = sections.get(seen)
+            if after is None:
+                after = sections[seen] = ids[near], values[near]
+            before = client.known[kind]
+            key = seen + (id(before),)
+            cached = sections.get(key)
+            if cached is None:
+                cached = sections[key] = before, encode_section(before, after, self.delta)
+            parts.append(cached[1])
+            client.known[kind] = after
+        edits = np.array(self.edits[client.edits:], dtype=np.int64).reshape(-1, 4)
+        records = np.zeros(len(edits), dtype=EDIT)
+        for i, name in enumerate(('x', 'y', 'z', 'id')):
+            records[name] = edits[:, i]
+        client.edits = len(self.edits)
+        parts.append(COUNT.pack(len(records)) + records.tobytes())
+        return b''.join(parts)
+
+    def tick(self):
+        """Apply inputs, step the match and send every client its snapshot."""
+        profiler = self.profiler
+        with profiler.phase('server.tick'):
+            with profiler.phase('server.inputs'):
+                self._apply_inputs()
+            self.sim.step()
+            with profiler.phase('server.snapshots'):
+                states = self._states()
+                sections = {}
+                for client in list(self.clients.values()):
+                    transport = client.writer.transport
+                    if transport.is_closing():
+                        continue
+                    data = frame(SNAPSHOT, self.snapshot(client, states, sections))
+                    client.writer.write(data)
+                    client.bytes_sent += len(data)
+                    client.snapshots += 1
+                    if transport.get_write_buffer_size() > self.max_buffered:
+                        # _serve sees the connection go and lets the player leave.
+                        transport.abort()
+                        self.dropped += 1
+        profiler.count('clients', len(self.clients))
+
+    async def run(self, ticks=None, realtime=True):
+        """Tick ticks times, or forever. In real time ticks are spaced
+           1 / TICKS_PER_SEC apart and clients that cannot keep up are
+           dropped by tick; otherwise each tick waits until every client has
+           answered the last snapshot, so bots run in lockstep."""
+        period = 1.0 / TICKS_PER_SEC
+        deadline = time.perf_counter()
+        count = 0
+        while ticks is None or count < ticks:
+            self.acked.clear()
+            self.tick()
+            count += 1
+            if realtime:
+                deadline += period
+                await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+            else:
+                await asyncio.gather(*(client.writer.drain() for client in self.clients.values()))
+                if self.clients:
+                    try:
+                        await asyncio.wait_for(self.acked.wait(), 1.0)
+                    except asyncio.TimeoutError:
+                        pass
+
+# === Bots ====================================================================
+
+def circle_script(client_id, tick):
+    """Walk forward while turning, jump now and then and fire twice a
+       second. Returns (strafe x, strafe z, rotation, buttons)."""
+    buttons = (JUMP if tick % 90 == client_id % 90 else 0) | (FIRE if tick % 30 == 0 else 0)
+    return -1, 0, ((tick * 2 + client_id * 37) % 360, 0), buttons
+
+class Bot(object):
+    """A scripted client. It keeps the state decoded from snapshots, as a
+       game client would draw it, and answers each with an INPUT from
+       script(client id, tick)."""
+    def __init__(self, script=circle_script):
+        self.script = script
+        self.id = None
+        self.tick = None
+        self.state = dict((kind, empty_state()) for kind in KINDS)
+        self.blocks = {}
+        self.bytes_received = 0
+        self.snapshots = 0
+
+    def apply(self, data):
+        """Decode one SNAPSHOT payload into self.state and self.blocks."""
+        self.tick, = TICK.unpack_from(data, 0)
+        offset = TICK.size
+        for kind in KINDS:
+            self.state[kind], offset = decode_section(data, offset, self.state[kind])
+        count, = COUNT.unpack_from(data, offset)
+        for x, y, z, id in np.frombuffer(data, EDIT, count, offset + COUNT.size).tolist():
+            self.blocks[(x, y, z)] = id
+        self.snapshots += 1
+
+    def positions(self, kind):
+        """{id: (x, y, z)} of the decoded entities of kind, in blocks."""
+        ids, values = self.state[kind]
+        return dict(zip(ids.tolist(), (values[:, :3] / QUANTUM).tolist()))
+
+    async def play(self, host, port, ticks=None):
+        """Connect, then answer snapshots until ticks of them have arrived
+           or the server hangs up."""
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(frame(HELLO))
+        try:
+            while ticks is None or self.snapshots < ticks:
+                length, kind = FRAME.unpack(await reader.readexactly(FRAME.size))
+                body = await reader.readexactly(length)
+                self.bytes_received += FRAME.size + length
+                if kind == WELCOME:
+                    self.id, self.tick, _ = WELCOME_BODY.unpack(body)
+                elif kind == SNAPSHOT:
+                    self.apply(body)
+                    sx, sz, (rx, ry), buttons = self.script(self.id, self.tick)
+                    writer.write(frame(INPUT, INPUT_BODY.pack(self.tick, sx, sz, rx, ry, buttons)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def play_match(server, bots, ticks, realtime=False):
+    """Run server for ticks with every bot connected over loopback."""
+    await server.start()
+    tasks = [asyncio.ensure_future(bot.play(server.host, server.port)) for bot in bots]
+    while len(server.clients) < len(bots):
+        await asyncio.sleep(0.001)
+    await server.run(ticks, realtime)
+    await server.close()
+    await asyncio.gather(*tasks)
+
+# === Main Entry Point ========================================================
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Host a match.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--interest', type=int, default=INTEREST, metavar='SECTORS',
+                        help='how many sectors around a player it is sent entities from')
+    parser.add_argument('--bots', type=int, default=0,
+                        help='connect this many scripted bots over loopback')
+    parser.add_argument('--ticks', type=int, help='stop after this many ticks')
+    args = parser.parse_args()
+    sim = Simulation(seed=args.seed, profiler=Profiler(), events=EventLog(enabled=False))
+    server = GameServer(sim, args.host, args.port, args.interest)
+    bots = [Bot() for _ in range(args.bots)]
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(play_match(server, bots, args.ticks, realtime=True))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+    for name, summary in sim.profiler.summary()['phases'].items():
+        if summary['count']:
+            print('%-16s p50 %6.3f  p99 %6.3f ms' % (name, summary['p50'], summary['p99']))
+    for bot in bots:
+        print('bot %d: %d snapshots, %.1f KB' % (bot.id, bot.snapshots, bot.bytes_received / 1024))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Line of sight through the voxel world, for many pairs of points at once."""
+from __future__ import division
+
+import numpy as np
+
+from raycast import segments_clear
+
+def cells(points):
+    """The block cell holding each row of points."""
+    return np.floor(np.asarray(points, dtype=float).reshape(-1, 3) + 0.5).astype(np.int64)
+
+class LineOfSight(object):
+    """Answers whether the straight line between two points is free of
+       blocks in block_map, for a whole batch of pairs in one call.
+
+       Points are taken to the centres of their cells, and the answer for
+       each pair of cells is kept, so an enemy standing still and a player
+       standing still cost one dictionary lookup after the first query.
+       Lines not yet known are tested together with segments_clear. The
+       answers are dropped whenever block_map.version moves, which covers
+       edits and sectors loading alike, or when more than capacity pile up.
+
+       With a view_range, cells further apart than that on x or z cannot
+       see each other; no line is cast for them."""
+    def __init__(self, block_map, view_range=None, capacity=1 << 16):
+        self.block_map = block_map
+        self.view_range = view_range
+        self.capacity = capacity
+        self.cache = {}
+        self.version = None
+        self.queries = 0
+        self.casts = 0
+
+    def visible(self, origin, target):
+        """Whether one pair of points can see each other."""
+        return bool(self.query([origin], [target])[0])
+
+    def query(self, origins, targets):
+        """Boolean array: for each row of origins, whether it can see the
+           matching row of targets (n x 3 each, or one target for all)."""
+        a = cells(origins)
+        n = len(a)
+        if not n:
+            return np.zeros(0, dtype=bool)
+        b = np.broadcast_to(cells(targets), a.shape)
+        version = self.block_map.version
+        if version != self.version or len(self.cache) > self.capacity:
+            self.cache.clear()
+            self.version = version
+        pairs, inverse = np.unique(np.concatenate([a, b], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        keys = [tuple(pair) for pair in pairs.tolist()]
+        cache = self.cache
+        seen = np.zeros(len(pairs), dtype=bool)
+        missing = []
+        for i, key in enumerate(keys):
+            value = cache.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                seen[i] = value
+        if missing:
+            seen[missing] = results = self._cast(pairs[missing])
+            for i, value in zip(missing, results.tolist()):
+                cache[keys[i]] = value
+            self.casts += len(missing)
+        self.queries += n
+        return seen[inverse]
+
+    def _cast(self, pairs):
+        """Whether the segment from the centre of each first cell to the
+           centre of each second is free of blocks, the two cells included."""
+        starts, ends = pairs[:, :3], pairs[:, 3:]
+        seen = np.ones(len(pairs), dtype=bool)
+        if self.view_range is not None:
+            seen = (np.abs(ends - starts)[:, [0, 2]] <= self.view_range).all(axis=1)
+        rows = np.flatnonzero(seen)
+        if len(rows):
+            seen[rows] = segments_clear(self.block_map, starts[rows], ends[rows])
+        return seen
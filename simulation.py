@@ -0,0 +1,521 @@
+from __future__ import division
+import sys, math, random, time, itertools, hashlib
+
+import numpy as np
+
+from world import (TICKS_PER_SEC, SECTOR_SIZE, WALKING_SPEED, GRAVITY, JUMP_SPEED,
+                   TERMINAL_VELOCITY, PLAYER_HEIGHT, FACES, normalize, World)
+from bullets import PLAYER, BulletPool
+from spatial import SpatialHash
+from swarm import EnemySwarm
+from pathfinding import FlowField
+from profiler import Profiler, EventLog
+from timers import TimerWheel, to_ticks
+from sight import LineOfSight
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+# === Dynamic Entities: Enemies ===============================================
+
+class Enemy(object):
+    """A simple enemy made of two blocks (each 1 block tall) with a hitbox
+       roughly 1×2 blocks and health. It uses the provided speed and shooting rate."""
+    _ids = itertools.count()
+
+    def __init__(self, position, speed=2.0, shoot_interval=2.0, id=None):
+        self.id = id if id is not None else next(Enemy._ids)
+        self.position = position
+        self.health = 100
+        self.speed = speed
+        self.shoot_interval = shoot_interval
+        self.time_since_shot = 0.0
+
+    def update(self, dt, player_position, bullets):
+
+        ex, ey, ez = self.position
+        px, py, pz = player_position
+        dx = px - ex
+        dz = pz - ez
+        dist = math.sqrt(dx*dx + dz*dz)
+        if dist > 0:
+            dx /= dist
+            dz /= dist
+        ex += dx * self.speed * dt
+        ez += dz * self.speed * dt
+        self.position = (ex, ey, ez)
+
+        self.time_since_shot += dt
+        if self.time_since_shot >= self.shoot_interval:
+            self.time_since_shot = 0.0
+            aim_from = (ex, ey + 1, ez)
+            direction = (px - aim_from[0], py - aim_from[1], pz - aim_from[2])
+            bullets.spawn(aim_from, direction, speed=20, owner=self.id)
+
+    def get_aabb(self):
+        x, y, z = self.position
+        return (x - 0.5, y, z - 0.5, x + 0.5, y + 2, z + 0.5)
+
+# === Enemy Spawner ===========================================================
+
+
+class EnemySpawner(object):
+    """An area enemies appear in, at random intervals, up to count of them
+       alive at once. Whoever owns the spawner keeps the time: it asks
+       next_delay() how long to wait, calls spawn() when that is up and
+       keeps alive, the number of its enemies still living, up to date."""
+    def __init__(self, center, width, depth, count,
+                 respawn_time_range, speed_range, shoot_rate_range,
+                 spawn_y=-1, rng=None, ids=None):
+        """
+        center: tuple (center_x, center_z) for the spawn area.
+        width, depth: dimensions of the area.
+        count: maximum number of active enemies from this spawner.
+        respawn_time_range: (min, max) seconds between spawns.
+        speed_range: (min, max) enemy speed.
+        shoot_rate_range: (min, max) enemy shoot interval.
+        spawn_y: the y-coordinate for spawning (so enemies are on the ground).
+        rng: random.Random to draw from; defaults to the global random module.
+        ids: iterator of enemy ids; defaults to one shared by every Enemy.
+        """
+        self.center = center
+        self.width = width
+        self.depth = depth
+        self.count = count
+        self.respawn_time_range = respawn_time_range
+        self.speed_range = speed_range
+        self.shoot_rate_range = shoot_rate_range
+        self.spawn_y = spawn_y
+        self.random = rng if rng is not None else random
+        self.ids = ids
+        self.alive = 0
+        self.waiting = False
+
+    def next_delay(self):
+        """Seconds until the next spawn."""
+        return self.random.uniform(*self.respawn_time_range)
+
+    def full(self):
+        return self.alive >= self.count
+
+    def spawn(self, enemy_list):
+        """Append a new enemy somewhere in the area and return it."""
+        spawn_x = self.random.uniform(self.center[0] - self.width/2,
+                                      self.center[0] + self.width/2)
+        spawn_z = self.random.uniform(self.center[1] - self.depth/2,
+                                      self.center[1] + self.depth/2)
+        spawn_position = (spawn_x, self.spawn_y, spawn_z)
+        speed = self.random.uniform(self.speed_range[0], self.speed_range[1])
+        shoot_interval = self.random.uniform(self.shoot_rate_range[0], self.shoot_rate_range[1])
+        enemy = Enemy(spawn_position, speed=speed, shoot_interval=shoot_interval,
+                      id=next(self.ids) if self.ids is not None else None)
+        enemy_list.append(enemy)
+        self.alive += 1
+        return enemy
+
+# === Player ==================================================================
+
+class Player(object):
+    def __init__(self, position=(0, 1.5, 5)):
+        self.position = position
+        self.rotation = (0, 0)
+        self.strafe = [0, 0]
+        self.dy = 0
+        self.health = 100
+
+    def look(self, dx, dy, sensitivity=0.15):
+        """Turn by a mouse movement of dx, dy pixels."""
+        rx, ry = self.rotation
+        rx, ry = rx + dx * sensitivity, ry + dy * sensitivity
+        ry = max(-90, min(90, ry))
+        self.rotation = (rx, ry)
+
+    def get_sight_vector(self):
+        x, y = self.rotation
+        m = math.cos(math.radians(y))
+        dy = math.sin(math.radians(y))
+        dx = math.cos(math.radians(x - 90)) * m
+        dz = math.sin(math.radians(x - 90)) * m
+        return (dx, dy, dz)
+
+    def get_motion_vector(self):
+        if any(self.strafe):
+            x, y = self.rotation
+            strafe = math.degrees(math.atan2(*self.strafe))
+            x_angle = math.radians(x + strafe)
+            dx = math.cos(x_angle)
+            dz = math.sin(x_angle)
+        else:
+            dx = 0.0
+            dz = 0.0
+        return (dx, 0.0, dz)
+
+    def get_aabb(self):
+        x, y, z = self.position
+        return (x - 0.5, y, z - 0.5, x + 0.5, y + PLAYER_HEIGHT, z + 0.5)
+
+    def jump(self):
+        if self.dy == 0:
+            self.dy = JUMP_SPEED
+
+# === Simulation ==============================================================
+
+# Sectors loaded around each player, and how far from one a bullet lives.
+LOAD_RADIUS = 5
+# Seconds an enemy that cannot see its player waits before looking again.
+SIGHT_RETRY = 0.25
+
+class Simulation(object):
+    """Everything that happens in a match, stepped at a fixed TICKS_PER_SEC
+       from a seeded RNG. Nothing here touches pyglet, so it can run headless
+       and as fast as the CPU allows; the Window only feeds it input and draws it.
+       Enemies live in an EnemySwarm and are updated together each tick,
+       following a FlowField toward the player around the terrain.
+       They are also filed in enemy_index, a SpatialHash with cells of
+       cell_size, which bullet hits and proximity queries go through.
+       Each tick's phases are timed by profiler, disabled by default, and
+       hits and kills are reported to events, an EventLog.
+       players holds everyone playing, player (the first) included, for a
+       match hosted by a server; enemies go for the nearest of them.
+
+       Input goes through move(), look(), jump() and fire(), which also
+       pass it to recorder if one is set, so a match can be replayed tick
+       for tick from its seed; state_hash() checks that it was.
+       Nothing depends on sectors loaded by anyone else: bullets leaving
+       the LOAD_RADIUS square around every player are dropped.
+
+       Spawns, enemy shots and bullet expiry are deadlines in timers, a
+       TimerWheel on the tick count, so each tick only touches what is due.
+       Enemies and bullets get their timers at the start of the tick after
+       they appear, however they were added; spawners come from
+       add_spawner(), the first of them being enemy_spawner. An enemy
+       only fires if sight, a LineOfSight, finds nothing in the way within
+       LOAD_RADIUS sectors; otherwise it looks again SIGHT_RETRY seconds
+       later."""
+    def __init__(self, world=None, seed=None, cell_size=4, profiler=None, events=None):
+        self.world = world if world is not None else World()
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.dt = 1.0 / TICKS_PER_SEC
+        self.tick = 0
+        self.accumulator = 0.0
+        self.player = Player()
+        self.players = [self.player]
+        self.enemies = EnemySwarm()
+        self.enemy_index = SpatialHash(cell_size)
+        self.bullets = BulletPool()
+        self.enemy_ids = itertools.count()
+        self.recorder = None
+        self.timers = TimerWheel()
+        # The first enemy id and bullet id without a timer yet.
+        self.untimed_enemy = 0
+        self.untimed_bullet = 0
+        self.spawners = []
+        self.spawned_by = {}
+        self.enemy_spawner = self.add_spawner(center=(0, -10),
+                                              width=30, depth=30, count=5,
+                                              respawn_time_range=(2, 6),
+                                              speed_range=(1.5, 5.0),
+                                              shoot_rate_range=(1.0, 3.0),
+                                              spawn_y=-1)
+        self.flow = FlowField(self.world.world, self.enemy_spawner.spawn_y)
+        self.sight = LineOfSight(self.world.world, view_range=LOAD_RADIUS * SECTOR_SIZE)
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self.events = events if events is not None else EventLog()
+
+    def advance(self, dt):
+        """Run as many fixed ticks as fit in dt of wall-clock time and
+           return how many were run. The leftover carries over to the next call."""
+        self.accumulator += min(dt, 0.2)
+        ticks = 0
+        while self.accumulator >= self.dt:
+            self.accumulator -= self.dt
+            self.step()
+            ticks += 1
+        return ticks
+
+    def add_player(self, player=None):
+        """Add another Player to the match and return it."""
+        player = player if player is not None else Player()
+        self.players.append(player)
+        return player
+
+    def add_spawner(self, center, width, depth, count, respawn_time_range, speed_range,
+                    shoot_rate_range, spawn_y=-1):
+        """Add an EnemySpawner with its own area, cap and rate ranges (see
+           EnemySpawner) and return it. Its first spawn is due a random
+           delay from the next tick."""
+        spawner = EnemySpawner(center, width, depth, count, respawn_time_range, speed_range,
+                               shoot_rate_range, spawn_y, rng=self.random, ids=self.enemy_ids)
+        self.timers.schedule(('spawn', len(self.spawners)),
+                             self.tick + to_ticks(spawner.next_delay()) - 1)
+        self.spawners.append(spawner)
+        return spawner
+
+    def remove_player(self, player):
+        if player is self.player:
+            raise ValueError('the first player cannot leave')
+        self.players.remove(player)
+
+    def step(self):
+        dt = self.dt
+        profiler = self.profiler
+        events = self.events
+        tick = self.tick
+        player = self.player
+        players = self.players
+        enemies = self.enemies
+        index = self.enemy_index
+        timers = self.timers
+        with profiler.phase('tick.timers'):
+            self._time_new_entities()
+            expired, shots, spawns = [], None, []
+            for key in timers.pop():
+                kind = key[0]
+                if kind == 'bullets':
+                    expired.append(key[1:])
+                elif kind == 'shots':
+                    shots = timers.take(key)
+                else:
+                    spawns.append(key[1])
+        with profiler.phase('tick.load'):
+            self.world.load_around_all([other.position for other in players], LOAD_RADIUS)
+        with profiler.phase('tick.physics'):
+            m = 8
+            for other in players:
+                for _ in xrange(m):
+                    self._update(dt / m, other)
+
+        with profiler.phase('tick.bullets'):
+            self.bullets.expire(expired)
+            enemy_hits, player_hits = self.bullets.update(
+                dt, index, [other.get_aabb() for other in players], self.world.world)
+            if len(enemy_hits):
+                enemies.damage(enemy_hits, 20)
+                if events.enabled:
+                    rows = enemies.rows(enemy_hits)
+                    for id, health in zip(enemy_hits.tolist(), enemies.healths[rows].tolist()):
+                        events.emit(tick, 'enemy_hit', enemy=id, health=int(health))
+            for i in np.flatnonzero(player_hits).tolist():
+                for _ in xrange(player_hits[i]):
+                    players[i].health -= 10
+                    events.emit(tick, 'player_hit', player=i, health=players[i].health)
+            self._drop_far_bullets()
+
+        with profiler.phase('tick.flow'):
+            self.flow.update(player.position)
+        with profiler.phase('tick.enemies'):
+            targets = [other.position for other in players]
+            enemies.update(dt, targets, None, self.flow)
+            if shots is not None:
+                fired, held = enemies.fire(enemies.live(shots), targets, self.bullets, self.sight)
+                timers.schedule_many('shots', enemies.ids[fired],
+                                     tick + to_ticks(enemies.shoot_intervals[fired]))
+                timers.schedule_many('shots', enemies.ids[held], tick + to_ticks(SIGHT_RETRY))
+            for id in enemies.remove_dead().tolist():
+                events.emit(tick, 'enemy_defeated', enemy=id)
+                index.remove(id)
+                number = self.spawned_by.pop(id, None)
+                if number is not None:
+                    spawner = self.spawners[number]
+                    spawner.alive -= 1
+                    if spawner.waiting:
+                        spawner.waiting = False
+                        timers.schedule(('spawn', number), tick + 1)
+            index.move_many(enemies.ids[:len(enemies)].tolist(), enemies.get_aabbs())
+
+        with profiler.phase('tick.spawn'):
+            spawned = len(enemies)
+            for number in spawns:
+                spawner = self.spawners[number]
+                if spawner.full():
+                    spawner.waiting = True
+                    continue
+                self.spawned_by[spawner.spawn(enemies).id] = number
+                timers.schedule(('spawn', number), tick + to_ticks(spawner.next_delay()))
+            if len(enemies) > spawned:
+                boxes = enemies.get_aabbs()
+                for row in xrange(spawned, len(enemies)):
+                    index.insert(int(enemies.ids[row]), boxes[row])
+        profiler.count('enemies', len(enemies))
+        profiler.count('bullets', len(self.bullets))
+        profiler.count('timers', len(timers))
+        self.tick += 1
+        if self.recorder is not None:
+            self.recorder.stepped(self)
+
+    def _time_new_entities(self):
+        """Give enemies and bullets added since the last tick their timers.
+           Ids only grow, so the new ones are the rows from the first
+           untimed id on. An enemy first fires the number of ticks its
+           shoot interval takes counting this one, and joins the batch of
+           shots due then; a run of bullets with one lifetime shares a
+           single timer over its range of ids. Neither is cancelled when
+           the enemy or bullet goes: those ids are just skipped."""
+        tick = self.tick
+        timers = self.timers
+        enemies = self.enemies
+        n = len(enemies)
+        if n and enemies.ids[n - 1] >= self.untimed_enemy:
+            first = int(np.searchsorted(enemies.ids[:n], self.untimed_enemy))
+            timers.schedule_many('shots', enemies.ids[first:n],
+                                 tick + to_ticks(enemies.shoot_intervals[first:n]) - 1)
+            self.untimed_enemy = int(enemies.ids[n - 1]) + 1
+        bullets = self.bullets
+        n = len(bullets)
+        if n and bullets.ids[n - 1] >= self.untimed_bullet:
+            first = int(np.searchsorted(bullets.ids[:n], self.untimed_bullet))
+            lifetimes = bullets.lifetimes[first:n]
+            starts = [0] + (np.flatnonzero(np.diff(lifetimes)) + 1).tolist()
+            for start, end in zip(starts, starts[1:] + [n - first]):
+                timers.schedule(('bullets', int(bullets.ids[first + start]),
+                                 int(bullets.ids[first + end - 1]) + 1),
+                                tick + to_ticks(lifetimes[start]))
+            self.untimed_bullet = int(bullets.ids[n - 1]) + 1
+
+    def _drop_far_bullets(self):
+        bullets = self.bullets
+        n = len(bullets)
+        if not n:
+            return
+        s = SECTOR_SIZE
+        sectors = np.floor(bullets.positions[:n, [0, 2]] + 0.5) // s
+        centres = np.array([[math.floor(p.position[0] + 0.5) // s, math.floor(p.position[2] + 0.5) // s]
+                            for p in self.players])
+        near = (np.abs(sectors[:, None] - centres[None]) <= LOAD_RADIUS).all(axis=2).any(axis=1)
+        if not near.all():
+            bullets.compact(near)
+
+    def move(self, strafe, player=None):
+        """Set which way player walks: strafe is (forward/back, left/right),
+           each -1, 0 or 1."""
+        player = player if player is not None else self.player
+        player.strafe = list(strafe)
+        if self.recorder is not None:
+            self.recorder.move(self.tick, strafe)
+
+    def look(self, dx, dy, player=None):
+        """Turn player by a mouse movement of dx, dy pixels."""
+        (player if player is not None else self.player).look(dx, dy)
+        if self.recorder is not None:
+            self.recorder.look(self.tick, dx, dy)
+
+    def jump(self, player=None):
+        (player if player is not None else self.player).jump()
+        if self.recorder is not None:
+            self.recorder.jump(self.tick)
+
+    def fire(self, player=None):
+        self.shoot_bullet("player", player)
+        if self.recorder is not None:
+            self.recorder.fire(self.tick)
+
+    def state_hash(self):
+        """A digest of everything that can differ between two runs of the
+           same match: the tick, the players, every enemy and bullet, the
+           RNG and the timers."""
+        h = hashlib.blake2b(digest_size=8)
+        h.update(np.array([self.tick], dtype=np.int64).tobytes())
+        for player in self.players:
+            h.update(np.array(player.position + player.rotation + tuple(player.strafe) +
+                              (player.dy, player.health), dtype=float).tobytes())
+        for pool in (self.enemies, self.bullets):
+            for name in pool._columns():
+                h.update(getattr(pool, name)[:len(pool)].tobytes())
+        h.update(repr(self.random.getstate()).encode())
+        timers = self.timers
+        for key in sorted(timers.deadlines):
+            h.update(repr((key, timers.deadlines[key])).encode())
+            for ids in timers.batches.get(key, ()):
+                h.update(ids.tobytes())
+        h.update(repr([(spawner.alive, spawner.waiting) for spawner in self.spawners]).encode())
+        return h.digest()
+
+    def enemies_near(self, position, radius):
+        """Ids of the enemies whose centre is within radius of position on
+           the x/z plane, nearest first."""
+        x, _, z = position
+        return self.enemy_index.query_radius(x, z, radius)
+
+    def nearest_enemy(self, position, max_radius=SECTOR_SIZE * 4, exclude=None):
+        """Id of the closest enemy other than the id exclude, or None."""
+        x, _, z = position
+        return self.enemy_index.nearest(x, z, max_radius, exclude)
+
+    def _update(self, dt, player=None):
+        player = player if player is not None else self.player
+        speed = WALKING_SPEED
+        d = dt * speed
+        dx, dy, dz = player.get_motion_vector()
+        dx, dy, dz = dx * d, dy * d, dz * d
+        player.dy -= dt * GRAVITY
+        player.dy = max(player.dy, -TERMINAL_VELOCITY)
+        dy += player.dy * dt
+        x, y, z = player.position
+        x, y, z = self.collide((x + dx, y + dy, z + dz), PLAYER_HEIGHT, player)
+        player.position = (x, y, z)
+
+    def collide(self, position, height, player=None):
+        """position moved out of any block it overlaps, for a body height
+           blocks tall. Landing on or bumping into a block stops player's
+           (by default the first player's) vertical speed."""
+        pad = 0.25
+        p = list(position)
+        np_pos = normalize(position)
+        for face in FACES:
+            for i in xrange(3):
+                if not face[i]:
+                    continue
+                d = (p[i] - np_pos[i]) * face[i]
+                if d < pad:
+                    continue
+                for dy in xrange(height):
+                    op = list(np_pos)
+                    op[1] -= dy
+                    op[i] += face[i]
+                    if tuple(op) not in self.world.world:
+                        continue
+                    p[i] -= (d - pad) * face[i]
+                    if face in [(0, -1, 0), (0, 1, 0)]:
+                        (player if player is not None else self.player).dy = 0
+                    break
+        return tuple(p)
+
+    def shoot_bullet(self, owner, player=None):
+        if owner == "player":
+            player = player if player is not None else self.player
+            sight = player.get_sight_vector()
+            pos = (player.position[0] + sight[0] * 0.5,
+                   player.position[1] + sight[1] * 0.5,
+                   player.position[2] + sight[2] * 0.5)
+            self.bullets.spawn(pos, sight, speed=30, owner=PLAYER)
+
+# === Headless Entry Point ====================================================
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the simulation headless.')
+    parser.add_argument('--ticks', type=int, default=TICKS_PER_SEC * 60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--events', action='store_true',
+                        help='print hits and kills as lines of JSON')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='time each phase of a tick and write the summary to PATH, '
+                             'as CSV if it ends in .csv and JSON otherwise')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sim = Simulation(seed=args.seed, profiler=Profiler(window=args.ticks, enabled=bool(args.profile)),
+                     events=EventLog(stream=sys.stdout if args.events else None))
+    built = time.perf_counter()
+    for _ in xrange(args.ticks):
+        sim.step()
+    elapsed = time.perf_counter() - built
+    print('world built in %.2fs, %d ticks in %.2fs (%.0f ticks/sec, %.1fx real time)' % (
+        built - start, args.ticks, elapsed, args.ticks / elapsed,
+        args.ticks / elapsed / TICKS_PER_SEC))
+    if args.profile:
+        sim.profiler.export(args.profile)
+
+if __name__ == '__main__':
+    main()
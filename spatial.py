@@ -0,0 +1,214 @@
+"""Uniform-grid spatial hash over the x/z plane for entity queries."""
+from __future__ import division
+import math
+
+import numpy as np
+
+from raycast import segment_aabb
+
+def cell_key(cx, cz):
+    """Pack integer cell coordinates into one int. cell_keys() computes the
+       same packing for arrays."""
+    return cx * 4294967296 + (cz & 0xFFFFFFFF)
+
+def cell_keys(cx, cz):
+    return cx.astype(np.int64) * 4294967296 + (cz.astype(np.int64) & 0xFFFFFFFF)
+
+class SpatialHash(object):
+    """Entities are axis-aligned boxes (minx, miny, minz, maxx, maxy, maxz)
+       filed under every cell_size x cell_size column their x/z extent
+       overlaps. Boxes live in a slot array so batched queries can test
+       them with NumPy; moving an entity only touches the cell sets when it
+       crosses into a different set of cells."""
+    def __init__(self, cell_size=4, capacity=64):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.slots = {}
+        self.free = []
+        self.boxes = np.zeros((capacity, 6))
+        self.ranges = np.zeros((capacity, 4), dtype=np.int64)
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.used = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, id):
+        return id in self.slots
+
+    def _cell_range(self, box):
+        s = self.cell_size
+        return (int(math.floor(box[0] / s)), int(math.floor(box[2] / s)),
+                int(math.floor(box[3] / s)), int(math.floor(box[5] / s)))
+
+    def _file(self, slot, cell_range, add):
+        cx0, cz0, cx1, cz1 = cell_range
+        for cx in range(cx0, cx1 + 1):
+            for cz in range(cz0, cz1 + 1):
+                key = cell_key(cx, cz)
+                if add:
+                    self.cells.setdefault(key, set()).add(slot)
+                else:
+                    cell = self.cells[key]
+                    cell.discard(slot)
+                    if not cell:
+                        del self.cells[key]
+
+    def insert(self, id, box):
+        if id in self.slots:
+            raise KeyError('entity %r is already in the index' % (id,))
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.used == len(self.ids):
+                self.boxes = np.concatenate([self.boxes, np.zeros_like(self.boxes)])
+                self.ranges = np.concatenate([self.ranges, np.zeros_like(self.ranges)])
+                self.ids = np.concatenate([self.ids, np.full_like(self.ids, -1)])
+            slot = self.used
+            self.used += 1
+        self.slots[id] = slot
+        self.ids[slot] = id
+        self.boxes[slot] = box
+        cell_range = self._cell_range(box)
+        self.ranges[slot] = cell_range
+        self._file(slot, cell_range, True)
+
+    def move(self, id, box):
+        slot = self.slots[id]
+        self.boxes[slot] = box
+        self._refile(slot, self._cell_range(box))
+
+    def move_many(self, ids, boxes):
+        """move() for a batch: ids is a sequence of n ids and boxes an n x 6
+           array. The boxes are written and cell ranges compared in bulk;
+           only the entities that crossed a cell boundary are refiled."""
+        slots = np.fromiter((self.slots[id] for id in ids), dtype=np.int64, count=len(ids))
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 6)
+        self.boxes[slots] = boxes
+        ranges = np.floor(boxes[:, [0, 2, 3, 5]] / self.cell_size).astype(np.int64)
+        changed = np.flatnonzero((ranges != self.ranges[slots]).any(axis=1))
+        for i in changed.tolist():
+            self._refile(int(slots[i]), tuple(ranges[i].tolist()))
+
+    def _refile(self, slot, cell_range):
+        old = tuple(self.ranges[slot].tolist())
+        if cell_range != old:
+            self._file(slot, old, False)
+            self._file(slot, cell_range, True)
+            self.ranges[slot] = cell_range
+
+    def remove(self, id):
+        slot = self.slots.pop(id)
+        self._file(slot, tuple(self.ranges[slot].tolist()), False)
+        self.ids[slot] = -1
+        self.free.append(slot)
+
+    def box(self, id):
+        return tuple(self.boxes[self.slots[id]])
+
+    # --- Queries ------------------------------------------------------------
+
+    def query_box(self, minx, minz, maxx, maxz):
+        """Ids of entities whose box overlaps the given x/z rectangle."""
+        cx0, cz0, cx1, cz1 = self._cell_range((minx, 0, minz, maxx, 0, maxz))
+        slots = set()
+        for cx in range(cx0, cx1 + 1):
+            for cz in range(cz0, cz1 + 1):
+                slots.update(self.cells.get(cell_key(cx, cz), ()))
+        boxes = self.boxes
+        return [int(self.ids[slot]) for slot in slots
+                if boxes[slot, 0] <= maxx and minx <= boxes[slot, 3]
+                and boxes[slot, 2] <= maxz and minz <= boxes[slot, 5]]
+
+    def query_radius(self, x, z, radius):
+        """Ids of entities whose box centre is within radius of (x, z),
+           nearest first."""
+        found = []
+        for id in self.query_box(x - radius, z - radius, x + radius, z + radius):
+            box = self.boxes[self.slots[id]]
+            d2 = ((box[0] + box[3]) / 2 - x) ** 2 + ((box[2] + box[5]) / 2 - z) ** 2
+            if d2 <= radius * radius:
+                found.append((d2, id))
+        found.sort()
+        return [id for _, id in found]
+
+    def nearest(self, x, z, max_radius, exclude=None):
+        """The id whose box centre is closest to (x, z) within max_radius,
+           or None. Searches outward one cell_size ring at a time."""
+        radius = self.cell_size
+        while True:
+            radius = min(radius, max_radius)
+            for id in self.query_radius(x, z, radius):
+                if id != exclude:
+                    return id
+            if radius >= max_radius:
+                return None
+            radius *= 2
+
+    def _candidates(self, rows, keys, dedupe=False):
+        """(rows, slots) for every entity filed under keys[i], paired with
+           rows[i]. When a row has several keys, pass dedupe so that a
+           (row, slot) pair appears once even if the keys share the entity."""
+        empty = np.zeros(0, dtype=np.int64)
+        if not len(keys) or not self.cells:
+            return empty, empty
+        unique, inverse = np.unique(keys, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique) + 1))
+        pair_rows = []
+        pair_slots = []
+        for i, key in enumerate(unique.tolist()):
+            cell = self.cells.get(key)
+            if not cell:
+                continue
+            members = np.fromiter(cell, dtype=np.int64, count=len(cell))
+            group = rows[order[bounds[i]:bounds[i + 1]]]
+            pair_rows.append(np.repeat(group, len(members)))
+            pair_slots.append(np.tile(members, len(group)))
+        if not pair_rows:
+            return empty, empty
+        pair_rows = np.concatenate(pair_rows)
+        pair_slots = np.concatenate(pair_slots)
+        if dedupe:
+            pairs = np.unique(pair_rows * len(self.ids) + pair_slots)
+            pair_rows, pair_slots = np.divmod(pairs, len(self.ids))
+        return pair_rows, pair_slots
+
+    def query_points(self, points):
+        """Batched point-in-box test. points is an n x 3 array. Returns
+           (point_rows, ids): every pair of a point and an entity whose box
+           contains it, ordered by point row then id."""
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        s = self.cell_size
+        keys = cell_keys(np.floor(points[:, 0] / s), np.floor(points[:, 2] / s))
+        rows, slots = self._candidates(np.arange(len(points)), keys)
+        boxes = self.boxes[slots]
+        candidates = points[rows]
+        inside = ((boxes[:, :3] <= candidates) & (candidates <= boxes[:, 3:])).all(axis=1)
+        rows, ids = rows[inside], self.ids[slots[inside]]
+        order = np.lexsort((ids, rows))
+        return rows[order], ids[order]
+
+    def query_segments(self, starts, ends):
+        """Batched segment-vs-box test over every cell each segment's x/z
+           extent overlaps. Returns (segment_rows, ids, t) for each crossing,
+           t being the fraction along the segment where it enters the box,
+           ordered by segment row, then t, then id."""
+        starts = np.asarray(starts, dtype=float).reshape(-1, 3)
+        ends = np.asarray(ends, dtype=float).reshape(-1, 3)
+        s = self.cell_size
+        lo = np.floor(np.minimum(starts, ends) / s).astype(np.int64)
+        hi = np.floor(np.maximum(starts, ends) / s).astype(np.int64)
+        nx = hi[:, 0] - lo[:, 0] + 1
+        nz = hi[:, 2] - lo[:, 2] + 1
+        counts = nx * nz
+        rows = np.repeat(np.arange(len(starts)), counts)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        nz_rows = nz[rows]
+        keys = cell_keys(lo[rows, 0] + offsets // nz_rows, lo[rows, 2] + offsets % nz_rows)
+        rows, slots = self._candidates(rows, keys, dedupe=bool(len(counts)) and counts.max() > 1)
+        t = segment_aabb(starts[rows], ends[rows], self.boxes[slots])
+        crossed = np.isfinite(t)
+        rows, ids, t = rows[crossed], self.ids[slots[crossed]], t[crossed]
+        order = np.lexsort((ids, t, rows))
+        return rows[order], ids[order], t[order]
@@ -0,0 +1,144 @@
+"""All live enemies as one structure of NumPy arrays."""
+from __future__ import division
+
+import numpy as np
+
+from pool import ColumnPool
+
+ENEMY_BULLET_SPEED = 20
+ENEMY_HEALTH = 100
+
+def nearest_players(positions, players):
+    """For each row of positions, the row of players nearest on x/z."""
+    if len(players) == 1:
+        return np.zeros(len(positions), dtype=np.int64)
+    offsets = positions[:, None, [0, 2]] - players[None, :, [0, 2]]
+    return (offsets * offsets).sum(axis=2).argmin(axis=1)
+
+class EnemySwarm(ColumnPool):
+    """Enemies are rows of ids, positions (n x 3), speeds, healths, shoot
+       intervals and the time since each last shot. Ids only ever grow and
+       compaction keeps order, so the ids column stays sorted and an id's
+       row is found by bisection.
+
+       append() takes an Enemy, so an EnemySpawner can fill a swarm exactly
+       as it fills a list; the Enemy is only read, not kept."""
+    COLUMNS = (
+        ('ids', (), np.int64),
+        ('positions', (3,), float),
+        ('speeds', (), float),
+        ('healths', (), float),
+        ('shoot_intervals', (), float),
+        ('since_shot', (), float),
+    )
+
+    def append(self, enemy):
+        if self.count and enemy.id <= self.ids[self.count - 1]:
+            raise ValueError('enemy ids must be appended in increasing order')
+        self._reserve(1)
+        row = self.count
+        self.ids[row] = enemy.id
+        self.positions[row] = enemy.position
+        self.speeds[row] = enemy.speed
+        self.healths[row] = enemy.health
+        self.shoot_intervals[row] = enemy.shoot_interval
+        self.since_shot[row] = enemy.time_since_shot
+        self.count += 1
+
+    def rows(self, ids):
+        """Rows of the given ids, all of which must be live."""
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids[:self.count], ids)
+        if len(rows) and (rows.max() >= self.count or (self.ids[rows] != ids).any()):
+            raise KeyError('not every id is a live enemy')
+        return rows
+
+    def live(self, ids):
+        """Those of ids, sorted, that are still live enemies."""
+        ids = np.sort(np.asarray(ids, dtype=np.int64))
+        n = self.count
+        rows = np.searchsorted(self.ids[:n], ids)
+        found = rows < n
+        found[found] = self.ids[rows[found]] == ids[found]
+        return ids[found]
+
+    def position(self, id):
+        return tuple(self.positions[self.rows([id])[0]].tolist())
+
+    def get_aabbs(self):
+        """Hit boxes of every enemy, n x 6, as Enemy.get_aabb lays them out."""
+        p = self.positions[:self.count]
+        return np.concatenate([p - (0.5, 0, 0.5), p + (0.5, 2, 0.5)], axis=1)
+
+    def update(self, dt, player_position, bullets=None, flow=None):
+        """Steer every enemy toward the player along x/z and, given bullets,
+           fire one batch from those whose since_shot count reached their
+           shoot interval. A Simulation passes no bullets and calls fire()
+           for the enemies its TimerWheel says are due. With a FlowField
+           enemies head for the next cell on their route; without one, or
+           where it has no route, they walk straight at the player.
+           player_position may also be m x 3, one row per player: each
+           enemy then goes for its nearest player, and only the enemies
+           going for the first player, whom the flow field leads to, follow
+           the field."""
+        n = self.count
+        if not n:
+            return
+        positions = self.positions[:n]
+        players = np.asarray(player_position, dtype=float).reshape(-1, 3)
+        targets = nearest_players(positions, players)
+        goals = players[targets][:, [0, 2]]
+        if flow is not None:
+            cells, routed = flow.next_cells(positions)
+            routed &= targets == 0
+            goals = np.where(routed[:, None], cells, goals)
+        heading = goals - positions[:, [0, 2]]
+        dist = np.sqrt((heading * heading).sum(axis=1))
+        moving = dist > 0
+        heading[moving] /= dist[moving, None]
+        step = self.speeds[:n] * dt
+        positions[:, 0] += heading[:, 0] * step
+        positions[:, 2] += heading[:, 1] * step
+
+        if bullets is None:
+            return
+        since_shot = self.since_shot[:n]
+        since_shot += dt
+        shooters = np.flatnonzero(since_shot >= self.shoot_intervals[:n])
+        if len(shooters):
+            since_shot[shooters] = 0.0
+            self._shoot(shooters, players[targets[shooters]], bullets)
+
+    def fire(self, ids, player_position, bullets, sight=None):
+        """Fire one bullet from each enemy in ids, all live, at its nearest
+           player, or with a LineOfSight only from those that can see it.
+           Returns (rows that fired, rows that held their shot)."""
+        rows = self.rows(ids)
+        if not len(rows):
+            return rows, rows
+        players = np.asarray(player_position, dtype=float).reshape(-1, 3)
+        targets = players[nearest_players(self.positions[rows], players)]
+        if sight is None:
+            self._shoot(rows, targets, bullets)
+            return rows, rows[:0]
+        seen = sight.query(self.positions[rows] + (0, 1, 0), targets)
+        self._shoot(rows[seen], targets[seen], bullets)
+        return rows[seen], rows[~seen]
+
+    def _shoot(self, rows, targets, bullets):
+        if len(rows):
+            aim_from = self.positions[rows] + (0, 1, 0)
+            bullets.spawn_many(aim_from, targets - aim_from, ENEMY_BULLET_SPEED, self.ids[rows])
+
+    def damage(self, ids, amount):
+        """Take amount off the health of each id, once per occurrence."""
+        np.subtract.at(self.healths, self.rows(ids), amount)
+
+    def remove_dead(self):
+        """Drop every enemy whose health has run out and return their ids."""
+        dead = self.healths[:self.count] <= 0
+        if not dead.any():
+            return np.zeros(0, dtype=np.int64)
+        ids = self.ids[:self.count][dead]
+        self.compact(~dead)
+        return ids
@@ -0,0 +1,102 @@
+"""Seeded terrain generators that produce one sector's blocks at a time."""
+from __future__ import division
+
+import numpy as np
+
+from world import (SECTOR_SIZE, WORLD_BOTTOM, WORLD_HEIGHT, GRASS, SAND, STONE,
+                   block_id)
+
+# Block heights of each layer of a chunk array, shaped to broadcast over [y, z, x].
+LAYER_Y = np.arange(WORLD_BOTTOM, WORLD_BOTTOM + WORLD_HEIGHT)[:, None, None]
+
+def sector_columns(sector):
+    """World x and z of every column of sector, as two s x s arrays [z, x]."""
+    s = SECTOR_SIZE
+    sx, _, sz = sector
+    z, x = np.mgrid[sz * s:(sz + 1) * s, sx * s:(sx + 1) * s]
+    return x, z
+
+class FlatArenaGenerator(object):
+    """The original map: a grass floor over stone from -size to size on x and
+       z, walled in with stone five blocks high. Nothing outside it."""
+    def __init__(self, size=80):
+        self.size = size
+
+    def generate(self, sector):
+        n = self.size
+        x, z = sector_columns(sector)
+        inside = (abs(x) <= n) & (abs(z) <= n)
+        wall = inside & ((abs(x) == n) | (abs(z) == n))
+        blocks = np.zeros((WORLD_HEIGHT, SECTOR_SIZE, SECTOR_SIZE), dtype=np.uint8)
+        y = LAYER_Y
+        blocks[(y == -3) & inside] = block_id(STONE)
+        blocks[(y == -2) & inside] = block_id(GRASS)
+        blocks[(y >= -2) & (y <= 2) & wall] = block_id(STONE)
+        return blocks
+
+def lattice(seed, ix, iz):
+    """A repeatable pseudo-random value in [0, 1) for each integer lattice
+       point, from a 64-bit integer hash of (seed, ix, iz)."""
+    h = (ix.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+         ^ iz.astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)
+         ^ np.uint64(seed * 0x165667B19E3779F9 & 0xFFFFFFFFFFFFFFFF))
+    h ^= h >> np.uint64(31)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(29)
+    return (h >> np.uint64(11)).astype(float) / 2.0 ** 53
+
+def value_noise(seed, x, z, scale):
+    """Smoothly interpolated lattice values every scale blocks, in [0, 1)."""
+    x = x / scale
+    z = z / scale
+    ix = np.floor(x).astype(np.int64)
+    iz = np.floor(z).astype(np.int64)
+    fx = x - ix
+    fz = z - iz
+    fx = fx * fx * (3 - 2 * fx)
+    fz = fz * fz * (3 - 2 * fz)
+    v00 = lattice(seed, ix, iz)
+    v10 = lattice(seed, ix + 1, iz)
+    v01 = lattice(seed, ix, iz + 1)
+    v11 = lattice(seed, ix + 1, iz + 1)
+    top = v00 + (v10 - v00) * fx
+    bottom = v01 + (v11 - v01) * fx
+    return top + (bottom - top) * fz
+
+class HillsGenerator(object):
+    """Rolling hills from a few octaves of value noise: stone with a grass
+       top, and sand where the ground dips below sand_level. Each column
+       depends only on the seed and its position, so sectors come out the
+       same in any order and on any run."""
+    def __init__(self, seed=0, base=-3, amplitude=8, scale=48, octaves=3, sand_level=-6):
+        self.seed = seed
+        self.base = base
+        self.amplitude = amplitude
+        self.scale = scale
+        self.octaves = octaves
+        self.sand_level = sand_level
+
+    def heights(self, sector):
+        """Height of the top block of every column of sector, s x s [z, x]."""
+        x, z = sector_columns(sector)
+        total = np.zeros(x.shape)
+        weight = 1.0
+        weights = 0.0
+        for octave in range(self.octaves):
+            total += weight * value_noise(self.seed * 31 + octave, x, z, self.scale / 2 ** octave)
+            weights += weight
+            weight /= 2
+        heights = self.base + self.amplitude * (2 * total / weights - 1)
+        return np.clip(np.round(heights).astype(np.int64),
+                       WORLD_BOTTOM, WORLD_BOTTOM + WORLD_HEIGHT - 1)
+
+    def generate(self, sector):
+        heights = self.heights(sector)[None]
+        y = LAYER_Y
+        blocks = np.zeros((WORLD_HEIGHT, SECTOR_SIZE, SECTOR_SIZE), dtype=np.uint8)
+        blocks[y < heights] = block_id(STONE)
+        top = y == heights
+        low = heights <= self.sand_level
+        blocks[top & low] = block_id(SAND)
+        blocks[top & ~low] = block_id(GRASS)
+        return blocks
@@ -0,0 +1,84 @@
+from __future__ import division
+
+import numpy as np
+
+from world import BlockMap, STONE
+from spatial import SpatialHash
+from swarm import EnemySwarm
+from simulation import Enemy
+from bullets import PLAYER, BulletPool
+
+NO_PLAYER = (1000, 1000, 1000, 1001, 1002, 1001)
+
+def enemy_box(x, z):
+    return (x - 0.5, 0, z - 0.5, x + 0.5, 2, z + 0.5)
+
+def test_expire_drops_id_ranges():
+    bullets = BulletPool()
+    for i in range(6):
+        bullets.spawn((i, 1, 0), (1, 0, 0), 10, PLAYER)
+    assert bullets.expire([(1, 3), (5, 9)]) == 3
+    assert bullets.ids[:len(bullets)].tolist() == [0, 3, 4]
+    # Ranges whose bullets are already gone cost nothing.
+    assert bullets.expire([(1, 3)]) == 0
+    assert bullets.expire([]) == 0
+    assert bullets.expire([(0, 5)]) == 3 and not len(bullets)
+
+def test_owners():
+    index = SpatialHash()
+    index.insert(7, enemy_box(2, 0))
+    bullets = BulletPool()
+    # An enemy bullet through an enemy and a player bullet through the player.
+    bullets.spawn((0, 1, 0), (1, 0, 0), 60, 7)
+    bullets.spawn((0, 1, 5), (1, 0, 0), 60, PLAYER)
+    enemy_hits, player_hits = bullets.update(0.1, index, (1.5, 0, 4.5, 2.5, 2, 5.5))
+    assert enemy_hits.tolist() == [] and player_hits == 0
+    assert len(bullets) == 2
+
+def test_damage_once_per_hit():
+    swarm = EnemySwarm()
+    swarm.append(Enemy((2, 0, 0), id=1))
+    swarm.append(Enemy((4, 0, 0), id=2))
+    index = SpatialHash()
+    for id, box in zip([1, 2], swarm.get_aabbs()):
+        index.insert(id, box)
+    bullets = BulletPool()
+    # Two bullets through both enemies: each stops in the first.
+    bullets.spawn((0, 1, 0), (1, 0, 0), 60, PLAYER)
+    bullets.spawn((0, 1.5, 0), (1, 0, 0), 60, PLAYER)
+    enemy_hits, _ = bullets.update(0.1, index, NO_PLAYER)
+    assert enemy_hits.tolist() == [1, 1] and not len(bullets)
+    swarm.damage(enemy_hits, 20)
+    assert swarm.healths[:2].tolist() == [60, 100]
+    enemy_hits, _ = bullets.update(0.1, index, NO_PLAYER)
+    assert not len(enemy_hits)
+
+def test_swept_hits_within_one_tick():
+    blocks = BlockMap()
+    blocks[10, 1, 0] = STONE
+    index = SpatialHash()
+    index.insert(3, enemy_box(5, 4))
+    bullets = BulletPool()
+    # Each path for the tick runs 30 blocks, well past what it hits, so
+    # testing only where the bullets end up would miss all three.
+    bullets.spawn((0, 1, 0), (1, 0, 0), 300, PLAYER)
+    bullets.spawn((0, 1, 4), (1, 0, 0), 300, PLAYER)
+    bullets.spawn((0, 1, 8), (1, 0, 0), 300, 3)
+    players = np.array([enemy_box(6, 8), enemy_box(-50, 0)])
+    enemy_hits, player_hits = bullets.update(0.1, index, players, blocks)
+    assert enemy_hits.tolist() == [3]
+    assert player_hits.tolist() == [1, 0]
+    assert not len(bullets)
+
+def test_blocks_shield_what_is_behind_them():
+    blocks = BlockMap()
+    blocks[3, 1, 0] = STONE
+    blocks[3, 1, 8] = STONE
+    index = SpatialHash()
+    index.insert(3, enemy_box(5, 0))
+    bullets = BulletPool()
+    bullets.spawn((0, 1, 0), (1, 0, 0), 300, PLAYER)
+    bullets.spawn((0, 1, 8), (1, 0, 0), 300, 3)
+    enemy_hits, player_hits = bullets.update(0.1, index, enemy_box(6, 8), blocks)
+    assert not len(enemy_hits) and player_hits == 0
+    assert not len(bullets)
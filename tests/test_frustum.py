@@ -0,0 +1,53 @@
+from __future__ import division
+import random
+
+from world import SECTOR_SIZE, WORLD_BOTTOM, WORLD_HEIGHT, sectorize
+from frustum import Frustum, sector_box, sector_ring, view_range
+from simulation import Player
+
+ASPECT = 4 / 3
+
+def visible(position, rotation, sector, far=view_range(4)):
+    frustum = Frustum.from_camera(position, rotation, ASPECT, far)
+    return bool(frustum.visible([sector_box(sector)])[0])
+
+def test_sector_box():
+    s = SECTOR_SIZE
+    assert sector_box((0, 0, 0)) == (-0.5, WORLD_BOTTOM - 0.5, -0.5,
+                                     s - 0.5, WORLD_BOTTOM + WORLD_HEIGHT - 0.5, s - 0.5)
+    x0, _, z0, x1, _, z1 = sector_box((-1, 0, 2))
+    assert (x0, x1, z0, z1) == (-s - 0.5, -0.5, 2 * s - 0.5, 3 * s - 0.5)
+    # Every block centre in a sector lies in its box, and none beside it.
+    assert sectorize((x0 + 0.5, 0, z0 + 0.5)) == (-1, 0, 2)
+    assert sectorize((x1 + 0.5, 0, z1 + 0.5)) == (0, 0, 3)
+
+def test_sector_ring():
+    ring = sector_ring((2, 0, -1), 4)
+    assert (2, 0, -1) in ring and (6, 0, -1) in ring and (6, 0, 2) in ring
+    assert (7, 0, -1) not in ring and (6, 0, 3) not in ring
+    assert len(sector_ring((0, 0, 0), 0)) == 1
+
+def test_known_poses():
+    # Facing -z from the origin.
+    assert visible((0, 0, 0), (0, 0), (0, 0, -2))
+    assert not visible((0, 0, 0), (0, 0), (0, 0, 2))
+    assert not visible((0, 0, 0), (0, 0), (0, 0, -6))
+    assert not visible((0, 0, 0), (0, 0), (-3, 0, -1))
+    assert visible((0, 0, 0), (0, 0), (-3, 0, -3))
+    # Facing +x, then straight down: the own sector is always drawn.
+    assert visible((0, 0, 0), (90, 0), (2, 0, 0))
+    assert not visible((0, 0, 0), (90, 0), (-2, 0, 0))
+    assert visible((8, 10, 8), (0, -90), (0, 0, 0))
+
+def test_ahead_and_behind():
+    rng = random.Random(0)
+    player = Player()
+    for _ in range(200):
+        position = (rng.uniform(-100, 100), rng.uniform(-5, 10), rng.uniform(-100, 100))
+        player.rotation = (rng.uniform(-180, 180), rng.uniform(-20, 20))
+        frustum = Frustum.from_camera(position, player.rotation, ASPECT, view_range(4))
+        vector = player.get_sight_vector()
+        assert frustum.contains([p + 0.5 * v for p, v in zip(position, vector)])
+        ahead = sectorize([p + 40 * v for p, v in zip(position, vector)])
+        behind = sectorize([p - 40 * v for p, v in zip(position, vector)])
+        assert frustum.visible([sector_box(ahead), sector_box(behind)]).tolist() == [True, False]
@@ -0,0 +1,69 @@
+from __future__ import division
+import os, struct
+
+import pytest
+
+from world import World, STONE
+from mesher import MESHERS, MESHER_VERSION, snapshot_sector
+from meshcache import HEADER, MAGIC, MeshCache, dump_mesh, load_mesh, mesh_key
+
+def arena():
+    world = World(40)
+    world.load_all()
+    world.add_block((3, 0, 3), STONE)
+    return world
+
+def parts(mesh):
+    return dict((tile, (list(vertices), list(tex_coords)))
+                for tile, (vertices, tex_coords) in mesh.parts.items())
+
+@pytest.mark.parametrize('mesher', sorted(MESHERS))
+def test_dump_and_load(mesher):
+    world = arena()
+    mesh = MESHERS[mesher](snapshot_sector(world.world, (0, 0, 0)))
+    loaded = load_mesh((0, 0, 0), dump_mesh(mesh))
+    assert loaded.sector == (0, 0, 0)
+    assert parts(loaded) == parts(mesh) and loaded.quads == mesh.quads
+
+def test_other_versions_are_not_loaded():
+    world = arena()
+    data = dump_mesh(MESHERS['culled'](snapshot_sector(world.world, (0, 0, 0))))
+    _, _, count = HEADER.unpack_from(data)
+    older = HEADER.pack(MAGIC, MESHER_VERSION + 1, count) + data[HEADER.size:]
+    assert load_mesh((0, 0, 0), older) is None
+    assert load_mesh((0, 0, 0), b'XXXX' + data[4:]) is None
+
+def test_keys_follow_content():
+    world = arena()
+    snapshot = snapshot_sector(world.world, (0, 0, 0))
+    key = mesh_key(snapshot, 'culled')
+    assert key == mesh_key(snapshot_sector(world.world, (0, 0, 0)), 'culled')
+    assert key != mesh_key(snapshot, 'greedy')
+    world.remove_block((3, 0, 3))
+    assert key != mesh_key(snapshot_sector(world.world, (0, 0, 0)), 'culled')
+
+def test_disk_tier(tmp_path):
+    directory = str(tmp_path)
+    world = arena()
+    sectors = sorted(world.sectors)[:6]
+    meshes = [MESHERS['culled'](snapshot_sector(world.world, sector)) for sector in sectors]
+    keys = ['%040d' % i for i in range(len(sectors))]
+    cache = MeshCache(directory, capacity=2, disk_capacity=4)
+    for key, mesh in zip(keys[:4], meshes):
+        cache.put(key, mesh)
+    # A fresh cache reads from disk; the read makes keys[0] the newest file.
+    cache = MeshCache(directory, capacity=2, disk_capacity=4)
+    assert parts(cache.get(keys[0], sectors[0])) == parts(meshes[0])
+    assert cache.stats()['disk_hits'] == 1
+    for key, mesh in zip(keys[4:], meshes[4:]):
+        cache.put(key, mesh)
+    names = sorted(name[:-len('.mesh')] for name in os.listdir(directory))
+    assert names == sorted([keys[0], keys[3], keys[4], keys[5]])
+    assert cache.get(keys[1], sectors[1]) is None
+    # Reopening with a smaller cap prunes on startup, oldest first.
+    cache = MeshCache(directory, disk_capacity=2)
+    assert len(os.listdir(directory)) == 2 and cache.stats()['on_disk'] == 2
+    # A corrupt file is a miss, not an error.
+    with open(os.path.join(directory, os.listdir(directory)[0]), 'wb') as f:
+        f.write(struct.pack('<I', 0))
+    assert sum(cache.get(key, (0, 0, 0)) is None for key in keys) == len(keys) - 1
@@ -0,0 +1,58 @@
+from __future__ import division
+
+import numpy as np
+
+from world import World, FACES
+from terrain import HillsGenerator
+from mesher import MESHERS, build_culled, build_greedy, snapshot_sector, visible_faces
+
+def hills():
+    world = World(generator=HillsGenerator(seed=7))
+    world.load_around((0, 0, 0), radius=2)
+    return world
+
+def exposed_faces(world, sector):
+    """Faces of blocks in sector with an empty neighbour, by asking the
+       world about each neighbour rather than reading the masks."""
+    count = 0
+    for x, y, z in world.sectors[sector]:
+        for dx, dy, dz in FACES:
+            if (x + dx, y + dy, z + dz) not in world.world:
+                count += 1
+    return count
+
+def face_area(mesh):
+    """Total area of the quads in mesh."""
+    total = 0.0
+    for vertices, _ in mesh.parts.values():
+        corners = np.asarray(vertices, dtype=float).reshape(-1, 4, 3)
+        total += np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0],
+                                         corners[:, 3] - corners[:, 0]), axis=1).sum()
+    return total
+
+def test_meshers_are_registered():
+    assert MESHERS['culled'] is build_culled
+    assert MESHERS['greedy'] is build_greedy
+
+def test_culled_quads_match_exposed_faces():
+    world = hills()
+    inner = [(sx, 0, sz) for sx in range(-1, 2) for sz in range(-1, 2)]
+    for sector in inner:
+        snapshot = snapshot_sector(world.world, sector)
+        faces = sum(len(faces) for _, _, _, _, faces in visible_faces(snapshot))
+        assert faces == exposed_faces(world, sector)
+        assert build_culled(snapshot).quads == faces
+
+def test_greedy_merges_the_same_faces():
+    world = hills()
+    culled = greedy = 0
+    for sector in world.sectors:
+        snapshot = snapshot_sector(world.world, sector)
+        a, b = build_culled(snapshot), build_greedy(snapshot)
+        assert b.quads <= a.quads
+        assert abs(face_area(a) - face_area(b)) < 1e-6
+        if a.quads:
+            assert b.bounds == a.bounds
+        culled += a.quads
+        greedy += b.quads
+    assert greedy * 2 < culled
@@ -0,0 +1,49 @@
+from __future__ import division
+
+from world import World, STONE
+from mesher import build_culled, snapshot_sector
+from meshpool import MeshWorkerPool
+
+def same_mesh(a, b):
+    return a.sector == b.sector and dict(
+        (key, (list(v), list(t))) for key, (v, t) in a.parts.items()) == dict(
+        (key, (list(v), list(t))) for key, (v, t) in b.parts.items())
+
+def test_one_mesh_per_sector():
+    world = World(40)
+    world.load_all()
+    sectors = sorted(world.sectors)
+    pool = MeshWorkerPool(processes=False, workers=2)
+    try:
+        for sector in sectors:
+            pool.submit(snapshot_sector(world.world, sector))
+        pool.wait()
+        meshes = list(pool.completed())
+        assert sorted(mesh.sector for mesh in meshes) == sectors
+        for mesh in meshes:
+            assert same_mesh(mesh, build_culled(snapshot_sector(world.world, mesh.sector)))
+        assert pool.queue_depth == 0 and pool.stats()['submitted'] == len(sectors)
+    finally:
+        pool.shutdown()
+
+def test_cancel_and_resubmit_drop_stale_results():
+    world = World(40)
+    world.load_all()
+    pool = MeshWorkerPool(processes=False, workers=1)
+    try:
+        stale = snapshot_sector(world.world, (0, 0, 0))
+        pool.submit(stale)
+        pool.submit(snapshot_sector(world.world, (1, 0, 0)))
+        pool.cancel((1, 0, 0))
+        world.add_block((3, 5, 3), STONE)
+        fresh = snapshot_sector(world.world, (0, 0, 0))
+        pool.submit(fresh)
+        pool.wait()
+        meshes = list(pool.completed())
+        assert [mesh.sector for mesh in meshes] == [(0, 0, 0)]
+        assert same_mesh(meshes[0], build_culled(fresh))
+        assert not same_mesh(meshes[0], build_culled(stale))
+        assert pool.cancelled == 2
+        assert list(pool.completed()) == []
+    finally:
+        pool.shutdown()
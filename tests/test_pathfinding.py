@@ -0,0 +1,47 @@
+from __future__ import division
+
+from world import World, STONE
+from pathfinding import FlowField
+
+def walled():
+    """The arena with a wall across z = 0 from x = -10 to 10, and a closed
+       3 x 3 room around (20, 20)."""
+    world = World(40)
+    world.load_all()
+    world.fill_region((-10, -1, 0), (10, 0, 0), STONE)
+    world.fill_region((18, -1, 18), (22, 0, 22), STONE)
+    world.clear_region((19, -1, 19), (21, 0, 21))
+    return world
+
+def test_routes_around_the_wall():
+    world = walled()
+    field = FlowField(world.world, -1)
+    assert field.update((0, -1, -5))
+    assert not field.update((0.2, -1, -5.2))
+    x0, z0 = field.origin
+    # Straight through is 10 cells; around either end of the wall is 32.
+    assert field.distance[5 - z0, 0 - x0] == 32
+    assert field.distance[0 - z0, 0 - x0] == float('inf')
+    position = (0, -1, 5)
+    for _ in range(40):
+        (cell,), (routed,) = field.next_cells([position])
+        if not routed:
+            break
+        x, z = cell.tolist()
+        assert not (-10 <= x <= 10 and z == 0)
+        position = (x, -1, z)
+    assert position == (0, -1, -5)
+
+def test_unreachable_cells():
+    world = walled()
+    field = FlowField(world.world, -1)
+    field.update((0, -1, -5))
+    x0, z0 = field.origin
+    assert field.walkable[20 - z0, 20 - x0]
+    assert field.distance[20 - z0, 20 - x0] == float('inf')
+    (_, routed) = field.next_cells([(20, -1, 20), (30, -1, 30), (0, -1, -5)])
+    assert routed.tolist() == [False, True, False]
+    # The field follows the wall coming down.
+    world.clear_region((18, -1, 18), (22, 0, 22))
+    assert field.update((0, -1, -5))
+    assert field.distance[20 - z0, 20 - x0] < float('inf')
@@ -0,0 +1,102 @@
+from __future__ import division
+import math, random
+
+import numpy as np
+
+from world import BlockMap, World, STONE, raycast
+from raycast import block_ids, raycast_batch, segments_clear
+
+def scattered(seed=0, count=400):
+    """A BlockMap with blocks strewn around the origin, across sectors."""
+    rng = random.Random(seed)
+    blocks = BlockMap()
+    for _ in range(count):
+        blocks[rng.randint(-20, 20), rng.randint(-8, 8), rng.randint(-20, 20)] = STONE
+    return rng, blocks
+
+def random_rays(rng, n):
+    origins = [(rng.uniform(-15, 15), rng.uniform(-6, 6), rng.uniform(-15, 15)) for _ in range(n)]
+    vectors = [(rng.gauss(0, 1), rng.gauss(0, 1), rng.gauss(0, 1)) for _ in range(n)]
+    return origins, vectors
+
+def both(blocks, origin, vector, max_distance=8):
+    """The scalar and the batched answer for one ray, in the scalar form."""
+    hit, cells, normals, distances = raycast_batch(blocks, [origin], [vector], max_distance)
+    batched = (None, None, None)
+    if hit[0]:
+        batched = (tuple(cells[0].tolist()), tuple(normals[0].tolist()), float(distances[0]))
+    return raycast(blocks, origin, vector, max_distance), batched
+
+def test_world_raycast():
+    world = World(40)
+    world.load_all()
+    block, normal, distance = world.raycast((0, 3, 0), (0, -1, 0))
+    assert block == (0, -2, 0) and normal == (0, 1, 0) and abs(distance - 4.5) < 1e-9
+    assert world.hit_test((0, 3, 0), (0, -1, 0)) == ((0, -2, 0), (0, -1, 0))
+    assert world.hit_test((0, 3, 0), (0, 1, 0)) == (None, None)
+
+def test_axis_aligned():
+    blocks = BlockMap()
+    blocks[3, 0, 0] = STONE
+    blocks[0, 0, -4] = STONE
+    blocks[0, 5, 0] = STONE
+    for vector, expected in [((1, 0, 0), ((3, 0, 0), (-1, 0, 0), 2.5)),
+                             ((0, 0, -1), ((0, 0, -4), (0, 0, 1), 3.5)),
+                             ((0, 1, 0), ((0, 5, 0), (0, -1, 0), 4.5)),
+                             ((-1, 0, 0), (None, None, None))]:
+        scalar, batched = both(blocks, (0, 0, 0), vector)
+        assert scalar == batched == expected
+
+def test_exact_corners_and_inside():
+    blocks = BlockMap()
+    blocks[1, 1, 0] = STONE
+    # Through the edge between (1, 0, 0) and (0, 1, 0), and through the
+    # corner shared by eight cells: both walks step x first on a tie.
+    scalar, batched = both(blocks, (0, 0, 0), (1, 1, 0))
+    assert scalar == batched
+    assert scalar[:2] == ((1, 1, 0), (0, -1, 0)) and abs(scalar[2] - math.sqrt(0.5)) < 1e-9
+    corner = BlockMap()
+    corner[2, 2, 2] = STONE
+    scalar, batched = both(corner, (0, 0, 0), (1, 1, 1))
+    assert scalar == batched
+    assert scalar[0] == (2, 2, 2) and abs(scalar[2] - 1.5 * math.sqrt(3)) < 1e-9
+    # Starting inside a block hits it at once, with no face.
+    assert both(blocks, (1.3, 0.8, 0.1), (1, 0, 0)) == (((1, 1, 0), (0, 0, 0), 0.0),) * 2
+
+def test_scalar_and_batched_agree():
+    rng, blocks = scattered()
+    origins, vectors = random_rays(rng, 500)
+    hit, cells, normals, distances = raycast_batch(blocks, origins, vectors, 12)
+    for i, (origin, vector) in enumerate(zip(origins, vectors)):
+        block, normal, distance = raycast(blocks, origin, vector, 12)
+        assert bool(hit[i]) == (block is not None)
+        if block is not None:
+            assert tuple(cells[i].tolist()) == block
+            assert tuple(normals[i].tolist()) == normal
+            assert abs(distances[i] - distance) < 1e-9
+
+def test_batched_against_fine_steps():
+    rng, blocks = scattered(1)
+    origins, vectors = random_rays(rng, 200)
+    hit, cells, _, distances = raycast_batch(blocks, origins, vectors, 12)
+    steps = np.arange(0, 12, 1e-3)
+    for i, (origin, vector) in enumerate(zip(origins, vectors)):
+        direction = np.array(vector) / np.linalg.norm(vector)
+        points = np.floor(np.array(origin) + steps[:, None] * direction + 0.5)
+        solid = np.flatnonzero(block_ids(blocks, points))
+        assert bool(hit[i]) == bool(len(solid))
+        if len(solid):
+            assert tuple(points[solid[0]].tolist()) == tuple(cells[i].tolist())
+            assert abs(steps[solid[0]] - distances[i]) <= 1e-3
+
+def test_segments_clear_against_dda():
+    rng, blocks = scattered(2)
+    starts, _ = random_rays(rng, 2000)
+    ends, _ = random_rays(rng, 2000)
+    clear = segments_clear(blocks, starts, ends)
+    for start, end, seen in zip(starts, ends, clear.tolist()):
+        vector = [b - a for a, b in zip(start, end)]
+        length = math.sqrt(sum(c * c for c in vector))
+        block, _, _ = raycast(blocks, start, vector, length)
+        assert seen == (block is None)
+    assert 0 < clear.sum() < len(clear)
@@ -0,0 +1,59 @@
+from __future__ import division
+import random
+
+import pytest
+
+from world import World, STONE, GRASS
+from region import RegionFile, RegionStore, region_of, REGION_SIZE
+
+def same_blocks(a, b):
+    """Whether two worlds have the same sectors holding the same blocks and masks."""
+    if set(a.sectors) != set(b.sectors):
+        return False
+    return all(a.sectors[s].blocks == b.sectors[s].blocks and
+               a.world.masks_of(a.sectors[s]) == b.world.masks_of(b.sectors[s])
+               for s in a.sectors)
+
+def test_region_of():
+    assert region_of((0, 0, 0)) == ((0, 0), 0)
+    assert region_of((-1, 0, 1)) == ((-1, 0), REGION_SIZE + REGION_SIZE - 1)
+
+def test_round_trip(tmp_path):
+    directory = str(tmp_path / 'trip')
+    rng = random.Random(0)
+    world = World(40, store=RegionStore(directory))
+    world.load_all()
+    world.fill_region((-10, -1, -10), (10, 3, 10), STONE)
+    world.replace_region((-10, 3, -10), (10, 3, 10), STONE, GRASS)
+    for _ in range(200):
+        world.add_block((rng.randint(-40, 40), rng.randint(-1, 6), rng.randint(-40, 40)), STONE)
+    edited = set(world.world.edited)
+    assert len(edited) > 30
+    assert world.save() == len(edited) and world.store.written == len(edited)
+    world.add_block((30, 5, 30), STONE)
+    world.remove_block((0, 3, 0))
+    # Only the two sectors edited since are written again.
+    assert world.save() == 2
+    world.store.close()
+
+    copy = World(40, store=RegionStore(directory))
+    copy.load_all()
+    assert same_blocks(world, copy)
+    assert copy.world[30, 5, 30] == STONE and (0, 3, 0) not in copy.world
+    copy.store.close()
+
+def test_unloaded_edits_are_saved(tmp_path):
+    world = World(40, max_sectors=4, store=RegionStore(str(tmp_path)))
+    world.add_block((0, 5, 0), STONE)
+    world.load_around((100, 0, 100), radius=1)
+    assert (0, 0, 0) not in world.sectors
+    world.load_sectors([(0, 0, 0)])
+    assert world.world[0, 5, 0] == STONE
+    world.store.close()
+
+def test_rejects_other_files(tmp_path):
+    path = str(tmp_path / 'r.0.0.region')
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 64)
+    with pytest.raises(ValueError):
+        RegionFile(path)
@@ -0,0 +1,96 @@
+from __future__ import division
+
+import pytest
+
+from world import TICKS_PER_SEC
+from replay import (HEADER, MAGIC, FORMAT_VERSION, RECORD, PAYLOADS, FLAT, HASH, END,
+                    Recorder, Divergence, simulation_for, read_log, replay)
+
+TICKS = 240
+INTERVAL = 30
+
+def record(path, seed=7):
+    """Play a short scripted match on a small flat arena, recording it to
+       path. Returns the Simulation."""
+    sim = simulation_for(seed, FLAT, 40)
+    sim.recorder = Recorder(str(path), seed, FLAT, 40, hash_interval=INTERVAL)
+    for tick in range(TICKS):
+        if tick % 60 == 0:
+            sim.move(((-1, 0), (0, 1), (1, -1), (0, 0))[tick // 60 % 4])
+        if tick % 9 == 0:
+            sim.look(11 - tick % 23, tick % 7 - 3)
+        if tick % 25 == 0:
+            sim.fire()
+        if tick == 100:
+            sim.jump()
+        sim.step()
+    sim.recorder.close(sim)
+    return sim
+
+def hash_offsets(data):
+    """Byte offsets of the payloads of the HASH records in a log."""
+    offsets = []
+    offset = HEADER.size
+    while offset < len(data):
+        kind = RECORD.unpack_from(data, offset)[1]
+        offset += RECORD.size
+        if kind == HASH:
+            offsets.append(offset)
+        offset += PAYLOADS[kind].size if kind in PAYLOADS else 0
+    return offsets
+
+@pytest.mark.parametrize('seed', [7, -1, 2 ** 63 - 1])
+def test_replay_matches_recording(tmp_path, seed):
+    path = tmp_path / 'match.fpsi'
+    sim = record(path, seed)
+    replayed, checked, elapsed = replay(str(path))
+    assert replayed.tick == sim.tick == TICKS
+    assert replayed.state_hash() == sim.state_hash()
+    assert checked == TICKS // INTERVAL + 1
+    assert read_log(str(path))[0] == (seed, FLAT, 40)
+    assert read_log(str(path))[1][-1] == (TICKS, END, ())
+
+def test_tampered_hash_diverges(tmp_path):
+    path = tmp_path / 'match.fpsi'
+    record(path)
+    data = bytearray(path.read_bytes())
+    offset = hash_offsets(data)[2]
+    data[offset] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with pytest.raises(Divergence) as error:
+        replay(str(path))
+    assert error.value.tick == 3 * INTERVAL
+    # Without the check it still plays to the end.
+    assert replay(str(path), check=False)[0].tick == TICKS
+
+@pytest.mark.parametrize('fields', [
+    (b'FPSX', FORMAT_VERSION, TICKS_PER_SEC),
+    (MAGIC, FORMAT_VERSION - 1, TICKS_PER_SEC),
+    (MAGIC, FORMAT_VERSION, TICKS_PER_SEC + 1),
+])
+def test_bad_header_is_rejected(tmp_path, fields):
+    path = tmp_path / 'match.fpsi'
+    record(path)
+    data = path.read_bytes()
+    magic, version, rate = fields
+    seed, terrain, parameter = HEADER.unpack_from(data)[2:5]
+    path.write_bytes(HEADER.pack(magic, version, seed, terrain, parameter, rate) +
+                     data[HEADER.size:])
+    with pytest.raises(ValueError):
+        read_log(str(path))
+
+# Into the END record, into the last hash's payload, and into the header.
+@pytest.mark.parametrize('end', [-1, -2, -(RECORD.size + 1), HEADER.size - 1])
+def test_cut_short_log_is_rejected(tmp_path, end):
+    path = tmp_path / 'match.fpsi'
+    record(path)
+    path.write_bytes(path.read_bytes()[:end])
+    with pytest.raises(ValueError):
+        read_log(str(path))
+
+def test_unknown_kind_is_rejected(tmp_path):
+    path = tmp_path / 'match.fpsi'
+    record(path)
+    path.write_bytes(path.read_bytes() + RECORD.pack(0, END + 1))
+    with pytest.raises(ValueError):
+        read_log(str(path))
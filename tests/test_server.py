@@ -0,0 +1,200 @@
+from __future__ import division
+import struct, socket, asyncio
+
+import numpy as np
+import pytest
+
+from world import World, STONE, block_id
+from profiler import EventLog
+from simulation import Enemy, Simulation
+from server import (FRAME, MAX_FRAME, HELLO, INPUT, INPUT_BODY, QUANTUM, GameServer, Bot,
+                    frame, read_input, lookup, encode_section, decode_section)
+
+def test_read_input_clamps():
+    body = INPUT_BODY.pack(7, -5, 100, 725.0, -120.0, 3)
+    assert read_input(body) == (7, -1, 1, 5.0, -90.0, 3)
+    body = INPUT_BODY.pack(8, 1, 0, -30.0, 45.0, 0)
+    assert read_input(body) == (8, 1, 0, -30.0, 45.0, 0)
+
+def test_read_input_rejects():
+    with pytest.raises(ValueError):
+        read_input(INPUT_BODY.pack(1, 0, 0, float('nan'), 0.0, 0))
+    with pytest.raises(ValueError):
+        read_input(INPUT_BODY.pack(1, 0, 0, 0.0, float('inf'), 0))
+    with pytest.raises(struct.error):
+        read_input(b'\0' * (INPUT_BODY.size - 1))
+
+def random_state(rng, ids):
+    ids = np.array(sorted(ids), dtype=np.int64)
+    return ids, rng.randint(-5000, 5000, (len(ids), 4)).astype(np.int64)
+
+@pytest.mark.parametrize('delta', [True, False])
+@pytest.mark.parametrize('base', [0, 2 ** 40])
+def test_sections_round_trip(delta, base):
+    rng = np.random.RandomState(0)
+    before = random_state(rng, range(base, base + 60))
+    ids, values = random_state(rng, list(range(base + 10, base + 50)) +
+                               list(range(base + 70, base + 80)))
+    # Most of the survivors move a little, some a lot, some not at all.
+    rows, _ = lookup(before[0], ids[:40])
+    values[:40] = before[1][rows]
+    values[:30, :3] += rng.randint(-127, 128, (30, 3))
+    values[30:35, :3] += 1000
+    after = ids, values
+    data = encode_section(before, after, delta)
+    (got_ids, got_values), offset = decode_section(data, 0, before)
+    assert offset == len(data)
+    assert got_ids.tolist() == ids.tolist()
+    assert got_values.tolist() == values.tolist()
+    assert len(encode_section(after, after, delta)) < len(data)
+
+def run(coroutine):
+    """Run coroutine to the end on a loop of its own."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def new_server(enemies=0):
+    sim = Simulation(World(40), seed=0, events=EventLog(enabled=False))
+    for i in range(enemies):
+        sim.enemies.append(Enemy((6 * (i % 5) - 12, -1, 6 * (i // 5) - 30), speed=2,
+                                 shoot_interval=1.5, id=next(sim.enemy_ids)))
+    boxes = sim.enemies.get_aabbs()
+    for row, id in enumerate(sim.enemies.ids[:enemies].tolist()):
+        sim.enemy_index.insert(id, boxes[row])
+    return GameServer(sim, port=0)
+
+def check_bot(bot, server, player):
+    sim = server.sim
+    n = len(sim.enemies)
+    truth = dict(zip(sim.enemies.ids[:n].tolist(), sim.enemies.positions[:n].tolist()))
+    seen = bot.positions('enemies')
+    assert set(seen) <= set(truth)
+    for id, position in seen.items():
+        assert max(abs(a - b) for a, b in zip(position, truth[id])) <= 0.5 / QUANTUM
+    position = bot.positions('players')[bot.id]
+    assert max(abs(a - b) for a, b in zip(position, player.position)) <= 0.5 / QUANTUM
+
+def test_lockstep_match():
+    server = new_server(enemies=20)
+    bots = [Bot(), Bot()]
+    for i in range(5):
+        server.set_block((i, 0, -10), STONE)
+    players = []
+    async def match():
+        await server.start()
+        tasks = [asyncio.ensure_future(bot.play(server.host, server.port)) for bot in bots]
+        while len(server.clients) < len(bots):
+            await asyncio.sleep(0.001)
+        players.extend(client.player for client in sorted(server.clients.values(),
+                                                          key=lambda client: client.id))
+        await server.run(60, realtime=False)
+        await server.close()
+        await asyncio.gather(*tasks)
+    run(match())
+    assert players[0] is server.sim.player
+    for bot, player in zip(sorted(bots, key=lambda bot: bot.id), players):
+        assert bot.snapshots == 60 and bot.tick == server.sim.tick
+        assert sorted(bot.positions('players')) == [1, 2]
+        check_bot(bot, server, player)
+        assert bot.blocks == dict(((i, 0, -10), block_id(STONE)) for i in range(5))
+    assert all(len(bot.positions('enemies')) for bot in bots)
+    assert not server.clients and server.sim.players == [server.sim.player]
+
+def test_join_and_leave():
+    server = new_server()
+    stay, leave = Bot(), Bot()
+    async def match():
+        await server.start()
+        tasks = [asyncio.ensure_future(stay.play(server.host, server.port))]
+        while len(server.clients) < 1:
+            await asyncio.sleep(0.001)
+        await server.run(5, realtime=False)
+        tasks.append(asyncio.ensure_future(leave.play(server.host, server.port, ticks=10)))
+        while len(server.clients) < 2:
+            await asyncio.sleep(0.001)
+        assert len(server.sim.players) == 2
+        await server.run(10, realtime=False)
+        await tasks[1]
+        while len(server.clients) > 1:
+            await asyncio.sleep(0.001)
+        assert len(server.sim.players) == 1
+        server.remove_block((0, -2, 0))
+        await server.run(10, realtime=False)
+        await server.close()
+        await asyncio.gather(*tasks)
+    run(match())
+    assert stay.snapshots == 25 and leave.snapshots == 10
+    # The leaving player drops out of the snapshots sent after it left.
+    assert sorted(stay.positions('players')) == [stay.id]
+    assert stay.blocks == {(0, -2, 0): 0}
+    check_bot(stay, server, server.sim.player)
+
+@pytest.mark.parametrize('payload', [
+    frame(INPUT, INPUT_BODY.pack(0, 0, 0, float('nan'), 0.0, 0)),
+    frame(INPUT, b'\0' * 3),
+    FRAME.pack(MAX_FRAME + 1, INPUT),
+])
+def test_bad_client_is_dropped(payload):
+    server = new_server()
+    bot = Bot()
+    async def match():
+        await server.start()
+        task = asyncio.ensure_future(bot.play(server.host, server.port))
+        while len(server.clients) < 1:
+            await asyncio.sleep(0.001)
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        writer.write(frame(HELLO))
+        while len(server.clients) < 2:
+            await asyncio.sleep(0.001)
+        writer.write(payload)
+        while len(server.clients) > 1:
+            await asyncio.sleep(0.001)
+        await server.run(5, realtime=False)
+        writer.close()
+        await server.close()
+        await task
+    run(match())
+    assert bot.snapshots == 5
+    assert server.sim.players == [server.sim.player]
+
+def test_stalled_client_is_dropped():
+    server = new_server(enemies=20)
+    server.max_buffered = 1024
+    bot = Bot()
+    async def match():
+        await server.start()
+        task = asyncio.ensure_future(bot.play(server.host, server.port))
+        while len(server.clients) < 1:
+            await asyncio.sleep(0.001)
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        writer.write(frame(HELLO))
+        while len(server.clients) < 2:
+            await asyncio.sleep(0.001)
+        stalled = server.clients[max(server.clients)]
+        stalled.writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                                           4096)
+        # The second client never reads; in real time nothing waits for it.
+        # Block edits go to every client and fill its buffers quickly.
+        ticks = 0
+        while len(server.clients) > 1 and ticks < 60:
+            for x in range(-10, 10):
+                for z in range(10, 30):
+                    if ticks % 2:
+                        server.remove_block((x, 5, z))
+                    else:
+                        server.set_block((x, 5, z), STONE)
+            await server.run(1, realtime=True)
+            ticks += 1
+        assert len(server.clients) == 1 and server.dropped == 1
+        await server.run(5, realtime=True)
+        writer.close()
+        await server.close()
+        await task
+        return ticks
+    ticks = run(match())
+    assert bot.snapshots == ticks + 5
+    assert server.sim.players == [server.sim.player]
@@ -0,0 +1,25 @@
+from __future__ import division
+
+from world import World, STONE
+from bullets import BulletPool
+from sight import LineOfSight
+from swarm import EnemySwarm
+from simulation import Enemy
+
+def test_enemies_behind_a_wall_hold_their_shot():
+    world = World(40)
+    world.fill_region((-5, -1, 4), (5, 4, 4), STONE)
+    sight = LineOfSight(world.world)
+    swarm = EnemySwarm()
+    swarm.append(Enemy((0, -1, 10), id=1))
+    swarm.append(Enemy((30, -1, 10), id=2))
+    bullets = BulletPool()
+    fired, held = swarm.fire([1, 2], (0, 0, 0), bullets, sight)
+    assert swarm.ids[fired].tolist() == [2] and swarm.ids[held].tolist() == [1]
+    assert bullets.owners[:len(bullets)].tolist() == [2]
+    # Without a LineOfSight everyone fires.
+    fired, held = swarm.fire([1, 2], (0, 0, 0), bullets)
+    assert len(fired) == 2 and not len(held)
+    # Taking the wall down clears the cached answer.
+    world.clear_region((-5, -1, 4), (5, 4, 4))
+    assert sight.visible((0, 0, 10), (0, 0, 0))
@@ -0,0 +1,57 @@
+from __future__ import division
+import random
+
+import numpy as np
+
+from spatial import SpatialHash
+
+def random_box(rng):
+    x, z = rng.uniform(-50, 50), rng.uniform(-50, 50)
+    w, d = rng.uniform(0.2, 6), rng.uniform(0.2, 6)
+    return (x, 0, z, x + w, 2, z + d)
+
+def centre(box):
+    return (box[0] + box[3]) / 2, (box[2] + box[5]) / 2
+
+def scattered():
+    """An index after inserts, a batched move and removals, with the boxes
+       it should now hold."""
+    rng = random.Random(0)
+    index = SpatialHash(cell_size=4, capacity=8)
+    boxes = {}
+    for id in range(200):
+        boxes[id] = random_box(rng)
+        index.insert(id, boxes[id])
+    moved = list(range(0, 200, 3))
+    new = [random_box(rng) for _ in moved]
+    index.move_many(moved, np.array(new))
+    boxes.update(zip(moved, new))
+    for id in range(0, 200, 7):
+        index.remove(id)
+        del boxes[id]
+    index.insert(1000, (0, 0, 0, 1, 2, 1))
+    boxes[1000] = (0, 0, 0, 1, 2, 1)
+    return rng, index, boxes
+
+def test_query_box():
+    rng, index, boxes = scattered()
+    assert len(index) == len(boxes)
+    for _ in range(100):
+        x, z = rng.uniform(-60, 60), rng.uniform(-60, 60)
+        w, d = rng.uniform(0, 20), rng.uniform(0, 20)
+        expected = set(id for id, b in boxes.items()
+                       if b[0] <= x + w and x <= b[3] and b[2] <= z + d and z <= b[5])
+        assert set(index.query_box(x, z, x + w, z + d)) == expected
+
+def test_query_radius_and_nearest():
+    rng, index, boxes = scattered()
+    for _ in range(100):
+        x, z, radius = rng.uniform(-60, 60), rng.uniform(-60, 60), rng.uniform(1, 30)
+        d2 = dict((id, (centre(b)[0] - x) ** 2 + (centre(b)[1] - z) ** 2)
+                  for id, b in boxes.items())
+        within = sorted((d, id) for id, d in d2.items() if d <= radius * radius)
+        assert index.query_radius(x, z, radius) == [id for _, id in within]
+        nearest = index.nearest(x, z, radius)
+        assert nearest == (within[0][1] if within else None)
+        if len(within) > 1:
+            assert index.nearest(x, z, radius, exclude=within[0][1]) == within[1][1]
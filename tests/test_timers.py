@@ -0,0 +1,93 @@
+from __future__ import division
+
+from timers import TimerWheel
+
+def fired(wheel, ticks):
+    """Pop the wheel ticks times. Returns {tick: keys} for the ticks that
+       had any."""
+    due = {}
+    for _ in range(ticks):
+        tick = wheel.now
+        keys = wheel.pop()
+        if keys:
+            due[tick] = keys
+    return due
+
+def test_keys_fire_on_their_tick_in_order():
+    wheel = TimerWheel(slots=8)
+    wheel.schedule('b', 3)
+    wheel.schedule('a', 3)
+    wheel.schedule('c', 5)
+    assert len(wheel) == 3 and 'a' in wheel and wheel.deadline('c') == 5
+    assert fired(wheel, 8) == {3: ['b', 'a'], 5: ['c']}
+    assert len(wheel) == 0 and 'a' not in wheel and wheel.deadline('c') is None
+
+def test_reschedule_moves_a_key():
+    wheel = TimerWheel(slots=8)
+    wheel.schedule('a', 2)
+    wheel.schedule('b', 2)
+    wheel.schedule('a', 6)
+    # To the same tick it already had: two entries in the slot, one firing.
+    wheel.schedule('b', 2)
+    wheel.schedule('b', 2)
+    assert len(wheel) == 2 and wheel.deadline('a') == 6
+    assert fired(wheel, 16) == {2: ['b'], 6: ['a']}
+
+def test_reschedule_back_and_forth():
+    wheel = TimerWheel(slots=8)
+    wheel.schedule('a', 4)
+    wheel.schedule('a', 12)
+    wheel.schedule('a', 4)
+    assert fired(wheel, 24) == {4: ['a']}
+
+def test_cancel():
+    wheel = TimerWheel(slots=8)
+    wheel.schedule('a', 1)
+    wheel.schedule('b', 1)
+    assert wheel.cancel('a')
+    assert not wheel.cancel('a') and not wheel.cancel('never')
+    assert len(wheel) == 1
+    assert fired(wheel, 8) == {1: ['b']}
+    # A cancelled key can be scheduled again.
+    wheel.schedule('a', 10)
+    assert fired(wheel, 8) == {10: ['a']}
+
+def test_far_deadlines_wait_for_their_turn():
+    wheel = TimerWheel(slots=8)
+    wheel.schedule('near', 3)
+    wheel.schedule('one turn', 3 + 8)
+    wheel.schedule('three turns', 3 + 24)
+    wheel.schedule('moved', 3 + 16)
+    wheel.schedule('moved', 3 + 8)
+    assert fired(wheel, 40) == {3: ['near'], 11: ['one turn', 'moved'], 27: ['three turns']}
+
+def test_past_ticks_are_clamped_to_now():
+    wheel = TimerWheel(slots=8, now=100)
+    assert wheel.schedule('late', 90) == 100
+    assert wheel.schedule('now', 100) == 100
+    assert wheel.deadline('late') == 100
+    wheel.schedule_many('shot', [4, 5], [50, 101])
+    assert wheel.pop() == ['late', 'now', ('shot', 100)]
+    assert wheel.take(('shot', 100)).tolist() == [4]
+    assert wheel.pop() == [('shot', 101)]
+    assert wheel.take(('shot', 101)).tolist() == [5]
+
+def test_batches_keep_insertion_order():
+    wheel = TimerWheel(slots=8)
+    wheel.schedule_many('shot', [9, 3, 7, 1], [5, 2, 5, 2])
+    wheel.schedule_many('shot', [4, 8], 5)
+    wheel.schedule_many('shot', [], 5)
+    wheel.schedule_many('expire', [2], 5)
+    wheel.schedule_many('shot', [6], [5 + 8])
+    due = fired(wheel, 16)
+    assert due == {2: [('shot', 2)], 5: [('shot', 5), ('expire', 5)], 13: [('shot', 13)]}
+    assert wheel.take(('shot', 2)).tolist() == [3, 1]
+    assert wheel.take(('shot', 5)).tolist() == [9, 7, 4, 8]
+    assert wheel.take(('expire', 5)).tolist() == [2]
+    assert wheel.take(('shot', 13)).tolist() == [6]
+    # A batch is handed over once; a cancelled one is dropped.
+    assert wheel.take(('shot', 5)).tolist() == []
+    wheel.schedule_many('shot', [1, 2], 20)
+    assert wheel.cancel(('shot', 20))
+    assert fired(wheel, 8) == {}
+    assert wheel.take(('shot', 20)).tolist() == []
@@ -0,0 +1,88 @@
+from __future__ import division
+
+from world import World, BlockMap, STONE
+from terrain import HillsGenerator
+
+def test_masks_are_worked_out_when_needed():
+    world = World(generator=HillsGenerator(seed=3), max_sectors=64)
+    world.world.mask_capacity = 4
+    world.load_around((0, 0, 0), radius=2)
+    assert all(chunk.masks is None for chunk in world.sectors.values())
+    blocks = world.world
+    for sector in sorted(world.sectors)[:6]:
+        blocks.masks_of(world.sectors[sector])
+    assert len(blocks.masked) == 4
+    assert sum(chunk.masks is not None for chunk in world.sectors.values()) == 4
+
+def test_kept_masks_follow_edits():
+    world = World(generator=HillsGenerator(seed=3))
+    world.load_around((0, 0, 0), radius=1)
+    blocks = world.world
+    kept = [blocks.masks_of(chunk) for chunk in world.sectors.values()]
+    for position in [(15, 10, 0), (16, 10, 0), (0, 10, -1), (0, 10, 0), (3, 11, 3)]:
+        world.add_block(position, STONE)
+    world.remove_block((16, 10, 0))
+    for chunk, masks in zip(world.sectors.values(), kept):
+        assert chunk.masks is masks
+        assert masks == blocks._compute_masks(chunk)
+    assert world.exposed((15, 10, 0))
+    assert blocks.get_mask((0, 10, 0)) & 1 << 5
+
+def test_edits_without_kept_masks():
+    blocks = BlockMap(mask_capacity=1)
+    for x in range(-2, 3):
+        for z in range(-2, 3):
+            blocks[x, 0, z] = STONE
+    assert blocks.get_mask((0, 0, 0)) == 0b111100
+    assert blocks.get_mask((0, 1, 0)) == 0b10
+    # Across the sector border from the first, whose masks are dropped.
+    assert blocks.get_mask((-1, 0, 0)) == 0b111100
+    assert blocks.chunks[0, 0, 0].masks is None
+    assert len(blocks.masked) == 1
+
+def test_region_edits_load_sectors_first():
+    world = World(40)
+    assert not world.sectors
+    touched = world.clear_region((-8, -3, -8), (8, -2, 8))
+    assert (0, 0, 0) in touched and (-1, 0, -1) in touched
+    assert (0, -2, 0) not in world.world and (-8, -3, 8) not in world.world
+    assert (9, -2, 0) in world.world
+    # Loading the rest of the arena must not bring the cleared blocks back.
+    world.load_all()
+    assert (0, -2, 0) not in world.world and (-8, -3, 8) not in world.world
+
+def test_remove_block_loads_its_sector():
+    world = World(40)
+    world.remove_block((20, -2, 20))
+    assert (1, 0, 1) in world.sectors
+    assert (20, -2, 20) not in world.world and (21, -2, 20) in world.world
+    world.load_all()
+    assert (20, -2, 20) not in world.world
+    world.add_block((-20, 0, -20), STONE)
+    assert (-2, 0, -2) in world.sectors and (-20, -2, -20) in world.world
+
+def test_load_around_several_players():
+    world = World(generator=HillsGenerator(seed=3), max_sectors=60)
+    positions = [(0, 0, 0), (500, 0, 500)]
+    assert len(world.load_around_all(positions, radius=3)) == 2 * 49
+    assert world.max_sectors == 2 * 49
+    loaded = set(world.sectors)
+    # Moving within the same sectors loads nothing, and neither player's
+    # square pushes the other's out.
+    assert world.load_around_all([(5, 0, 5), (501, 0, 501)], radius=3) == set()
+    world.load_around_all([(20, 0, 0), (500, 0, 500)], radius=3)
+    assert loaded - set(world.sectors) == set((-3, 0, dz) for dz in range(-3, 4))
+    assert (31, 0, 31) in world.sectors and (4, 0, 0) in world.sectors
+
+def test_writing_the_same_block_changes_nothing():
+    world = World(40)
+    world.load_all()
+    blocks = world.world
+    version = blocks.version
+    world.add_block((0, -2, 0), blocks[0, -2, 0])
+    blocks.set_id((0, 5, 0), 0)
+    blocks.set_id((500, 5, 500), 0)
+    assert blocks.version == version and not blocks.edited
+    assert (31, 0, 31) not in blocks.chunks
+    world.add_block((0, 5, 0), STONE)
+    assert blocks.version == version + 1 and blocks.edited == set([(0, 0, 0)])
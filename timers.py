@@ -0,0 +1,110 @@
+"""Deadlines on the simulation clock: a timer wheel keyed by tick, so that
+spawners, enemy shots and bullet expiry are woken when they are due rather
+than counted down every tick."""
+from __future__ import division
+import sys
+
+import numpy as np
+
+from world import TICKS_PER_SEC
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+def to_ticks(seconds):
+    """Whole ticks until seconds have passed, at least one. Takes an array
+       of seconds too."""
+    ticks = np.maximum(1, np.ceil(np.asarray(seconds) * TICKS_PER_SEC - 1e-6)).astype(np.int64)
+    return ticks if ticks.ndim else int(ticks)
+
+class TimerWheel(object):
+    """Timers are keys, any hashable (by convention a tuple whose first
+       item is the kind), each with the tick it is due. A key has at most
+       one deadline: scheduling it again moves it, and cancel() drops it.
+       Both are a dict write, with the old entry left in its slot and
+       skipped when the slot comes round.
+
+       Slot tick % slots holds every entry due on that tick, and pop()
+       visits one slot per tick, so deadlines further off than slots ticks
+       just wait for another turn of the wheel.
+
+       Timers for many entities of one kind are better kept as batches: a
+       single timer (kind, tick) per tick with an array of entity ids,
+       added to by schedule_many() and handed over by take(). Those ids are
+       not cancelled one by one; whoever takes a batch skips the ones that
+       are gone, which costs an entity's death nothing."""
+    def __init__(self, slots=512, now=0):
+        self.slots = [[] for _ in xrange(slots)]
+        self.deadlines = {}
+        self.batches = {}
+        self.now = now
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def deadline(self, key):
+        return self.deadlines.get(key)
+
+    def schedule(self, key, tick):
+        """Make key due on tick, or on the next tick pop() returns if that
+           has already gone. Returns the tick."""
+        tick = max(tick, self.now)
+        self.deadlines[key] = tick
+        self.slots[tick % len(self.slots)].append((tick, key))
+        return tick
+
+    def cancel(self, key):
+        """Drop key's timer. Returns whether it had one."""
+        self.batches.pop(key, None)
+        return self.deadlines.pop(key, None) is not None
+
+    def schedule_many(self, kind, ids, ticks):
+        """Add each of ids to the batch of kind due on its tick in ticks."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        ticks = np.maximum(np.broadcast_to(np.asarray(ticks, dtype=np.int64), ids.shape), self.now)
+        order = np.argsort(ticks, kind='stable')
+        due, starts = np.unique(ticks[order], return_index=True)
+        for tick, group in zip(due.tolist(), np.split(ids[order], starts[1:])):
+            key = (kind, tick)
+            if key in self.deadlines:
+                self.batches[key].append(group)
+            else:
+                self.batches[key] = [group]
+                self.schedule(key, tick)
+
+    def take(self, key):
+        """The ids in a batch that pop() returned, in the order they were
+           added."""
+        batch = self.batches.pop(key, ())
+        if len(batch) == 1:
+            return batch[0]
+        return np.concatenate(batch) if batch else np.zeros(0, dtype=np.int64)
+
+    def pop(self):
+        """The keys due on tick now, in the order they were scheduled, then
+           move on to the next tick."""
+        tick = self.now
+        self.now += 1
+        slot = tick % len(self.slots)
+        entries = self.slots[slot]
+        if not entries:
+            return []
+        deadlines = self.deadlines
+        due = []
+        later = []
+        for entry in entries:
+            when, key = entry
+            if deadlines.get(key) != when:
+                continue
+            if when == tick:
+                del deadlines[key]
+                due.append(key)
+            else:
+                later.append(entry)
+        self.slots[slot] = later
+        return due
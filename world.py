@@ -0,0 +1,656 @@
+from __future__ import division
+import sys, math
+from collections import OrderedDict
+
+import numpy as np
+
+# === Constants and Helper Functions ========================================
+
+TICKS_PER_SEC = 60
+SECTOR_SIZE = 16
+WALKING_SPEED = 5
+GRAVITY = 20.0
+MAX_JUMP_HEIGHT = 1.0
+JUMP_SPEED = math.sqrt(2 * GRAVITY * MAX_JUMP_HEIGHT)
+TERMINAL_VELOCITY = 50
+PLAYER_HEIGHT = 2
+WORLD_BOTTOM = -16
+WORLD_HEIGHT = 32
+CHUNK_VOLUME = SECTOR_SIZE * WORLD_HEIGHT * SECTOR_SIZE
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+def cube_vertices(x, y, z, n):
+    return [
+        x-n, y+n, z-n,  x-n, y+n, z+n,  x+n, y+n, z+n,  x+n, y+n, z-n,  # top
+        x-n, y-n, z-n,  x+n, y-n, z-n,  x+n, y-n, z+n,  x-n, y-n, z+n,  # bottom
+        x-n, y-n, z-n,  x-n, y-n, z+n,  x-n, y+n, z+n,  x-n, y+n, z-n,  # left
+        x+n, y-n, z+n,  x+n, y-n, z-n,  x+n, y+n, z-n,  x+n, y+n, z+n,  # right
+        x-n, y-n, z+n,  x+n, y-n, z+n,  x+n, y+n, z+n,  x-n, y+n, z+n,  # front
+        x+n, y-n, z-n,  x-n, y-n, z-n,  x-n, y+n, z-n,  x+n, y+n, z-n,  # back
+    ]
+
+def tex_coord(x, y, n=4):
+    m = 1.0 / n
+    dx = x * m
+    dy = y * m
+    return dx, dy, dx + m, dy, dx + m, dy + m, dx, dy + m
+
+def tex_coords(top, bottom, side):
+    top = tex_coord(*top)
+    bottom = tex_coord(*bottom)
+    side = tex_coord(*side)
+    result = []
+    result.extend(top)
+    result.extend(bottom)
+    result.extend(side * 4)
+    return result
+
+# === Texture Definitions =====================================================
+
+TEXTURE_PATH = 'texture.png'
+
+class BlockType(object):
+    """A registered kind of block. Its id is what the chunk arrays store."""
+    def __init__(self, id, name, top, bottom, side):
+        self.id = id
+        self.name = name
+        self.tiles = (top, bottom, side, side, side, side)
+        self.texture = tex_coords(top, bottom, side)
+
+# Index 0 is air, so a zeroed chunk array is an empty sector.
+BLOCK_TYPES = [None]
+_BLOCK_IDS = {}
+
+def register_block(name, top, bottom, side):
+    if len(BLOCK_TYPES) > 255:
+        raise ValueError('chunk arrays hold at most 255 block types')
+    block = BlockType(len(BLOCK_TYPES), name, top, bottom, side)
+    BLOCK_TYPES.append(block)
+    _BLOCK_IDS[tuple(block.texture)] = block.id
+    return block
+
+def block_id(texture):
+    """The registered id for a texture list such as GRASS."""
+    try:
+        return _BLOCK_IDS[tuple(texture)]
+    except KeyError:
+        raise ValueError('unregistered block texture')
+
+GRASS = register_block('grass', (1, 0), (0, 1), (0, 0)).texture
+SAND  = register_block('sand', (1, 1), (1, 1), (1, 1)).texture
+BRICK = register_block('brick', (2, 0), (2, 0), (2, 0)).texture
+STONE = register_block('stone', (2, 1), (2, 1), (2, 1)).texture
+
+FACES = [
+    ( 0, 1, 0),
+    ( 0,-1, 0),
+    (-1, 0, 0),
+    ( 1, 0, 0),
+    ( 0, 0, 1),
+    ( 0, 0,-1),
+]
+
+# A block's neighbour mask has bit i set when the cell at FACES[i] from it
+# is solid; ALL_FACES means every face is hidden. FACES come in opposite
+# pairs, so face i ^ 1 is the one facing back.
+ALL_FACES = (1 << len(FACES)) - 1
+
+def normalize(position):
+    x, y, z = position
+    return (int(round(x)), int(round(y)), int(round(z)))
+
+def sectorize(position):
+    x, y, z = normalize(position)
+    return (x // SECTOR_SIZE, 0, z // SECTOR_SIZE)
+
+def raycast(blocks, position, vector, max_distance=8):
+    """Amanatides-Woo grid traversal: visit exactly the cells the ray from
+       position along vector crosses, up to max_distance, and return
+       (block, normal, distance) for the first one in blocks, normal being
+       the face the ray entered through (zero if it starts inside the
+       block). Returns (None, None, None) on a miss. raycast.raycast_batch
+       runs the same walk for many rays at once."""
+    length = math.sqrt(sum(c * c for c in vector))
+    direction = [c / length for c in vector]
+    # Blocks are centred on integers, so cell boundaries sit at k + 0.5.
+    cell = [int(math.floor(c + 0.5)) for c in position]
+    if tuple(cell) in blocks:
+        return tuple(cell), (0, 0, 0), 0.0
+    step = [0, 0, 0]
+    t_max = [float('inf')] * 3
+    t_delta = [float('inf')] * 3
+    for i in xrange(3):
+        d = direction[i]
+        if d:
+            step[i] = 1 if d > 0 else -1
+            t_delta[i] = abs(1.0 / d)
+            boundary = cell[i] + 0.5 if d > 0 else cell[i] - 0.5
+            t_max[i] = (boundary - position[i]) / d
+    while True:
+        axis = t_max.index(min(t_max))
+        t = t_max[axis]
+        if t > max_distance:
+            return None, None, None
+        cell[axis] += step[axis]
+        t_max[axis] += t_delta[axis]
+        key = tuple(cell)
+        if key in blocks:
+            normal = [0, 0, 0]
+            normal[axis] = -step[axis]
+            return key, tuple(normal), t
+
+# === Chunk Storage ===========================================================
+
+class Chunk(object):
+    """One sector's column of blocks: SECTOR_SIZE x WORLD_HEIGHT x SECTOR_SIZE
+       block ids in a flat bytearray, laid out y-major so each horizontal
+       layer is contiguous. masks is a parallel bytearray of neighbour masks
+       (see ALL_FACES) for every cell, empty or not, or None until
+       BlockMap.masks_of() works them out. Iterating yields the positions
+       of solid blocks."""
+    __slots__ = ('sector', 'blocks', 'masks', 'count')
+
+    def __init__(self, sector):
+        self.sector = sector
+        self.blocks = bytearray(CHUNK_VOLUME)
+        self.masks = None
+        self.count = 0
+
+    def __iter__(self):
+        s = SECTOR_SIZE
+        ox = self.sector[0] * s
+        oz = self.sector[2] * s
+        blocks = self.blocks
+        for index in xrange(CHUNK_VOLUME):
+            if blocks[index]:
+                yz, x = divmod(index, s)
+                y, z = divmod(yz, s)
+                yield (ox + x, y + WORLD_BOTTOM, oz + z)
+
+    def __len__(self):
+        return self.count
+
+def chunk_index(x, y, z):
+    s = SECTOR_SIZE
+    return ((y - WORLD_BOTTOM) * s + z % s) * s + x % s
+
+def chunk_array(buffer):
+    """A writable [y, z, x] NumPy view of a chunk's blocks or masks."""
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(WORLD_HEIGHT, SECTOR_SIZE, SECTOR_SIZE)
+
+# For each horizontal neighbour of a chunk: its (dx, dz) in sectors, the
+# [y, z, x] index of the chunk's edge next to it and of its edge next to
+# the chunk, and the face from the chunk toward it.
+CHUNK_EDGES = (((-1, 0), (Ellipsis, 0), (Ellipsis, -1), 2),
+               ((1, 0), (Ellipsis, -1), (Ellipsis, 0), 3),
+               ((0, 1), (slice(None), -1), (slice(None), 0), 4),
+               ((0, -1), (slice(None), 0), (slice(None), -1), 5))
+
+class BlockMap(object):
+    """Mapping of (x, y, z) to texture data, like the dict it replaces, but
+       backed by one Chunk per sector. Positions must be integer triples
+       within WORLD_BOTTOM <= y < WORLD_BOTTOM + WORLD_HEIGHT. Sectors
+       changed through the mapping, as opposed to loaded whole, are
+       recorded in edited.
+
+       Neighbour masks are only needed to mesh a sector, so they are worked
+       out the first time they are asked for and kept for the mask_capacity
+       chunks used most recently; the rest of the world is just its block
+       ids. Masks that are kept stay current as blocks come and go: a change
+       only touches the masks of the six cells around it."""
+    def __init__(self, mask_capacity=256):
+        self.chunks = {}
+        self.edited = set()
+        self.version = 0
+        self.mask_capacity = mask_capacity
+        self.masked = OrderedDict()
+
+    def __contains__(self, position):
+        x, y, z = position
+        y -= WORLD_BOTTOM
+        if not 0 <= y < WORLD_HEIGHT:
+            return False
+        s = SECTOR_SIZE
+        chunk = self.chunks.get((x // s, 0, z // s))
+        return chunk is not None and chunk.blocks[(y * s + z % s) * s + x % s] != 0
+
+    def get_id(self, position):
+        x, y, z = position
+        y -= WORLD_BOTTOM
+        if not 0 <= y < WORLD_HEIGHT:
+            return 0
+        s = SECTOR_SIZE
+        chunk = self.chunks.get((x // s, 0, z // s))
+        if chunk is None:
+            return 0
+        return chunk.blocks[(y * s + z % s) * s + x % s]
+
+    def get_mask(self, position):
+        """Which of the cell's neighbours are solid, as bits in FACES order."""
+        x, y, z = position
+        y -= WORLD_BOTTOM
+        if not 0 <= y < WORLD_HEIGHT:
+            return 0
+        s = SECTOR_SIZE
+        chunk = self.chunks.get((x // s, 0, z // s))
+        if chunk is None:
+            return 0
+        return self.masks_of(chunk)[(y * s + z % s) * s + x % s]
+
+    def masks_of(self, chunk, keep=True):
+        """chunk's neighbour masks, computed now if they were not kept, and
+           then kept unless keep is false."""
+        if chunk.masks is None:
+            if not keep:
+                return self._compute_masks(chunk)
+            self._keep_masks(chunk, self._compute_masks(chunk))
+        else:
+            self.masked.move_to_end(chunk.sector)
+        return chunk.masks
+
+    def _keep_masks(self, chunk, masks):
+        """Give chunk its masks, dropping those of the chunks used least
+           recently past mask_capacity."""
+        chunk.masks = masks
+        masked = self.masked
+        masked[chunk.sector] = None
+        masked.move_to_end(chunk.sector)
+        while len(masked) > max(self.mask_capacity, 1):
+            sector, _ = masked.popitem(last=False)
+            other = self.chunks.get(sector)
+            if other is not None:
+                other.masks = None
+
+    def _drop_masks(self, chunk):
+        chunk.masks = None
+        self.masked.pop(chunk.sector, None)
+
+    def __getitem__(self, position):
+        id = self.get_id(position)
+        if not id:
+            raise KeyError(position)
+        return BLOCK_TYPES[id].texture
+
+    def get(self, position, default=None):
+        id = self.get_id(position)
+        return BLOCK_TYPES[id].texture if id else default
+
+    def set_id(self, position, id):
+        x, y, z = position
+        if not WORLD_BOTTOM <= y < WORLD_BOTTOM + WORLD_HEIGHT:
+            raise ValueError('block %r is outside the world height' % (position,))
+        sector = (x // SECTOR_SIZE, 0, z // SECTOR_SIZE)
+        chunk = self.chunks.get(sector)
+        if chunk is None:
+            if not id:
+                return
+            chunk = self._add_chunk(sector)
+        index = chunk_index(x, y, z)
+        if chunk.blocks[index] == id:
+            # Nothing changes, so nothing needs saving and no cache built
+            # on version is dropped.
+            return
+        solid = bool(id)
+        changed = solid != bool(chunk.blocks[index])
+        chunk.blocks[index] = id
+        if changed:
+            chunk.count += 1 if solid else -1
+            self._update_masks(chunk, index, solid)
+        self.edited.add(sector)
+        self.version += 1
+
+    def _update_masks(self, chunk, index, solid):
+        """Set or clear, in each neighbour of the cell at index in chunk, the
+           bit for the face that looks back at it. Chunks without masks are
+           skipped; theirs are worked out from the blocks when needed."""
+        s = SECTOR_SIZE
+        layer = s * s
+        yz, lx = divmod(index, s)
+        ly, lz = divmod(yz, s)
+        sx, _, sz = chunk.sector
+        chunks = self.chunks
+        masks = chunk.masks
+        # (masks, index, bit) for each neighbour, in FACES order; the bit is
+        # that of the opposite face.
+        cells = [(masks, index + layer, 2) if ly < WORLD_HEIGHT - 1 else None,
+                 (masks, index - layer, 1) if ly > 0 else None]
+        if lx > 0:
+            cells.append((masks, index - 1, 8))
+        else:
+            other = chunks.get((sx - 1, 0, sz))
+            cells.append(other and (other.masks, index + s - 1, 8))
+        if lx < s - 1:
+            cells.append((masks, index + 1, 4))
+        else:
+            other = chunks.get((sx + 1, 0, sz))
+            cells.append(other and (other.masks, index - s + 1, 4))
+        if lz < s - 1:
+            cells.append((masks, index + s, 32))
+        else:
+            other = chunks.get((sx, 0, sz + 1))
+            cells.append(other and (other.masks, index - layer + s, 32))
+        if lz > 0:
+            cells.append((masks, index - s, 16))
+        else:
+            other = chunks.get((sx, 0, sz - 1))
+            cells.append(other and (other.masks, index + layer - s, 16))
+        for cell in cells:
+            if cell and cell[0] is not None:
+                array, i, bit = cell
+                if solid:
+                    array[i] |= bit
+                else:
+                    array[i] &= ~bit
+
+    def _add_chunk(self, sector):
+        """An empty chunk; its masks are worked out when first needed, so
+           its border cells see the blocks of the chunks around it."""
+        chunk = self.chunks[sector] = Chunk(sector)
+        self._drop_masks(chunk)
+        return chunk
+
+    def _compute_masks(self, chunk):
+        """Every mask in chunk, as a new bytearray, from its blocks and the
+           facing edges of the four chunks beside it."""
+        solid = (chunk_array(chunk.blocks) != 0).view(np.uint8)
+        masks = np.zeros(solid.shape, dtype=np.uint8)
+        # Axis order is [y, z, x]; bits follow FACES.
+        masks[:-1] |= solid[1:] << 0
+        masks[1:] |= solid[:-1] << 1
+        masks[:, :, 1:] |= solid[:, :, :-1] << 2
+        masks[:, :, :-1] |= solid[:, :, 1:] << 3
+        masks[:, :-1] |= solid[:, 1:] << 4
+        masks[:, 1:] |= solid[:, :-1] << 5
+        sx, _, sz = chunk.sector
+        for (dx, dz), mine, theirs, face in CHUNK_EDGES:
+            other = self.chunks.get((sx + dx, 0, sz + dz))
+            if other is not None and other.count:
+                masks[mine] |= (chunk_array(other.blocks)[theirs] != 0).view(np.uint8) << face
+        return bytearray(masks.tobytes())
+
+    def _update_edge(self, chunk, edge, other, other_edge, face):
+        """Redo bit face of the masks along one edge of chunk from the
+           facing edge of other. Returns whether any mask changed."""
+        masks = chunk_array(chunk.masks)[edge]
+        solid = (chunk_array(other.blocks)[other_edge] != 0).view(np.uint8) << face
+        updated = (masks & ~np.uint8(1 << face)) | solid
+        if np.array_equal(masks, updated):
+            return False
+        masks[...] = updated
+        return True
+
+    # --- Region edits ----------------------------------------------------------
+
+    def fill_region(self, start, end, id, replace=None):
+        """Set every cell of the box between the corners start and end
+           (inclusive) to id, or only the cells currently holding the id
+           replace. All blocks are written first, chunk by chunk, then the
+           masks of every chunk the box or its one-cell border reaches are
+           dropped, to be worked out once when next needed. Returns those
+           chunks' sectors."""
+        (x0, x1), (y0, y1), (z0, z1) = [(min(a, b), max(a, b)) for a, b in zip(start, end)]
+        y0 = max(y0, WORLD_BOTTOM) - WORLD_BOTTOM
+        y1 = min(y1, WORLD_BOTTOM + WORLD_HEIGHT - 1) - WORLD_BOTTOM
+        if y0 > y1:
+            return set()
+        s = SECTOR_SIZE
+        creates = id and replace in (None, 0)
+        for sx in xrange(x0 // s, x1 // s + 1):
+            for sz in xrange(z0 // s, z1 // s + 1):
+                sector = (sx, 0, sz)
+                chunk = self.chunks.get(sector)
+                if chunk is None:
+                    if not creates:
+                        continue
+                    chunk = self.chunks[sector] = Chunk(sector)
+                blocks = chunk_array(chunk.blocks)[
+                    y0:y1 + 1,
+                    max(z0 - sz * s, 0):min(z1 - sz * s, s - 1) + 1,
+                    max(x0 - sx * s, 0):min(x1 - sx * s, s - 1) + 1]
+                if replace is None:
+                    blocks[...] = id
+                else:
+                    blocks[blocks == replace] = id
+                chunk.count = int(np.count_nonzero(chunk_array(chunk.blocks)))
+                self.edited.add(sector)
+        touched = set()
+        for sx in xrange((x0 - 1) // s, (x1 + 1) // s + 1):
+            for sz in xrange((z0 - 1) // s, (z1 + 1) // s + 1):
+                chunk = self.chunks.get((sx, 0, sz))
+                if chunk is not None:
+                    self._drop_masks(chunk)
+                    touched.add(chunk.sector)
+        self.version += 1
+        return touched
+
+    def load_chunk(self, sector, blocks, masks=None):
+        """Install a whole sector from a [y, z, x] array of block ids,
+           replacing any chunk there, and bring the kept masks of the chunks
+           beside it up to date. Saved masks may be passed in to keep them
+           straight away; only their edges are then redone. Returns the
+           sectors whose masks changed, or that have none kept and may have."""
+        chunk = self.chunks[sector] = Chunk(sector)
+        chunk_array(chunk.blocks)[...] = blocks
+        chunk.count = int(np.count_nonzero(blocks))
+        self.edited.discard(sector)
+        sx, _, sz = sector
+        touched = set([sector])
+        if masks is None:
+            self._drop_masks(chunk)
+        else:
+            saved = bytearray(CHUNK_VOLUME)
+            chunk_array(saved)[...] = masks
+            self._keep_masks(chunk, saved)
+        for (dx, dz), mine, theirs, face in CHUNK_EDGES:
+            other = self.chunks.get((sx + dx, 0, sz + dz))
+            if other is None:
+                continue
+            if chunk.masks is not None:
+                self._update_edge(chunk, mine, other, theirs, face)
+            if other.masks is None or self._update_edge(other, theirs, chunk, mine, face ^ 1):
+                touched.add(other.sector)
+        self.version += 1
+        return touched
+
+    def unload_chunk(self, sector):
+        """Drop a sector's chunk. The kept masks of the chunks beside it are
+           left as they were, as if it were still there, so reloading the
+           same blocks later changes nothing."""
+        self._drop_masks(self.chunks.pop(sector))
+        self.edited.discard(sector)
+        self.version += 1
+
+    def __setitem__(self, position, texture):
+        self.set_id(position, block_id(texture))
+
+    def __delitem__(self, position):
+        if position not in self:
+            raise KeyError(position)
+        self.set_id(position, 0)
+
+    def __len__(self):
+        return sum(chunk.count for chunk in self.chunks.values())
+
+    def __iter__(self):
+        for chunk in self.chunks.values():
+            for position in chunk:
+                yield position
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for position in self:
+            yield position, self[position]
+
+# === World: Static Blocks ====================================================
+
+class World(object):
+    """Block storage and queries with no rendering attached. Model in main.py
+       layers the pyglet batch on top of this; the Simulation only needs this.
+       self.sectors maps each loaded sector to its Chunk, which iterates the
+       solid block positions in it.
+
+       Sectors are made by generator (see terrain.py; by default the flat
+       arena of the given size) the first time they are loaded, or read
+       back from store, a region.RegionStore, if it has them. Past
+       max_sectors, the least recently loaded sectors are unloaded again.
+       Edited sectors are saved to the store first, or kept if there is
+       none."""
+    def __init__(self, size=80, generator=None, max_sectors=1024, store=None):
+        if generator is None:
+            # terrain imports this module, so it cannot be imported at the top.
+            from terrain import FlatArenaGenerator
+            generator = FlatArenaGenerator(size)
+        self.size = size
+        self.generator = generator
+        self.store = store
+        self.max_sectors = max_sectors
+        self.world = BlockMap()
+        self.sectors = self.world.chunks
+        self.recent = OrderedDict()
+        self.centres = None
+
+    def load_sectors(self, sectors):
+        """Generate whichever of sectors are not loaded and mark them all as
+           just used, then unload down to max_sectors. Returns the loaded
+           sectors whose masks changed."""
+        touched = set()
+        recent = self.recent
+        for sector in sectors:
+            if sector not in self.sectors:
+                saved = self.store.load(sector) if self.store is not None else None
+                if saved is not None:
+                    touched |= self.world.load_chunk(sector, saved[0], saved[1])
+                else:
+                    touched |= self.world.load_chunk(sector, self.generator.generate(sector))
+            recent[sector] = None
+            recent.move_to_end(sector)
+        excess = len(self.sectors) - self.max_sectors
+        edited = self.world.edited
+        for sector in list(recent):
+            if excess <= 0:
+                break
+            if sector in edited:
+                if self.store is None:
+                    continue
+                chunk = self.sectors[sector]
+                self.store.save(chunk, self.world.masks_of(chunk, keep=False))
+            del recent[sector]
+            self.unload_sector(sector)
+            touched.discard(sector)
+            excess -= 1
+        return touched
+
+    def save(self):
+        """Write the sectors edited since they were loaded or last saved to
+           the store, and only those. Returns how many were written."""
+        edited = self.world.edited
+        saved = 0
+        for sector in list(edited):
+            chunk = self.sectors.get(sector)
+            if chunk is not None:
+                self.store.save(chunk, self.world.masks_of(chunk, keep=False))
+                saved += 1
+        edited.clear()
+        self.store.flush()
+        return saved
+
+    def load_around(self, position, radius=5):
+        """Load the square of sectors within radius of the one containing
+           position. Cheap to call every tick: nothing happens until
+           position enters another sector."""
+        return self.load_around_all([position], radius)
+
+    def load_around_all(self, positions, radius=5):
+        """load_around for several players at once: the union of their
+           squares is loaded in one go, whenever any of them enters another
+           sector. Loading them one by one would have each player's square
+           push the others' out of the least recently used order."""
+        centres = tuple(sectorize(position) for position in positions)
+        if centres == self.centres:
+            return set()
+        self.centres = centres
+        self.max_sectors = max(self.max_sectors, len(centres) * (2 * radius + 1) ** 2)
+        sectors = []
+        seen = set()
+        for sx, _, sz in centres:
+            for dx in xrange(-radius, radius + 1):
+                for dz in xrange(-radius, radius + 1):
+                    sector = (sx + dx, 0, sz + dz)
+                    if sector not in seen:
+                        seen.add(sector)
+                        sectors.append(sector)
+        return self.load_sectors(sectors)
+
+    def load_all(self):
+        """Load every sector of a bounded generator such as the flat arena."""
+        n = self.generator.size
+        s = SECTOR_SIZE
+        self.max_sectors = max(self.max_sectors, (2 * n // s + 2) ** 2)
+        self.load_sectors([(sx, 0, sz) for sx in xrange(-n // s, n // s + 1)
+                           for sz in xrange(-n // s, n // s + 1)])
+
+    def unload_sector(self, sector):
+        self.world.unload_chunk(sector)
+
+    def _load_box(self, start, end):
+        """Make sure the sectors under a box of blocks exist before an edit."""
+        s = SECTOR_SIZE
+        (x0, x1), (z0, z1) = [(min(a, b), max(a, b)) for a, b in
+                              ((start[0], end[0]), (start[2], end[2]))]
+        missing = [(sx, 0, sz) for sx in xrange(x0 // s, x1 // s + 1)
+                   for sz in xrange(z0 // s, z1 // s + 1)
+                   if (sx, 0, sz) not in self.sectors]
+        if missing:
+            self.load_sectors(missing)
+
+    def add_block(self, position, texture):
+        self._load_box(position, position)
+        self.world[position] = texture
+
+    def remove_block(self, position):
+        """Like del on the mapping, but the sector is loaded first, so a
+           block the generator would put there is removed for good."""
+        self._load_box(position, position)
+        del self.world[position]
+
+    def fill_region(self, start, end, texture):
+        """Fill the box between two corner blocks, inclusive. Like the other
+           region edits it returns the sectors whose meshes need rebuilding."""
+        self._load_box(start, end)
+        return self.world.fill_region(start, end, block_id(texture))
+
+    def clear_region(self, start, end):
+        self._load_box(start, end)
+        return self.world.fill_region(start, end, 0)
+
+    def replace_region(self, start, end, old, new):
+        """Turn the blocks of texture old in the box into new; new may be
+           None to remove them."""
+        self._load_box(start, end)
+        return self.world.fill_region(start, end, block_id(new) if new is not None else 0,
+                                      replace=block_id(old))
+
+    @property
+    def version(self):
+        """Bumped on every block change, for caches of world queries."""
+        return self.world.version
+
+    def raycast(self, position, vector, max_distance=8):
+        return raycast(self.world, position, vector, max_distance)
+
+    def hit_test(self, position, vector, max_distance=8):
+        """The first block along the ray and the empty cell in front of the
+           face it was entered through (None if the ray starts inside it)."""
+        block, normal, _ = raycast(self.world, position, vector, max_distance)
+        if block is None:
+            return None, None
+        if not any(normal):
+            return block, None
+        return block, tuple(b + n for b, n in zip(block, normal))
+
+    def exposed(self, position):
+        return self.world.get_mask(position) != ALL_FACES